@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class DtuCommandQueueFullError(Exception):
+    pass
+
+
+class DtuCommandScheduler:
+    """
+    serialize the commands to the sub-devices behind a dtu, as they share one RS485 bus and
+    a sub-device drops the request overlapped with others.
+    each dtu has its own asyncio queue and worker task, so a dtu runs at most one command at a time,
+    with at least `min_frame_interval_ms` between the end of a command and the start of the next one,
+    while different dtus run in parallel.
+    a command is an async callable, normally publishes a frame and then awaits the reply (or its timeout),
+    so the bus is considered busy until the command returns.
+    """
+
+    def __init__(self,
+                 min_frame_interval_ms: int = 300,
+                 max_queued_command_count: int = 200,
+                 idle_worker_timeout_s: float = 60,
+                 logger: logging.Logger = None) -> None:
+        """
+        :param min_frame_interval_ms: the min spacing between 2 commands to the same dtu.
+        :param max_queued_command_count: the max number of commands waiting for a dtu, `submit` raises `DtuCommandQueueFullError` beyond it.
+        :param idle_worker_timeout_s: the worker task of a dtu exits once idle for this long, and is re-created on demand.
+        """
+        self.min_frame_interval_s = min_frame_interval_ms / 1000
+        self.max_queued_command_count = max_queued_command_count
+        self.idle_worker_timeout_s = idle_worker_timeout_s
+        self.logger = logger or logging.getLogger(
+            __class__.__name__+"Logger")
+        self._queues: dict[str, asyncio.Queue] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self._last_command_finished_time: dict[str, float] = {}
+
+    def submit(self, dtu_sn: str, command: Callable[[], Awaitable[T]]) -> "asyncio.Future[T]":
+        """
+        queue the command for the dtu, must be called in the event loop.
+        @return: the future of the command result, the caller may not await it if not interested in the result.
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(dtu_sn)
+        if queue is None:
+            queue = self._queues[dtu_sn] = asyncio.Queue(
+                maxsize=self.max_queued_command_count)
+        try:
+            queue.put_nowait((command, future))
+        except asyncio.QueueFull:
+            raise DtuCommandQueueFullError(
+                f"Too many commands waiting for DTU {dtu_sn}, max: {self.max_queued_command_count}")
+        worker = self._workers.get(dtu_sn)
+        if worker is None or worker.done():
+            self._workers[dtu_sn] = asyncio.create_task(
+                self._work(dtu_sn, queue))
+        return future
+
+    def queued_command_count(self, dtu_sn: str) -> int:
+        queue = self._queues.get(dtu_sn)
+        return queue.qsize() if queue else 0
+
+    async def _work(self, dtu_sn: str, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                command, future = await asyncio.wait_for(queue.get(), self.idle_worker_timeout_s)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    self._workers.pop(dtu_sn, None)
+                    self._queues.pop(dtu_sn, None)
+                    self._last_command_finished_time.pop(dtu_sn, None)
+                    return
+                continue
+            if future.done():
+                # the submitter gave up, like the http request was cancelled
+                continue
+            last_finished_time: Optional[float] = self._last_command_finished_time.get(
+                dtu_sn)
+            if last_finished_time is not None:
+                wait_s = last_finished_time + self.min_frame_interval_s - loop.time()
+                if wait_s > 0:
+                    await asyncio.sleep(wait_s)
+            # run the command in its own task, so the exception handed to the submitter
+            # doesn't carry the frame of this long living worker in its traceback
+            command_task = asyncio.ensure_future(command())
+            await asyncio.wait([command_task])
+            self._last_command_finished_time[dtu_sn] = loop.time()
+            if future.done():
+                if not command_task.cancelled():
+                    command_task.exception()
+                continue
+            if command_task.cancelled():
+                future.cancel()
+            elif command_task.exception() is not None:
+                future.set_exception(command_task.exception())
+            else:
+                future.set_result(command_task.result())
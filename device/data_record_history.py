@@ -0,0 +1,319 @@
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from threading import Lock
+from typing import Any, Iterable, Iterator, List, Optional
+
+from pydantic import GetCoreSchemaHandler
+from pydantic_core import core_schema, to_json
+
+DEFAULT_MAX_KEEP_DATA_RECORDS_COUNT = 300
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_epoch_ms(value: datetime) -> int:
+    """exact epoch ms of `value`, the naive one is taken as UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - _EPOCH) // timedelta(milliseconds=1)
+
+
+class DataRecordHistory:
+    """
+    bounded history of a device's data records, in the order of received, the oldest first.
+    it's a ring buffer, appending costs O(1) and the oldest record is evicted once exceeds the capacity.
+    a data record is a dict like: {"received_datetime": datetime, "data": dict}
+    it's serialized as a plain list of data records by pydantic.
+    """
+
+    def __init__(self, max_count: int = DEFAULT_MAX_KEEP_DATA_RECORDS_COUNT, records: Iterable[dict] = ()):
+        if max_count <= 0:
+            raise ValueError("max_count must be positive")
+        self._lock = Lock()
+        self._records: deque[dict] = deque(records, maxlen=max_count)
+
+    @property
+    def max_count(self) -> int:
+        return self._records.maxlen
+
+    def append(self, data_record: dict) -> None:
+        with self._lock:
+            self._records.append(data_record)
+
+    def latest(self, count: int = 1) -> List[dict]:
+        """the latest `count` records, the oldest first"""
+        if count <= 0:
+            return []
+        with self._lock:
+            result = list(islice(reversed(self._records), count))
+        result.reverse()
+        return result
+
+    def since(self, since_datetime: datetime) -> List[dict]:
+        """the records received at or after `since_datetime`, the oldest first"""
+        result = []
+        with self._lock:
+            for data_record in reversed(self._records):
+                if data_record["received_datetime"] < since_datetime:
+                    break
+                result.append(data_record)
+        result.reverse()
+        return result
+
+    def query(self,
+              since: Optional[datetime] = None,
+              before: Optional[datetime] = None,
+              limit: Optional[int] = None,
+              fields: Optional[Iterable[str]] = None) -> tuple[List[dict], bool]:
+        """
+        the latest `limit` records received in [`since`, `before`), the oldest first, with only the
+        `fields` kept in their `data`. the records received in the same ms as the oldest one are
+        all included even beyond `limit`, so a page never cuts them, which is what the ms cursor needs.
+        @return: the records, and True if older records in range were left out by `limit`.
+        """
+        since_epoch_ms = None if since is None else to_epoch_ms(since)
+        before_epoch_ms = None if before is None else to_epoch_ms(before)
+        fields = None if fields is None else set(fields)
+        result = []
+        truncated = False
+        oldest_epoch_ms = None
+        with self._lock:
+            for data_record in reversed(self._records):
+                received_epoch_ms = to_epoch_ms(
+                    data_record["received_datetime"])
+                if before_epoch_ms is not None and received_epoch_ms >= before_epoch_ms:
+                    continue
+                if since_epoch_ms is not None and received_epoch_ms < since_epoch_ms:
+                    break
+                if limit is not None and len(result) >= limit and received_epoch_ms != oldest_epoch_ms:
+                    truncated = True
+                    break
+                oldest_epoch_ms = received_epoch_ms
+                result.append(data_record)
+        result.reverse()
+        if fields is not None:
+            result = [{**data_record, "data": {name: value for name, value in data_record["data"].items() if name in fields}}
+                      for data_record in result]
+        return result, truncated
+
+    def to_list(self) -> List[dict]:
+        with self._lock:
+            return list(self._records)
+
+    def to_json(self) -> bytes:
+        """the JSON array of the records, same as the pydantic serialized one"""
+        return to_json(self.to_list())
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self.to_list())
+
+    def __getitem__(self, index: int) -> dict:
+        return self._records[index]
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(max_count={self.max_count}, count={len(self)})"
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source_type: Any, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        list_schema = handler.generate_schema(List[dict])
+        from_list_schema = core_schema.no_info_after_validator_function(
+            lambda records: DataRecordHistory(
+                max(DEFAULT_MAX_KEEP_DATA_RECORDS_COUNT, len(records)), records),
+            list_schema)
+        return core_schema.json_or_python_schema(
+            json_schema=from_list_schema,
+            python_schema=core_schema.union_schema(
+                [core_schema.is_instance_schema(DataRecordHistory), from_list_schema]),
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda history: history.to_list(), return_schema=list_schema),
+        )
+
+
+class DataRecordCodec(ABC):
+    """
+    convert the `data` of a data record to a row of typed column values and back,
+    used by `ColumnarDataRecordHistory` for storing records of a device type compactly.
+    """
+    # (column name, array typecode or None for python object column, values count per row)
+    columns: tuple[tuple[str, Optional[str], int], ...] = ()
+
+    @abstractmethod
+    def encode(self, data: dict) -> tuple:
+        """
+        @return: a value for each column, a tuple of `values count` values for the multi values column.
+        """
+        pass
+
+    @abstractmethod
+    def decode(self, row: tuple) -> dict:
+        """build back the `data` dict from the row produced by `encode`"""
+        pass
+
+    def decode_fields(self, row: tuple, fields: set[str]) -> dict:
+        """
+        build back only the `fields` of the `data` dict, override it for skipping the costly part of `decode`
+        when the fields could be read from the row directly.
+        """
+        return {name: value for name, value in self.decode(row).items() if name in fields}
+
+
+class ColumnarDataRecordHistory(DataRecordHistory):
+    """
+    bounded history which stores data records in preallocated typed columns rather than
+    a dict per record, the epoch ms of `received_datetime` is kept in its own column.
+    records are materialized to the dict shape only when read.
+    the JSON of a record is cached once encoded by `to_json`, until its slot is overwritten,
+    so encoding a history again costs only the records appended since.
+    """
+
+    def __init__(self, codec: DataRecordCodec, max_count: int = DEFAULT_MAX_KEEP_DATA_RECORDS_COUNT):
+        if max_count <= 0:
+            raise ValueError("max_count must be positive")
+        self._lock = Lock()
+        self._codec = codec
+        self._max_count = max_count
+        # index of the oldest record in columns
+        self._start = 0
+        self._count = 0
+        # the record appended as the n-th one is in slot n % max_count
+        self._appended_count = 0
+        self._encoded_records: list[Optional[bytes]] = [None] * max_count
+        self._received_epoch_ms = array('q', bytes(8 * max_count))
+        self._columns: list = []
+        for _, typecode, width in codec.columns:
+            if typecode is None:
+                self._columns.append([None] * (max_count * width))
+            else:
+                self._columns.append(
+                    array(typecode, bytes(array(typecode).itemsize * max_count * width)))
+
+    @property
+    def max_count(self) -> int:
+        return self._max_count
+
+    def append(self, data_record: dict) -> None:
+        row = self._codec.encode(data_record["data"])
+        received_epoch_ms = to_epoch_ms(data_record["received_datetime"])
+        with self._lock:
+            if self._count < self._max_count:
+                index = (self._start + self._count) % self._max_count
+                self._count += 1
+            else:
+                # overwrite the oldest
+                index = self._start
+                self._start = (self._start + 1) % self._max_count
+            self._appended_count += 1
+            self._encoded_records[index] = None
+            self._received_epoch_ms[index] = received_epoch_ms
+            for column, (_, _, width), value in zip(self._columns, self._codec.columns, row):
+                if width == 1:
+                    column[index] = value
+                elif isinstance(column, array):
+                    column[index * width:(index + 1) * width] = array(
+                        column.typecode, value)
+                else:
+                    column[index * width:(index + 1) * width] = value
+
+    def _read_row(self, index: int) -> tuple[int, tuple]:
+        row = []
+        for column, (_, _, width) in zip(self._columns, self._codec.columns):
+            row.append(column[index] if width == 1 else tuple(
+                column[index * width:(index + 1) * width]))
+        return self._received_epoch_ms[index], tuple(row)
+
+    def _materialize(self, received_epoch_ms: int, row: tuple, fields: Optional[set[str]] = None) -> dict:
+        return {"received_datetime": datetime.fromtimestamp(received_epoch_ms / 1000, timezone.utc),
+                "data": self._codec.decode(row) if fields is None else self._codec.decode_fields(row, fields)}
+
+    def _read_latest_rows(self, count: int, since_epoch_ms: Optional[int] = None) -> list[tuple[int, tuple]]:
+        """read rows from the newest, stop at `count` rows or at the row older than `since_epoch_ms`"""
+        rows = []
+        with self._lock:
+            for offset in range(min(count, self._count)):
+                index = (self._start + self._count - 1 -
+                         offset) % self._max_count
+                if since_epoch_ms is not None and self._received_epoch_ms[index] < since_epoch_ms:
+                    break
+                rows.append(self._read_row(index))
+        rows.reverse()
+        return rows
+
+    def latest(self, count: int = 1) -> List[dict]:
+        if count <= 0:
+            return []
+        return [self._materialize(*row) for row in self._read_latest_rows(count)]
+
+    def since(self, since_datetime: datetime) -> List[dict]:
+        return [self._materialize(*row) for row in self._read_latest_rows(
+            self._max_count, to_epoch_ms(since_datetime))]
+
+    def query(self,
+              since: Optional[datetime] = None,
+              before: Optional[datetime] = None,
+              limit: Optional[int] = None,
+              fields: Optional[Iterable[str]] = None) -> tuple[List[dict], bool]:
+        """filters on the ms column, only the rows in the page are materialized, and only their `fields`"""
+        since_epoch_ms = None if since is None else to_epoch_ms(since)
+        before_epoch_ms = None if before is None else to_epoch_ms(before)
+        fields = None if fields is None else set(fields)
+        rows = []
+        truncated = False
+        with self._lock:
+            for offset in range(self._count):
+                index = (self._start + self._count - 1 -
+                         offset) % self._max_count
+                received_epoch_ms = self._received_epoch_ms[index]
+                if before_epoch_ms is not None and received_epoch_ms >= before_epoch_ms:
+                    continue
+                if since_epoch_ms is not None and received_epoch_ms < since_epoch_ms:
+                    break
+                if limit is not None and len(rows) >= limit and received_epoch_ms != rows[-1][0]:
+                    truncated = True
+                    break
+                rows.append(self._read_row(index))
+        rows.reverse()
+        return [self._materialize(*row, fields) for row in rows], truncated
+
+    def to_list(self) -> List[dict]:
+        return self.latest(self._max_count)
+
+    def to_json(self) -> bytes:
+        encoded_records: list[Optional[bytes]] = []
+        # (position in encoded_records, slot index, the n-th appended, row)
+        rows_to_encode: list[tuple[int, int, int, tuple]] = []
+        with self._lock:
+            first_appended_count = self._appended_count - self._count
+            for offset in range(self._count):
+                index = (self._start + offset) % self._max_count
+                encoded_record = self._encoded_records[index]
+                if encoded_record is None:
+                    rows_to_encode.append(
+                        (offset, index, first_appended_count + offset, self._read_row(index)))
+                encoded_records.append(encoded_record)
+        # materialize and encode out of the lock, not to stall the ingest path
+        for position, _, _, row in rows_to_encode:
+            encoded_records[position] = to_json(self._materialize(*row))
+        with self._lock:
+            for position, index, appended_count, _ in rows_to_encode:
+                # not overwritten by the appends in the meantime
+                if self._appended_count <= appended_count + self._max_count:
+                    self._encoded_records[index] = encoded_records[position]
+        return b"[" + b",".join(encoded_records) + b"]"
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> dict:
+        with self._lock:
+            if index < 0:
+                index += self._count
+            if not 0 <= index < self._count:
+                raise IndexError("data record index out of range")
+            row = self._read_row((self._start + index) % self._max_count)
+        return self._materialize(*row)
@@ -0,0 +1,81 @@
+from threading import RLock
+from typing import Iterator, Optional
+
+from models import DEVICE_TYPE, DeviceDigitalTwin, DeviceIdentity
+
+
+class DeviceRegistry:
+    """
+    hash indexed store of device digital twins.
+    the primary index is keyed by `DeviceIdentity.identity_key()`, and the secondary indexes
+    by dtu_sn and device_type, so lookup of a device costs O(1) and filtered queries cost O(matches)
+    rather than walking the whole fleet.
+    the ingest path (MQTT client thread) and the http handlers access it concurrently, so all
+    access is guarded by a lock and queries return snapshot lists.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._devices_by_key: dict[tuple, DeviceDigitalTwin] = {}
+        self._devices_by_dtu_sn: dict[str, dict[tuple, DeviceDigitalTwin]] = {}
+        self._devices_by_device_type: dict[DEVICE_TYPE,
+                                           dict[tuple, DeviceDigitalTwin]] = {}
+
+    def get(self, device_identity: DeviceIdentity) -> Optional[DeviceDigitalTwin]:
+        return self._devices_by_key.get(device_identity.identity_key())
+
+    def add(self, device: DeviceDigitalTwin) -> None:
+        key = device.device_identity.identity_key()
+        with self._lock:
+            if key in self._devices_by_key:
+                raise ValueError(
+                    f"device with identity: {device.device_identity} already exists")
+            self._devices_by_key[key] = device
+            self._devices_by_dtu_sn.setdefault(
+                device.device_identity.dtu_sn, {})[key] = device
+            self._devices_by_device_type.setdefault(
+                device.device_identity.device_type, {})[key] = device
+
+    def get_or_add(self, device_identity: DeviceIdentity, create_device) -> tuple[DeviceDigitalTwin, bool]:
+        """
+        get the device by identity, or add the one built by `create_device()` if not existed.
+        @return: the device, and True if it was newly added.
+        """
+        device = self.get(device_identity)
+        if device is not None:
+            return device, False
+        with self._lock:
+            device = self.get(device_identity)
+            if device is not None:
+                return device, False
+            device = create_device()
+            self.add(device)
+            return device, True
+
+    def find(self,
+             dtu_sn: Optional[str] = None,
+             device_type: Optional[DEVICE_TYPE] = None,
+             device_physical_id: Optional[str] = None) -> list[DeviceDigitalTwin]:
+        """
+        query devices by the given filters, the None filter means not filtering on that field.
+        """
+        with self._lock:
+            candidates = self._devices_by_key
+            if dtu_sn is not None:
+                candidates = self._devices_by_dtu_sn.get(dtu_sn, {})
+            if device_type is not None:
+                by_device_type = self._devices_by_device_type.get(
+                    device_type, {})
+                if dtu_sn is None or len(by_device_type) < len(candidates):
+                    candidates = by_device_type
+            return [device for device in candidates.values()
+                    if (dtu_sn is None or device.device_identity.dtu_sn == dtu_sn)
+                    and (device_type is None or device.device_identity.device_type == device_type)
+                    and (device_physical_id is None or device.device_identity.device_physical_id == device_physical_id)]
+
+    def __len__(self) -> int:
+        return len(self._devices_by_key)
+
+    def __iter__(self) -> Iterator[DeviceDigitalTwin]:
+        with self._lock:
+            return iter(list(self._devices_by_key.values()))
@@ -0,0 +1,156 @@
+import logging
+import queue
+import threading
+from enum import Enum
+from typing import Callable
+from paho.mqtt.client import PayloadType
+
+
+class BACKPRESSURE_POLICY(str, Enum):
+    # discard the oldest queued msg to make room for the new one
+    DropOldest = "drop_oldest"
+    # block the MQTT client thread until there's room
+    Block = "block"
+    # discard the new msg
+    DropNew = "drop_new"
+
+
+class IngestPipeline:
+    """
+    hand msgs over from the MQTT client(network) thread to a pool of worker threads via bounded queues.
+    each worker owns a queue, and msgs from the same topic always go to the same worker,
+    so msgs from one dtu are handled in the order of received.
+    with a `batch_handler`, a worker drains up to `max_batch_size` queued msgs at a time and hands
+    them over in one call, so the per msg cost of parsing is amortized when msgs pile up, like a
+    reconnecting fleet floods the broker, while a msg arriving alone is still handled at once.
+    """
+
+    def __init__(self,
+                 handler: Callable[[str, PayloadType], None],
+                 worker_count: int = 4,
+                 batch_handler: Callable[[list[tuple[str, PayloadType]]], None] = None,
+                 max_batch_size: int = 1,
+                 max_queued_msg_count: int = 10000,
+                 backpressure_policy: BACKPRESSURE_POLICY = BACKPRESSURE_POLICY.DropOldest,
+                 name: str = "IngestPipeline",
+                 logger: logging.Logger = None) -> None:
+        """
+        :param handler: handles a msg in worker thread, should accept two parameters: topic and payload.
+        :param worker_count: the number of worker threads.
+        :param batch_handler: handles a batch of msgs in worker thread, accepts a list of (topic, payload), used instead of `handler` once set.
+        :param max_batch_size: the max number of msgs handed to `batch_handler` in one call.
+        :param max_queued_msg_count: the max number of msgs waiting in queues, shared evenly by the workers.
+        :param backpressure_policy: what to do with a new msg when the queue of its worker is full.
+        """
+        if worker_count <= 0:
+            raise ValueError("worker_count must be positive")
+        if max_queued_msg_count < worker_count:
+            raise ValueError(
+                "max_queued_msg_count must not be less than worker_count")
+        if max_batch_size <= 0:
+            raise ValueError("max_batch_size must be positive")
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self.logger = logger or logging.getLogger(
+            __class__.__name__+"Logger")
+        self.backpressure_policy = BACKPRESSURE_POLICY(backpressure_policy)
+        self._queues: list[queue.Queue] = [queue.Queue(
+            maxsize=max_queued_msg_count // worker_count) for _ in range(worker_count)]
+        self._workers: list[threading.Thread] = []
+        self.dropped_msg_count = 0
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        for i, msg_queue in enumerate(self._queues):
+            worker = threading.Thread(
+                target=self._work, args=(msg_queue,), name=f"{self.name}-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout: float = 5) -> None:
+        """stop the workers after the queued msgs are handled"""
+        for msg_queue in self._queues:
+            msg_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def submit(self, topic: str, payload: PayloadType) -> bool:
+        """
+        queue a msg for handling, called from the MQTT client thread.
+        @return: False if the new msg was dropped.
+        """
+        msg_queue = self._queues[hash(topic) % len(self._queues)]
+        item = (topic, payload)
+        if self.backpressure_policy == BACKPRESSURE_POLICY.Block:
+            msg_queue.put(item)
+            return True
+        while True:
+            try:
+                msg_queue.put_nowait(item)
+                return True
+            except queue.Full:
+                if self.backpressure_policy == BACKPRESSURE_POLICY.DropNew:
+                    self._on_dropped(topic)
+                    return False
+            try:
+                dropped_item = msg_queue.get_nowait()
+            except queue.Empty:
+                continue
+            if dropped_item is None:
+                # the stop signal queued by `stop`, keep it for the worker, the new msg would not be handled anyway
+                msg_queue.put_nowait(None)
+                self._on_dropped(topic)
+                return False
+            self._on_dropped(dropped_item[0])
+
+    def queued_msg_count(self) -> int:
+        return sum(msg_queue.qsize() for msg_queue in self._queues)
+
+    def _on_dropped(self, topic: str) -> None:
+        self.dropped_msg_count += 1
+        if self.dropped_msg_count % 1000 == 1:
+            self.logger.warning(
+                "%s - queue is full, dropped msg from topic %s with policy %s, total dropped: %d",
+                self.name, topic, self.backpressure_policy.value, self.dropped_msg_count)
+
+    def _work(self, msg_queue: queue.Queue) -> None:
+        if self.batch_handler is not None:
+            self._work_in_batch(msg_queue)
+            return
+        while True:
+            item = msg_queue.get()
+            if item is None:
+                return
+            topic, payload = item
+            try:
+                self.handler(topic, payload)
+            except Exception as e:
+                self.logger.exception(
+                    "%s - Failed to handle message: %s from topic %s", self.name, e, topic)
+
+    def _work_in_batch(self, msg_queue: queue.Queue) -> None:
+        stopping = False
+        while not stopping:
+            # wait for the first msg, then take what's already queued without waiting
+            item = msg_queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = msg_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self.batch_handler(batch)
+            except Exception as e:
+                self.logger.exception(
+                    "%s - Failed to handle a batch of %d messages: %s", self.name, len(batch), e)
@@ -0,0 +1,91 @@
+from threading import Lock
+from typing import List, Optional
+
+from pydantic import TypeAdapter
+
+from models import DeviceDigitalTwin, DeviceState
+
+
+class LatestStateTable:
+    """
+    the latest state of each device, grouped by dtu_sn, updated by the ingest path on each parsed data record.
+    the states of a dtu are encoded to JSON once and the bytes are cached until a device of that dtu is updated,
+    so polling the current state of a dtu, or of the whole fleet, costs a dict lookup rather than encoding models.
+    """
+
+    _states_adapter = TypeAdapter(List[DeviceState])
+
+    def __init__(self):
+        self._lock = Lock()
+        self._states_by_dtu_sn: dict[str, dict[tuple, DeviceState]] = {}
+        # bumped on each update, an encoding started before an update is not cached
+        self._versions_by_dtu_sn: dict[str, int] = {}
+        self._encoded_states_by_dtu_sn: dict[str, bytes] = {}
+        self._encoded_fleet_states: Optional[bytes] = None
+        self._fleet_version = 0
+
+    def update(self, device: DeviceDigitalTwin, data_record: Optional[dict] = None) -> None:
+        """refresh the state of the device, with `data_record` as the latest one, or keep the previous one if None"""
+        dtu_sn = device.device_identity.dtu_sn
+        key = device.device_identity.identity_key()
+        with self._lock:
+            if data_record is None:
+                previous_state = self._states_by_dtu_sn.get(dtu_sn, {}).get(key)
+                data_record = None if previous_state is None else previous_state.latest_data_record
+            # built from the validated fields, so skip the validation on the ingest path
+            self._states_by_dtu_sn.setdefault(dtu_sn, {})[key] = DeviceState.model_construct(
+                device_identity=device.device_identity,
+                last_device_msg_received_datetime=device.last_device_msg_received_datetime,
+                checksum_error_count=device.checksum_error_count,
+                latest_data_record=data_record)
+            self._versions_by_dtu_sn[dtu_sn] = self._versions_by_dtu_sn.get(
+                dtu_sn, 0) + 1
+            self._encoded_states_by_dtu_sn.pop(dtu_sn, None)
+            self._fleet_version += 1
+            self._encoded_fleet_states = None
+
+    def get(self, dtu_sn: Optional[str] = None) -> list[DeviceState]:
+        """the states of the devices of `dtu_sn`, or of all devices if None"""
+        with self._lock:
+            if dtu_sn is None:
+                return [state for states in self._states_by_dtu_sn.values() for state in states.values()]
+            return list(self._states_by_dtu_sn.get(dtu_sn, {}).values())
+
+    def get_json(self, dtu_sn: Optional[str] = None) -> bytes:
+        """the JSON array of `get(dtu_sn)`, served from the cache if the states are not changed since last call"""
+        if dtu_sn is None:
+            return self._get_fleet_json()
+        with self._lock:
+            encoded_states = self._encoded_states_by_dtu_sn.get(dtu_sn)
+            if encoded_states is not None:
+                return encoded_states
+            if dtu_sn not in self._states_by_dtu_sn:
+                return b"[]"
+            version = self._versions_by_dtu_sn[dtu_sn]
+            states = list(self._states_by_dtu_sn[dtu_sn].values())
+        # encode out of the lock, not to stall the ingest path
+        encoded_states = self._states_adapter.dump_json(states)
+        with self._lock:
+            if self._versions_by_dtu_sn[dtu_sn] == version:
+                self._encoded_states_by_dtu_sn[dtu_sn] = encoded_states
+        return encoded_states
+
+    def _get_fleet_json(self) -> bytes:
+        with self._lock:
+            if self._encoded_fleet_states is not None:
+                return self._encoded_fleet_states
+            version = self._fleet_version
+            dtu_sns = list(self._states_by_dtu_sn)
+        # joined from the cached arrays of the dtus, so only the changed dtus are encoded again
+        encoded_states_list = [self.get_json(dtu_sn)[1:-1]
+                               for dtu_sn in dtu_sns]
+        encoded_fleet_states = b"[" + b",".join(
+            encoded_states for encoded_states in encoded_states_list if encoded_states) + b"]"
+        with self._lock:
+            if self._fleet_version == version:
+                self._encoded_fleet_states = encoded_fleet_states
+        return encoded_fleet_states
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(states) for states in self._states_by_dtu_sn.values())
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, Iterable
+
+from models import DEVICE_TYPE, REQUEST_ACTION, DeviceIdentity, DeviceRequest
+from device.protocol_parser.parser import DeviceProtocolParser
+
+
+class ProbePollingEngine:
+    """
+    periodically sweep the configured probes with the read request, as the probes only report when asked.
+    the read frame of each probe id is built once, the polls of a cycle are spread evenly over
+    the interval with jitter, interleaved across dtus, and a probe not answering for `max_missed_cycles`
+    cycles is skipped, except for every `revive_every_cycles` cycle, to give it a chance to come back.
+    a poll is skipped as well while its dtu is still busy with the commands queued before, as a dtu
+    with many probes timing out could not sweep them all in one interval, and would pile up the polls.
+    """
+
+    def __init__(self,
+                 parser: DeviceProtocolParser,
+                 send_frame: Callable[[str, str, bytes], Awaitable[None]],
+                 targets: dict[str, Iterable[int]],
+                 interval_s: float = 60,
+                 jitter_ratio: float = 0.2,
+                 max_missed_cycles: int = 3,
+                 revive_every_cycles: int = 10,
+                 device_type: DEVICE_TYPE = DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck,
+                 is_dtu_busy: Callable[[str], bool] = None,
+                 logger: logging.Logger = None) -> None:
+        """
+        :param parser: serializes the read request frame.
+        :param send_frame: sends the frame to a probe, accepts dtu_sn, probe physical id and the frame, should not wait for the reply.
+        :param targets: the probe ids(1-99) to poll of each dtu_sn.
+        :param interval_s: the interval of polling a probe.
+        :param jitter_ratio: the random jitter of the spacing between 2 polls, as the ratio of the spacing.
+        :param max_missed_cycles: skip the probe once it has not answered for this many cycles.
+        :param revive_every_cycles: poll the skipped probes in every this many cycles.
+        :param is_dtu_busy: accepts dtu_sn, returns whether the dtu still has commands waiting, the poll is skipped then.
+        """
+        self.send_frame = send_frame
+        self.interval_s = interval_s
+        self.jitter_ratio = jitter_ratio
+        self.max_missed_cycles = max_missed_cycles
+        self.revive_every_cycles = revive_every_cycles
+        self.device_type = device_type
+        self.is_dtu_busy = is_dtu_busy
+        self.logger = logger or logging.getLogger(
+            __class__.__name__+"Logger")
+
+        # interleave the dtus, so the polls to a dtu are spread over the interval as well
+        probe_ids_by_dtu_sn = {dtu_sn: sorted(set(probe_ids))
+                               for dtu_sn, probe_ids in targets.items()}
+        for dtu_sn, probe_ids in probe_ids_by_dtu_sn.items():
+            if any(probe_id < 1 or probe_id > 99 for probe_id in probe_ids):
+                raise ValueError(
+                    f"probe id must be in 1-99, but got: {probe_ids} for DTU {dtu_sn}")
+        self.targets: list[tuple[str, str]] = [
+            (dtu_sn, str(probe_ids[i]))
+            for i in range(max((len(ids) for ids in probe_ids_by_dtu_sn.values()), default=0))
+            for dtu_sn, probe_ids in probe_ids_by_dtu_sn.items() if i < len(probe_ids)]
+
+        # the frame doesn't vary with dtu, so build once for each probe id
+        self.frames: dict[str, bytes] = {}
+        for _, probe_id in self.targets:
+            if probe_id not in self.frames:
+                self.frames[probe_id] = parser.Serialize(DeviceRequest(
+                    device_identity=DeviceIdentity(
+                        name="", dtu_sn="", device_type=device_type, device_physical_id=probe_id),
+                    request_action=REQUEST_ACTION.Read))
+
+        self.cycle = 0
+        # (dtu_sn, probe id) -> the cycle of last answered
+        self._last_answered_cycle: dict[tuple[str, str], int] = {}
+        self._task: asyncio.Task = None
+
+    def on_reading(self, device_identity: DeviceIdentity) -> None:
+        """called from the ingest path once a reading from a probe is parsed"""
+        if device_identity.device_type != self.device_type:
+            return
+        self._last_answered_cycle[(device_identity.dtu_sn,
+                                   device_identity.device_physical_id)] = self.cycle
+
+    def missed_cycles(self, dtu_sn: str, probe_id: str) -> int:
+        """the number of finished cycles since the probe answered last time"""
+        return self.cycle - 1 - self._last_answered_cycle.get((dtu_sn, probe_id), -1)
+
+    def should_poll(self, dtu_sn: str, probe_id: str) -> bool:
+        return self.missed_cycles(dtu_sn, probe_id) < self.max_missed_cycles \
+            or self.cycle % self.revive_every_cycles == 0
+
+    def start(self) -> None:
+        """must be called in the event loop"""
+        if self._task is None and self.targets:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            cycle_start_time = loop.time()
+            await self.run_cycle()
+            self.cycle += 1
+            await asyncio.sleep(max(0, cycle_start_time + self.interval_s - loop.time()))
+
+    async def run_cycle(self) -> int:
+        """
+        poll the probes once, spread over the interval.
+        @return: the number of polled probes, not including the ones skipped as their dtu was busy.
+        """
+        loop = asyncio.get_running_loop()
+        targets = [(dtu_sn, probe_id) for dtu_sn, probe_id in self.targets
+                   if self.should_poll(dtu_sn, probe_id)]
+        if not targets:
+            return 0
+        spacing_s = self.interval_s / len(targets)
+        next_send_time = loop.time()
+        busy_skipped_count = 0
+        for dtu_sn, probe_id in targets:
+            delay_s = next_send_time - loop.time()
+            if delay_s > 0:
+                await asyncio.sleep(delay_s)
+            next_send_time += spacing_s * \
+                (1 + random.uniform(-self.jitter_ratio, self.jitter_ratio))
+            if self.is_dtu_busy is not None and self.is_dtu_busy(dtu_sn):
+                busy_skipped_count += 1
+                continue
+            try:
+                await self.send_frame(dtu_sn, probe_id, self.frames[probe_id])
+            except Exception as e:
+                self.logger.error(
+                    "Failed to poll probe %s of DTU %s: %s", probe_id, dtu_sn, e)
+        if busy_skipped_count:
+            self.logger.warning("Skipped %d polls in cycle %d, as their DTUs were still busy",
+                                busy_skipped_count, self.cycle)
+        self.logger.debug("Polled %d of %d probes in cycle %d",
+                          len(targets) - busy_skipped_count, len(self.targets), self.cycle)
+        return len(targets) - busy_skipped_count
@@ -0,0 +1,136 @@
+import time
+from threading import Lock
+from typing import Callable
+
+from device.protocol_parser.frame_spec import FrameSpec
+
+
+class _StreamBuffer:
+    __slots__ = ("data", "last_fed_time")
+
+    def __init__(self, data: bytes, last_fed_time: float) -> None:
+        self.data = data
+        self.last_fed_time = last_fed_time
+
+
+class FrameReassembler:
+    """
+    rebuild the frames of a serial protocol from the byte stream forwarded by dtus, as a dtu cuts
+    the stream into MQTT msgs by its own timing, a frame could be split across msgs, or several
+    frames merged into one msg.
+    each topic(a dtu) has a buffer of the bytes not forming a frame yet, which is dropped once
+    not fed for `window_ms`, so a lost fragment won't corrupt the later frames. the buffer is scanned
+    for the start bytes, and a frame is emitted only if its length, end bytes and checksum are all valid,
+    otherwise the scan resyncs from the next start bytes.
+    """
+
+    def __init__(self,
+                 frame_spec: FrameSpec,
+                 window_ms: int = 500,
+                 max_buffered_byte_count: int = 1024,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        :param frame_spec: the spec of the frames to rebuild, must have a checksum, otherwise random bytes could be taken as a frame.
+        :param window_ms: the buffered bytes are dropped once the topic has not been fed for this long.
+        :param max_buffered_byte_count: the max bytes buffered for a topic, the oldest bytes are dropped beyond it.
+        """
+        if frame_spec.checksum is None:
+            raise ValueError(
+                f"the frame spec {frame_spec.name} must have a checksum for reassembling")
+        self.frame_spec = frame_spec
+        self.window_s = window_ms / 1000
+        self.max_buffered_byte_count = max_buffered_byte_count
+        self.clock = clock
+        self._lock = Lock()
+        self._buffers: dict[str, _StreamBuffer] = {}
+        self._last_sweep_time = clock()
+        self.reassembled_frame_count = 0
+        self.discarded_byte_count = 0
+
+    def feed(self, topic: str, payload: bytes) -> list[bytes]:
+        """
+        append the payload to the buffer of the topic.
+        @return: the complete frames found, in the order of received.
+        """
+        now = self.clock()
+        with self._lock:
+            if now - self._last_sweep_time > self.window_s * 10:
+                self._sweep(now)
+            buffer = self._buffers.get(topic)
+            if buffer is not None and now - buffer.last_fed_time <= self.window_s:
+                data = buffer.data + payload
+            else:
+                if buffer is not None:
+                    self.discarded_byte_count += len(buffer.data)
+                data = bytes(payload)
+            frames, rest = self._extract_frames(data)
+            if len(rest) > self.max_buffered_byte_count:
+                self.discarded_byte_count += len(rest) - \
+                    self.max_buffered_byte_count
+                rest = rest[-self.max_buffered_byte_count:]
+            if rest:
+                self._buffers[topic] = _StreamBuffer(rest, now)
+            else:
+                self._buffers.pop(topic, None)
+            self.reassembled_frame_count += len(frames)
+        return frames
+
+    def buffered_byte_count(self, topic: str) -> int:
+        buffer = self._buffers.get(topic)
+        return len(buffer.data) if buffer else 0
+
+    def _extract_frames(self, data: bytes) -> tuple[list[bytes], bytes]:
+        """@return: the complete frames, and the bytes may be the head of a frame"""
+        frames = []
+        start = self.frame_spec.start
+        index = data.find(start)
+        if index < 0:
+            self.discarded_byte_count += len(data)
+            return frames, b""
+        self.discarded_byte_count += index
+        while index >= 0:
+            frame_length = self.frame_spec.frame_length(
+                memoryview(data)[index:])
+            if frame_length is None or index + frame_length > len(data):
+                # wait for the rest of the frame, unless the start bytes turn out to be part of
+                # others, as a complete frame follows
+                next_index = self._find_complete_frame(data, index + 1)
+                if next_index < 0:
+                    return frames, data[index:]
+                self.discarded_byte_count += next_index - index
+                index = next_index
+                continue
+            frame = data[index:index + frame_length]
+            if self._is_frame(frame):
+                frames.append(frame)
+                next_index = data.find(start, index + frame_length)
+                self.discarded_byte_count += (
+                    next_index if next_index >= 0 else len(data)) - index - frame_length
+            else:
+                # not a frame, the start bytes are part of others
+                next_index = data.find(start, index + 1)
+                self.discarded_byte_count += (
+                    next_index if next_index >= 0 else len(data)) - index
+            index = next_index
+        return frames, b""
+
+    def _is_frame(self, frame: bytes) -> bool:
+        return self.frame_spec.matches(frame) and self.frame_spec.verify_checksum(frame)
+
+    def _find_complete_frame(self, data: bytes, from_index: int) -> int:
+        """@return: the index of the first complete frame at or after `from_index`, -1 if none"""
+        index = data.find(self.frame_spec.start, from_index)
+        while index >= 0:
+            frame_length = self.frame_spec.frame_length(
+                memoryview(data)[index:])
+            if frame_length is not None and index + frame_length <= len(data) \
+                    and self._is_frame(data[index:index + frame_length]):
+                return index
+            index = data.find(self.frame_spec.start, index + 1)
+        return -1
+
+    def _sweep(self, now: float) -> None:
+        for topic in [topic for topic, buffer in self._buffers.items()
+                      if now - buffer.last_fed_time > self.window_s]:
+            self.discarded_byte_count += len(self._buffers.pop(topic).data)
+        self._last_sweep_time = now
@@ -0,0 +1,294 @@
+import struct
+from enum import Enum
+from typing import Callable, NamedTuple, Optional, Union
+
+# the value(0-99) of each packed BCD byte, as the table of bytes.translate, which converts a whole
+# buffer of BCD bytes to their values in C. an invalid nibble is kept as is, e.g. 0x1F -> 25,
+# same as `DeviceProtocolParser.bcd_to_int`.
+BCD_BYTE_VALUES = bytes((byte >> 4) * 10 + (byte & 0xF) for byte in range(256))
+
+
+class FIELD_TYPE(str, Enum):
+    # big-endian unsigned integer
+    UInt = "uint"
+    # big-endian two's complement integer
+    Int = "int"
+    # packed BCD, 2 decimal digits per byte, the most significant first
+    Bcd = "bcd"
+    # big-endian IEEE 754, 4 or 8 bytes
+    Float = "float"
+    # skipped when decoding, filled with zeros when encoding
+    Reserved = "reserved"
+
+
+class CHECKSUM_ALGORITHM(str, Enum):
+    # the low byte of the sum of the covered bytes
+    Sum8 = "sum8"
+    # the decimal sum of the covered BCD bytes, the low 2 digits in BCD, a.k.a. 十进制加和
+    BcdSum = "bcd_sum"
+    # xor of the covered bytes
+    Xor8 = "xor8"
+
+
+class FieldSpec(NamedTuple):
+    name: str
+    field_type: FIELD_TYPE = FIELD_TYPE.UInt
+    byte_count: int = 1
+    # the decoded value is raw / divisor + offset, e.g. the temperature reported as (℃ + 80) × 10
+    divisor: float = 1
+    offset: float = 0
+    # the value the field always carries, a frame with other value is not of this spec,
+    # and it's used when encoding, so the caller doesn't have to provide it
+    fixed_value: Optional[int] = None
+
+
+class RepeatedFieldSpec(NamedTuple):
+    """a field repeated by the value of a preceding 1 byte count field, like the temperature points"""
+    name: str
+    count_field: str
+    item: FieldSpec
+    # when set, the items are decoded into a dict keyed by the key of the item index,
+    # otherwise into a list
+    item_key: Optional[Callable[[int], str]] = None
+
+
+class ChecksumSpec(NamedTuple):
+    algorithm: CHECKSUM_ALGORITHM
+    # the checksum byte is right before the end bytes, and covers the bytes from
+    # `first_offset` of the frame to it, by default all the bytes after the start bytes
+    first_offset: Optional[int] = None
+
+
+def compute_checksum(algorithm: CHECKSUM_ALGORITHM, covered_bytes: bytes) -> int:
+    if algorithm == CHECKSUM_ALGORITHM.Sum8:
+        return sum(covered_bytes) & 0xFF
+    if algorithm == CHECKSUM_ALGORITHM.BcdSum:
+        decimal_sum = sum(covered_bytes.translate(BCD_BYTE_VALUES)) % 100
+        return (decimal_sum // 10) << 4 | decimal_sum % 10
+    if algorithm == CHECKSUM_ALGORITHM.Xor8:
+        result = 0
+        for byte in covered_bytes:
+            result ^= byte
+        return result
+    raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+
+
+_FLOAT_STRUCTS = {4: struct.Struct(">f"), 8: struct.Struct(">d")}
+
+
+class FrameSpec:
+    """
+    declarative description of a binary frame: start bytes, fields, an optional repeated field,
+    an optional 1 byte checksum and end bytes, the frame length follows from the fields, e.g.
+    the fixed part plus the item size times the repeat count.
+    the spec is compiled once on construction: the decoder is generated as a straight-line function
+    reading every field out of the frame by index (same way as `collections.namedtuple` generates
+    its class), so decoding a frame costs no loop, slice or per field dispatch.
+    """
+
+    def __init__(self,
+                 name: str,
+                 start: bytes,
+                 end: bytes,
+                 fields: tuple[Union[FieldSpec, RepeatedFieldSpec], ...],
+                 checksum: Optional[ChecksumSpec] = None) -> None:
+        self.name = name
+        self.start = start
+        self.end = end
+        self.fields = fields
+        self.checksum = checksum
+
+        repeated_fields = [field for field in fields
+                           if isinstance(field, RepeatedFieldSpec)]
+        if len(repeated_fields) > 1:
+            raise ValueError(
+                f"{name}: at most 1 repeated field is supported")
+        self.repeated_field: Optional[RepeatedFieldSpec] = repeated_fields[0] if repeated_fields else None
+        # offset of the fixed fields before the repeated one, the ones after are relative to its end
+        self._field_offsets: dict[str, int] = {}
+        self._fields_after_repeated: set[str] = set()
+        self._count_field: Optional[FieldSpec] = None
+        self._repeated_offset = 0
+        self._item_keys: list[str] = []
+        offset = len(start)
+        for field in fields:
+            if isinstance(field, RepeatedFieldSpec):
+                count_field = next((f for f in fields if isinstance(f, FieldSpec) and f.name == field.count_field
+                                    and f.name in self._field_offsets), None)
+                if count_field is None or count_field.byte_count != 1 \
+                        or count_field.field_type not in (FIELD_TYPE.UInt, FIELD_TYPE.Bcd) \
+                        or count_field.divisor != 1 or count_field.offset != 0:
+                    raise ValueError(
+                        f"{name}: the count field of {field.name} must be a preceding 1 byte UInt or Bcd field")
+                self._repeated_offset = offset
+                self._count_field = count_field
+                if field.item_key:
+                    # the count is a byte, so precompute the keys of all the possible indexes
+                    self._item_keys = [field.item_key(i) for i in range(256)]
+                offset = 0
+                continue
+            if self._count_field is not None:
+                self._fields_after_repeated.add(field.name)
+            if field.fixed_value is not None and (field.divisor != 1 or field.offset != 0):
+                raise ValueError(
+                    f"{name}: the field {field.name} with fixed value must not have divisor or offset")
+            if field.field_type == FIELD_TYPE.Float and field.byte_count not in _FLOAT_STRUCTS:
+                raise ValueError(
+                    f"{name}: the float field {field.name} must be 4 or 8 bytes")
+            self._field_offsets[field.name] = offset
+            offset += field.byte_count
+        # the length of the frame without repeated items
+        self.fixed_length = len(start) + sum(
+            field.byte_count for field in fields if isinstance(field, FieldSpec)) + \
+            (1 if checksum else 0) + len(end)
+        self.checksum_first_offset = len(start) if checksum is None or checksum.first_offset is None \
+            else checksum.first_offset
+
+        self._decode_fields = self._compile_decoder()
+
+    def frame_length(self, frame: bytes) -> Optional[int]:
+        """the length the frame should have by its count field, None if it's too short to tell"""
+        if self.repeated_field is None:
+            return self.fixed_length
+        count_offset = self._field_offsets[self._count_field.name]
+        if len(frame) <= count_offset:
+            return None
+        count = frame[count_offset]
+        if self._count_field.field_type == FIELD_TYPE.Bcd:
+            count = BCD_BYTE_VALUES[count]
+        return self.fixed_length + count * self.repeated_field.item.byte_count
+
+    def matches(self, frame: bytes) -> bool:
+        """check the start bytes, end bytes and the length, the fields are not checked"""
+        frame_length = len(frame)
+        return frame_length >= self.fixed_length and frame[:len(self.start)] == self.start \
+            and frame[frame_length - len(self.end):] == self.end and frame_length == self.frame_length(frame)
+
+    def verify_checksum(self, frame: bytes) -> bool:
+        if self.checksum is None:
+            return True
+        checksum_offset = len(frame) - len(self.end) - 1
+        return compute_checksum(self.checksum.algorithm,
+                                bytes(frame[self.checksum_first_offset:checksum_offset])) == frame[checksum_offset]
+
+    def decode(self, frame: Union[bytes, memoryview]) -> Optional[dict]:
+        """
+        @return: the field values, the Reserved fields are not included, or None if the frame is not of this spec,
+            like the length or a fixed value doesn't match.
+        """
+        if not self.matches(frame):
+            return None
+        return self._decode_fields(frame)
+
+    def decode_matched(self, frame: Union[bytes, memoryview]) -> Optional[dict]:
+        """decode the frame already checked by `matches`, None if a fixed value doesn't match"""
+        return self._decode_fields(frame)
+
+    def encode(self, values: dict) -> bytes:
+        """
+        build a frame from the field values, the fields with `fixed_value` could be absent,
+        the repeated field takes a list, or a dict if it has `item_key`, and the count field is derived from it.
+        """
+        frame = bytearray(self.start)
+        for field in self.fields:
+            if isinstance(field, RepeatedFieldSpec):
+                items = values[field.name]
+                for item in (items.values() if isinstance(items, dict) else items):
+                    frame += self._encode_value(field.item, item)
+                continue
+            if field.fixed_value is not None:
+                value = field.fixed_value
+            elif self.repeated_field is not None and field is self._count_field and field.name not in values:
+                value = len(values[self.repeated_field.name])
+            elif field.field_type == FIELD_TYPE.Reserved:
+                value = 0
+            else:
+                value = values[field.name]
+            frame += self._encode_value(field, value)
+        if self.checksum is not None:
+            frame.append(compute_checksum(self.checksum.algorithm,
+                                          bytes(frame[self.checksum_first_offset:])))
+        frame += self.end
+        return bytes(frame)
+
+    @staticmethod
+    def _encode_value(field: FieldSpec, value) -> bytes:
+        if field.field_type == FIELD_TYPE.Reserved:
+            return bytes(field.byte_count)
+        if field.divisor != 1 or field.offset != 0:
+            value = (value - field.offset) * field.divisor
+        if field.field_type == FIELD_TYPE.Float:
+            return _FLOAT_STRUCTS[field.byte_count].pack(value)
+        value = round(value)
+        if field.field_type == FIELD_TYPE.Bcd:
+            if value < 0 or value >= 100 ** field.byte_count:
+                raise ValueError(
+                    f"{field.name}: {value} can't be encoded in {field.byte_count} BCD bytes")
+            digits = str(value).zfill(2 * field.byte_count)
+            return bytes(int(digits[i]) << 4 | int(digits[i + 1]) for i in range(0, len(digits), 2))
+        return value.to_bytes(field.byte_count, 'big', signed=field.field_type == FIELD_TYPE.Int)
+
+    def _compile_decoder(self) -> Callable[[bytes], Optional[dict]]:
+        namespace = {"T": BCD_BYTE_VALUES, "K": self._item_keys}
+        lines = ["def decode(f):"]
+        variables: list[tuple[str, str]] = []
+        variable_by_name: dict[str, str] = {}
+        # the offset base of the fields after the repeated one
+        base = ""
+
+        def read_expression(field: FieldSpec, offset: int, dynamic_offset: str = "") -> str:
+            """`dynamic_offset` is the expression added to the offset, like 'b + '"""
+            if field.field_type == FIELD_TYPE.Float:
+                namespace[f"unpack_{field.byte_count}"] = _FLOAT_STRUCTS[field.byte_count].unpack_from
+                expression = f"unpack_{field.byte_count}(f, {dynamic_offset}{offset})[0]"
+            elif field.field_type == FIELD_TYPE.Bcd:
+                expression = " + ".join(
+                    f"T[f[{dynamic_offset}{offset + k}]]" + (f" * {100 ** (field.byte_count - 1 - k)}" if k < field.byte_count - 1 else "")
+                    for k in range(field.byte_count))
+            else:
+                expression = " | ".join(
+                    f"f[{dynamic_offset}{offset + k}]" + (f" << {8 * (field.byte_count - 1 - k)}" if k < field.byte_count - 1 else "")
+                    for k in range(field.byte_count))
+                if field.field_type == FIELD_TYPE.Int:
+                    sign_bit = 1 << (8 * field.byte_count - 1)
+                    expression = f"(({expression}) ^ {sign_bit}) - {sign_bit}"
+            if field.divisor != 1:
+                expression = f"({expression})/{field.divisor!r}"
+            if field.offset > 0:
+                expression = f"{expression} + {field.offset!r}"
+            elif field.offset < 0:
+                expression = f"{expression} - {-field.offset!r}"
+            return expression
+
+        for field in self.fields:
+            variable = f"v{len(variables)}"
+            if isinstance(field, RepeatedFieldSpec):
+                count_variable = variable_by_name[field.count_field]
+                item_expression = read_expression(
+                    field.item, self._repeated_offset, f"{field.item.byte_count} * i + ")
+                if field.item_key:
+                    expression = f"{{K[i]: {item_expression} for i in range({count_variable})}}"
+                else:
+                    expression = f"[{item_expression} for i in range({count_variable})]"
+                lines.append(f"    {variable} = {expression}")
+                lines.append(
+                    f"    b = {self._repeated_offset} + {field.item.byte_count} * {count_variable}")
+                base = "b + "
+            elif field.field_type == FIELD_TYPE.Reserved:
+                continue
+            else:
+                lines.append(
+                    f"    {variable} = {read_expression(field, self._field_offsets[field.name], base)}")
+                if field.fixed_value is not None:
+                    lines.append(
+                        f"    if {variable} != {field.fixed_value!r}:\n        return None")
+            variables.append((field.name, variable))
+            variable_by_name[field.name] = variable
+        for i, (name, _) in enumerate(variables):
+            namespace[f"N{i}"] = name
+        lines.append("    return {" + ", ".join(
+            f"N{i}: {variable}" for i, (_, variable) in enumerate(variables)) + "}")
+        self.decoder_source = "\n".join(lines)
+        exec(compile(self.decoder_source,
+             f"<frame spec {self.name}>", "exec"), namespace)
+        return namespace["decode"]
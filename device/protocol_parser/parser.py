@@ -1,15 +1,57 @@
-import codecs
 import logging
-import struct
-from typing import Union
+import math
+from collections import Counter
+from enum import Enum
+from functools import reduce
+from operator import xor
+from threading import Lock
+from typing import Callable, NamedTuple, Union
 from models import *
+from device.data_record_history import ColumnarDataRecordHistory, DataRecordCodec, DataRecordHistory
+from device.protocol_parser.frame_spec import BCD_BYTE_VALUES, CHECKSUM_ALGORITHM, FIELD_TYPE, ChecksumSpec, FieldSpec, FrameSpec, RepeatedFieldSpec
 from abc import ABC, abstractmethod
 from paho.mqtt.client import PayloadType
 
 
+class CHECKSUM_POLICY(str, Enum):
+    # drop the frame failed the checksum before decoding its fields
+    Reject = "reject"
+    # decode and keep the frame, with 校验状态 ERROR in its data
+    KeepAndFlag = "keep_and_flag"
+    # decode and keep the frame as a valid one, only count it, the parsers whose data always
+    # carries 校验状态, like GPS, still have it
+    CountOnly = "count_only"
+
+
 class DeviceProtocolParser(ABC):
+    # the leading bytes of the payloads this parser could handle, used for dispatching msg to
+    # the parser by a lookup table rather than trying every parser, empty means the parser
+    # has no cheap signature and will be tried for all msgs.
+    payload_signature_prefixes: tuple[bytes, ...] = ()
+    # the spec of the frames from a serial sub-device, for rebuilding the frames split across msgs
+    # or merged into one msg by the dtu, None means the msgs are always complete, like the text ones.
+    stream_frame_spec: Optional[FrameSpec] = None
+    # the type of the devices whose msgs this parser handles
+    device_type: Optional[DEVICE_TYPE] = None
+
     def __init__(self):
         self.max_keep_data_records_count = 300
+        # when set, the data records are stored in typed columns rather than a dict per record
+        self.data_record_codec: Optional[DataRecordCodec] = None
+        # precomputed request frames keyed by (request action, device physical id), for the
+        # parsers with a small set of fixed requests, so serializing a request costs a dict lookup
+        self.serialized_frame_cache: dict[tuple[REQUEST_ACTION,
+                                                Optional[str]], bytes] = {}
+        # what to do with the frames failed the checksum, and the count of them
+        # per (dtu_sn, device physical id)
+        self.checksum_policy = CHECKSUM_POLICY.Reject
+        self.checksum_error_counts: Counter[tuple[str,
+                                                  Optional[str]]] = Counter()
+        self._checksum_error_counts_lock = Lock()
+        # called with the dtu_sn, the device physical id and the updated count on each frame failed the checksum,
+        # including the rejected ones, which never become a data record
+        self.on_checksum_error_callbacks: list[Callable[[
+            str, Optional[str], int], None]] = []
 
     @abstractmethod
     def Serialize(self, request: DeviceRequest) -> PayloadType:
@@ -19,6 +61,47 @@ class DeviceProtocolParser(ABC):
     def TryParse(self, device_mqtt_msg_topic: str, device_mqtt_msg: PayloadType) -> tuple[Optional[DeviceIdentity], Optional[dict]]:
         pass
 
+    def TryParseBatch(
+            self,
+            device_mqtt_msgs: list[tuple[str, PayloadType]]) -> list[tuple[Optional[DeviceIdentity], Optional[dict]]]:
+        """
+        parse a batch of (topic, payload), the result of each msg is in the same order as the input,
+        (None, None) for the msg could not be parsed.
+        parsers override it to amortize the per msg cost over the batch, the default one parses them one by one.
+        an override must not raise for a msg it could not parse, as the dispatcher then parses the whole batch
+        again by `TryParse`, which counts the checksum errors of the batch once more.
+        """
+        return [self.TryParse(topic, payload) for topic, payload in device_mqtt_msgs]
+
+    def MatchesSignature(self, device_mqtt_msg: bytes) -> bool:
+        """
+        cheap check of whether the payload looks like the one this parser could handle,
+        it must not decode the payload, the full validation is still done by TryParse.
+        """
+        return not self.payload_signature_prefixes or device_mqtt_msg.startswith(self.payload_signature_prefixes)
+
+    def on_checksum_error(self, dtu_sn: str, device_physical_id: Optional[str] = None) -> bool:
+        """
+        count a frame failed the checksum for the device, called before decoding the fields of the frame.
+        @return: whether the frame should still be decoded, by the checksum policy.
+        """
+        with self._checksum_error_counts_lock:
+            self.checksum_error_counts[(dtu_sn, device_physical_id)] += 1
+            checksum_error_count = self.checksum_error_counts[(
+                dtu_sn, device_physical_id)]
+        for callback in self.on_checksum_error_callbacks:
+            callback(dtu_sn, device_physical_id, checksum_error_count)
+        return self.checksum_policy != CHECKSUM_POLICY.Reject
+
+    def get_checksum_error_count(self, dtu_sn: str, device_physical_id: Optional[str] = None) -> int:
+        return self.checksum_error_counts.get((dtu_sn, device_physical_id), 0)
+
+    def create_data_record_history(self) -> DataRecordHistory:
+        """create the history for storing data records of a device parsed by this parser"""
+        if self.data_record_codec is not None:
+            return ColumnarDataRecordHistory(self.data_record_codec, self.max_keep_data_records_count)
+        return DataRecordHistory(self.max_keep_data_records_count)
+
     # @abstractmethod
     # def Deserialize(self, raw_device_request_data: Union[bytes, str], raw_device_response_data: Union[bytes, str]) -> dict:
     #     pass
@@ -26,75 +109,139 @@ class DeviceProtocolParser(ABC):
     def bcd_to_int(bcd_bytes: bytes):
         result = 0
         for byte in bcd_bytes:
-            # Extract the high nibble and low nibble
-            high_nibble = (byte >> 4) & 0xF
-            low_nibble = byte & 0xF
-            # Combine the nibbles into the result
-            result = result * 100 + high_nibble * 10 + low_nibble
+            # 2 decimal digits per byte, looked up rather than combining the nibbles
+            result = result * 100 + BCD_BYTE_VALUES[byte]
         return result
 
 
-class GenericTimelyReportGpsDtuDeviceParser(DeviceProtocolParser):
-    def __init__(self):
-        super().__init__()
-        self.logger = logging.getLogger("mqttClientLogger")
-        self.max_keep_data_records_count = 100
+class GnrmcFix(NamedTuple):
+    """
+    一次解析得到的GNRMC定位结果, 只保存原始字段和数值, 需要时再通过`to_dict`生成原有的中文字段dict
+    """
+    raw_sentence: str
+    # 原始字段(格式: HHMMSS.ss)
+    utc_time: str
+    # A=有效定位, V=无效定位
+    status: str
+    # 十进制度数, 南纬为负值
+    latitude: float
+    latitude_dir: str
+    # 十进制度数, 西经为负值
+    longitude: float
+    longitude_dir: str
+    speed_knots: float
+    course: str
+    # 原始字段(格式: DDMMYY)
+    utc_date: str
+    magnetic_variation: str
+    magnetic_dir: str
+    # NMEA 2.3+扩展字段, 缺失时为空字符串
+    mode: str
+    nav_status: str
+    checksum_valid: bool
+
+    @staticmethod
+    def parse(gnrmc_sentence: PayloadType, checksum_valid: Optional[bool] = None) -> Optional["GnrmcFix"]:
+        """
+        解析NMEA协议的$GNRMC语句, 如: $GNRMC,111700.00,A,2906.78084,N,11207.29890,E,0.114,,111125,,,A,V*10
+        直接在bytes上一次完成格式检查和校验和计算, 只解码一次.
+        `checksum_valid`为调用方已通过`verify_checksum`得到的结果, 为None时在此计算.
 
-    def Serialize(self, request: DeviceRequest) -> PayloadType:
-        # this kind of dtu does not support actively query gps,
-        # instead, it reports gps data as heartbeat msg actively with interval
-        raise NotImplementedError("Serialize method not implemented")
+        返回:
+            GnrmcFix, 当输入不是GNRMC语句或格式不完整时返回None
 
-    def TryParse(
-            self,
-            device_mqtt_msg_topic: str, device_mqtt_msg: PayloadType) -> tuple[Optional[DeviceIdentity], Optional[dict]]:
-        if device_mqtt_msg is None:
-            return None, None
-        gnrmc_sentence: str = None
-        if isinstance(device_mqtt_msg, bytes):
-            try:
-                gnrmc_sentence = device_mqtt_msg.decode()
-            except UnicodeDecodeError:
-                return None, None
-        elif isinstance(device_mqtt_msg, str):
-            gnrmc_sentence = device_mqtt_msg
+        异常:
+            ValueError: 当经纬度, 速度等数值字段无法解析时抛出
+        """
+        sentence_bytes = GnrmcFix.to_sentence_bytes(gnrmc_sentence)
+        if sentence_bytes is None:
+            return None
+        try:
+            sentence = gnrmc_sentence if isinstance(
+                gnrmc_sentence, str) else sentence_bytes.decode()
+        except UnicodeDecodeError:
+            return None
+        return GnrmcFix.from_sentence(sentence, sentence_bytes, checksum_valid)
+
+    @staticmethod
+    def to_sentence_bytes(gnrmc_sentence: PayloadType) -> Optional[bytes]:
+        """
+        返回语句的原始字节, 不做解码, 当输入不是以$GNRMC开头且有且只有一个*(其后为校验码)的语句时返回None
+        """
+        if isinstance(gnrmc_sentence, str):
+            sentence_bytes = gnrmc_sentence.encode()
+        elif isinstance(gnrmc_sentence, (bytes, bytearray)):
+            sentence_bytes = gnrmc_sentence
         else:
-            return None, None
-        if not gnrmc_sentence.startswith("$GNRMC"):
-            return None, None
+            return None
+        if not sentence_bytes.startswith(b"$GNRMC") or sentence_bytes.count(b'*') != 1:
+            return None
+        return sentence_bytes
 
-        # 分割语句（去掉$开头和*后的校验码）
-        parts = gnrmc_sentence.split('*')
-        if len(parts) != 2:
-            return None, None
+    @staticmethod
+    def verify_checksum(sentence_bytes: bytes) -> bool:
+        """
+        校验和为$与*之间所有字节的异或, 由reduce在C层一次遍历bytes完成, 不需要解码和拆分字段.
+        调用方需已检查过`sentence_bytes`只有一个*, 校验码后的行结束符(\r\n)及空白不参与比较.
+        """
+        star_index = sentence_bytes.index(b'*')
+        return b"%02X" % reduce(xor, sentence_bytes[1:star_index], 0) == sentence_bytes[star_index + 1:].rstrip().upper()
 
-        data_part, checksum_part = parts
+    @staticmethod
+    def from_sentence(sentence: str, sentence_bytes: bytes, checksum_valid: Optional[bool] = None) -> Optional["GnrmcFix"]:
+        """
+        解析已解码的GNRMC语句, 调用方需已检查过`sentence_bytes`以$GNRMC开头且只有一个*,
+        `sentence_bytes`为其原始字节, 用于计算校验和.
+        """
+        data_part = sentence.partition('*')[0]
         data_fields = data_part.split(',')
-
-        # 修正：GNRMC标准字段数应为14个（包含$GNRMC本身），允许扩展字段
+        # GNRMC标准字段数应为14个（包含$GNRMC本身），允许扩展字段
         # 核心字段需要前13个（索引0-12），扩展字段（定位模式、导航状态）在12+
         if len(data_fields) < 13:
-            return None, None
-        parsed_gnrmc = self.__parse_gnrmc(gnrmc_sentence)
-        # Extract dtu_sn from topic
-        dtu_sn = device_mqtt_msg_topic.split('/')[1]
-        assert isinstance(dtu_sn, str)
-        data_record = {"received_datetime": datetime.now(
-            timezone.utc), "data": parsed_gnrmc}
-        device_identity = DeviceIdentity(
-            name=f"GenericTimelyReportGpsDtuDevice__{dtu_sn}",
-            dtu_sn=dtu_sn,
-            device_type=DEVICE_TYPE.DTU,
-        )
-        return device_identity, data_record
+            return None
 
-    def __parse_gnrmc(self, gnrmc_sentence: str) -> dict:
-        """
-        解析NMEA协议的$GNRMC语句，提取关键字段
+        if checksum_valid is None:
+            checksum_valid = GnrmcFix.verify_checksum(sentence_bytes)
+
+        # 纬度（NMEA格式：DDMM.MMMMM -> 十进制：DD + MM.MMMMM/60）
+        latitude_raw = data_fields[3]
+        latitude_dir = data_fields[4] if data_fields[4] in ('N', 'S') else "未知"
+        latitude = 0.0
+        if latitude_raw:
+            latitude = int(latitude_raw[:2]) + float(latitude_raw[2:]) / 60.0
+            if latitude_dir == 'S':
+                latitude = -latitude
 
-        参数:
-            gnrmc_sentence: GNRMC语句字符串（如$GNRMC,111700.00,A,2906.78084,N,11207.29890,E,0.114,,111125,,,A,V*10）
+        # 经度（NMEA格式：DDDMM.MMMMM -> 十进制：DDD + MM.MMMMM/60）
+        longitude_raw = data_fields[5]
+        longitude_dir = data_fields[6] if data_fields[6] in (
+            'E', 'W') else "未知"
+        longitude = 0.0
+        if longitude_raw:
+            longitude = int(longitude_raw[:3]) + \
+                float(longitude_raw[3:]) / 60.0
+            if longitude_dir == 'W':
+                longitude = -longitude
 
+        return GnrmcFix(
+            raw_sentence=sentence,
+            utc_time=data_fields[1],
+            status=data_fields[2],
+            latitude=latitude,
+            latitude_dir=latitude_dir,
+            longitude=longitude,
+            longitude_dir=longitude_dir,
+            speed_knots=float(data_fields[7]) if data_fields[7] else 0.0,
+            course=data_fields[8],
+            utc_date=data_fields[9],
+            magnetic_variation=data_fields[10],
+            magnetic_dir=data_fields[11],
+            mode=data_fields[12],
+            nav_status=data_fields[13] if len(data_fields) > 13 else "",
+            checksum_valid=checksum_valid)
+
+    def to_dict(self) -> dict:
+        """
         返回:
             dict: 包含解析后的关键字段，格式如下：
             {
@@ -114,129 +261,301 @@ class GenericTimelyReportGpsDtuDeviceParser(DeviceProtocolParser):
                 "导航状态": str (V=未定位, A=定位, 部分模块扩展字段),
                 "校验状态": str (OK=校验通过, ERROR=校验失败)
             }
-
-        异常:
-            ValueError: 当输入不是有效的GNRMC语句时抛出
         """
-        # 基础校验
-        if not gnrmc_sentence.startswith("$GNRMC"):
-            raise ValueError("输入不是有效的GNRMC语句")
-
-        # 分割语句（去掉$开头和*后的校验码）
-        parts = gnrmc_sentence.split('*')
-        if len(parts) != 2:
-            raise ValueError("GNRMC语句格式错误，缺少校验码")
-
-        data_part, checksum_part = parts
-        data_fields = data_part.split(',')
-
-        # 修正：GNRMC标准字段数应为14个（包含$GNRMC本身），允许扩展字段
-        # 核心字段需要前13个（索引0-12），扩展字段（定位模式、导航状态）在12+
-        if len(data_fields) < 13:
-            raise ValueError(
-                f"GNRMC语句字段不完整，期望至少13个核心字段，实际收到{len(data_fields)}个")
-
-        # 计算校验和并验证（NMEA校验规则：所有字段的异或运算）
-        def calculate_nmea_checksum(sentence: str) -> str:
-            """计算NMEA语句的校验和（去掉$和*后的部分）"""
-            checksum = 0
-            for char in sentence[1:]:  # 跳过开头的$
-                if char == '*':
-                    break
-                checksum ^= ord(char)
-            return f"{checksum:02X}"  # 转为两位十六进制字符串
-
-        expected_checksum = calculate_nmea_checksum(gnrmc_sentence)
-        checksum_valid = expected_checksum == checksum_part.upper()
-
-        # 解析核心字段
-        # 1. UTC时间（格式：HHMMSS.ss）
-        utc_time_raw = data_fields[1]
-        utc_time = f"{utc_time_raw[:2]}:{utc_time_raw[2:4]}:{utc_time_raw[4:]}" if utc_time_raw else "无数据"
-
-        # 2. 定位状态
-        status = "有效定位" if data_fields[2] == 'A' else "无效定位" if data_fields[
-            2] == 'V' else f"未知({data_fields[2]})"
-
-        # 3. 纬度（NMEA格式：DDMM.MMMMM -> 十进制：DD + MM.MMMMM/60）
-        latitude_raw = data_fields[3]
-        latitude_dir = data_fields[4] if data_fields[4] in ['N', 'S'] else "未知"
-        latitude = 0.0
-        if latitude_raw:
-            degrees = int(latitude_raw[:2])
-            minutes = float(latitude_raw[2:])
-            latitude = degrees + minutes / 60.0
-            # 南纬为负值
-            if latitude_dir == 'S':
-                latitude = -latitude
-
-        # 4. 经度（NMEA格式：DDDMM.MMMMM -> 十进制：DDD + MM.MMMMM/60）
-        longitude_raw = data_fields[5]
-        longitude_dir = data_fields[6] if data_fields[6] in [
-            'E', 'W'] else "未知"
-        longitude = 0.0
-        if longitude_raw:
-            degrees = int(longitude_raw[:3])
-            minutes = float(longitude_raw[3:])
-            longitude = degrees + minutes / 60.0
-            # 西经为负值
-            if longitude_dir == 'W':
-                longitude = -longitude
-
-        # 5. 地面速度（节，1节=1.852公里/小时）
-        speed_knots = float(data_fields[7]) if data_fields[7] else 0.0
+        utc_time = self.utc_time
+        utc_date = self.utc_date
+        return {
+            "原始语句": self.raw_sentence,
+            "UTC时间": f"{utc_time[:2]}:{utc_time[2:4]}:{utc_time[4:]}" if utc_time else "无数据",
+            "定位状态": "有效定位" if self.status == 'A' else "无效定位" if self.status == 'V' else f"未知({self.status})",
+            "纬度": round(self.latitude, 6),  # 保留6位小数（约10cm精度）
+            "纬度方向": self.latitude_dir,
+            "经度": round(self.longitude, 6),
+            "经度方向": self.longitude_dir,
+            "地面速度(节)": round(self.speed_knots, 3),
+            "地面速度(km/h)": round(self.speed_knots * 1.852, 3),  # 额外转换为公里/小时
+            "地面航向(度)": self.course or "无数据",
+            "UTC日期": f"{utc_date[:2]}/{utc_date[2:4]}/{utc_date[4:]}" if utc_date else "无数据",
+            "磁偏角(度)": self.magnetic_variation or "无数据",
+            "磁偏角方向": self.magnetic_dir if self.magnetic_dir in ('E', 'W') else "无数据",
+            "定位模式": GNRMC_MODE_NAMES.get(self.mode, f"未知({self.mode})") if self.mode else "无数据",
+            "导航状态": GNRMC_NAV_STATUS_NAMES.get(self.nav_status, f"未知({self.nav_status})") if self.nav_status else "无数据",
+            "校验状态": "OK" if self.checksum_valid else "ERROR"}
+
+
+GNRMC_MODE_NAMES = {
+    'A': '自主定位',
+    'D': '差分定位',
+    'E': '估算定位',
+    'N': '数据无效'
+}
+GNRMC_NAV_STATUS_NAMES = {
+    'A': '定位',
+    'V': '未定位'
+}
+
+
+class GnrmcRecordCodec(DataRecordCodec):
+    """
+    keeps the numeric fields and the statuses of a GNRMC fix in typed columns, and the raw sentence
+    for the text fields without a column, which are split from it rather than parsing it again.
+    """
+    columns = (("纬度", 'd', 1),
+               ("经度", 'd', 1),
+               ("地面速度(节)", 'd', 1),
+               ("地面速度(km/h)", 'd', 1),
+               ("定位状态", 'B', 1),
+               ("校验状态", 'B', 1),
+               ("原始语句", None, 1))
+    status_codes = {"有效定位": 1, "无效定位": 2}
+    checksum_status_codes = {"OK": 1, "ERROR": 2}
+    # the raw status field of the status codes, 0 is the unknown status kept as is in the sentence
+    raw_statuses = {1: 'A', 2: 'V'}
+    checksum_statuses = {code: checksum_status for checksum_status,
+                         code in checksum_status_codes.items()}
+
+    def encode(self, data: dict) -> tuple:
+        return (data["纬度"], data["经度"], data["地面速度(节)"], data["地面速度(km/h)"],
+                self.status_codes.get(data["定位状态"], 0),
+                self.checksum_status_codes[data["校验状态"]],
+                data["原始语句"])
+
+    # the fields read from the row as is, without touching the raw sentence
+    plain_field_indexes = {"纬度": 0, "经度": 1,
+                           "地面速度(节)": 2, "地面速度(km/h)": 3}
+
+    def decode(self, row: tuple) -> dict:
+        sentence = row[6]
+        data_fields = sentence.partition('*')[0].split(',')
+        data = GnrmcFix(
+            raw_sentence=sentence,
+            utc_time=data_fields[1],
+            status=self.raw_statuses.get(row[4], data_fields[2]),
+            latitude=row[0],
+            latitude_dir=data_fields[4] if data_fields[4] in (
+                'N', 'S') else "未知",
+            longitude=row[1],
+            longitude_dir=data_fields[6] if data_fields[6] in (
+                'E', 'W') else "未知",
+            speed_knots=row[2],
+            course=data_fields[8],
+            utc_date=data_fields[9],
+            magnetic_variation=data_fields[10],
+            magnetic_dir=data_fields[11],
+            mode=data_fields[12],
+            nav_status=data_fields[13] if len(data_fields) > 13 else "",
+            checksum_valid=row[5] == self.checksum_status_codes["OK"]).to_dict()
+        # derived from the unrounded speed when parsed, so not from the rounded one in the row
+        data["地面速度(km/h)"] = row[3]
+        return data
+
+    def decode_fields(self, row: tuple, fields: set[str]) -> dict:
+        if not fields.issubset(self.plain_field_indexes.keys() | {"定位状态", "校验状态"}) \
+                or ("定位状态" in fields and row[4] not in self.raw_statuses):
+            return super().decode_fields(row, fields)
+        data = {name: row[index] for name, index in self.plain_field_indexes.items()
+                if name in fields}
+        if "定位状态" in fields:
+            data["定位状态"] = "有效定位" if row[4] == self.status_codes["有效定位"] else "无效定位"
+        if "校验状态" in fields:
+            data["校验状态"] = self.checksum_statuses[row[5]]
+        return data
 
-        # 6. 地面航向
-        course = data_fields[8] if data_fields[8] else "无数据"
 
-        # 7. UTC日期（格式：DDMMYY -> 转换为DD/MM/YY）
-        date_raw = data_fields[9]
-        utc_date = f"{date_raw[:2]}/{date_raw[2:4]}/{date_raw[4:]}" if date_raw else "无数据"
+class GenericTimelyReportGpsDtuDeviceParser(DeviceProtocolParser):
+    payload_signature_prefixes = (b"$GNRMC",)
+    device_type = DEVICE_TYPE.DTU
 
-        # 8. 磁偏角
-        magnetic_variation = data_fields[10] if data_fields[10] else "无数据"
-        magnetic_dir = data_fields[11] if data_fields[11] in [
-            'E', 'W'] else "无数据"
+    def __init__(self):
+        super().__init__()
+        self.logger = logging.getLogger("mqttClientLogger")
+        self.max_keep_data_records_count = 100
+        self.data_record_codec = GnrmcRecordCodec()
 
-        # 9. 定位模式（NMEA 2.3+扩展字段，索引12）
-        mode = {
-            'A': '自主定位',
-            'D': '差分定位',
-            'E': '估算定位',
-            'N': '数据无效'
-        }.get(data_fields[12], f"未知({data_fields[12]})") if len(data_fields) > 12 and data_fields[12] else "无数据"
+    def Serialize(self, request: DeviceRequest) -> PayloadType:
+        # this kind of dtu does not support actively query gps,
+        # instead, it reports gps data as heartbeat msg actively with interval
+        raise NotImplementedError("Serialize method not implemented")
 
-        # 10. 导航状态（部分模块扩展字段，索引13）
-        nav_status = {
-            'A': '定位',
-            'V': '未定位'
-        }.get(data_fields[13], f"未知({data_fields[13]})") if len(data_fields) > 13 and data_fields[13] else "无数据"
+    def TryParse(
+            self,
+            device_mqtt_msg_topic: str, device_mqtt_msg: PayloadType) -> tuple[Optional[DeviceIdentity], Optional[dict]]:
+        if device_mqtt_msg is None:
+            return None, None
+        sentence_bytes = GnrmcFix.to_sentence_bytes(device_mqtt_msg)
+        if sentence_bytes is None:
+            return None, None
+        # Extract dtu_sn from topic
+        dtu_sn = device_mqtt_msg_topic.split('/')[1]
+        assert isinstance(dtu_sn, str)
+        checksum_valid = GnrmcFix.verify_checksum(sentence_bytes)
+        if not checksum_valid and not self.on_checksum_error(dtu_sn):
+            return None, None
+        fix = GnrmcFix.parse(device_mqtt_msg, checksum_valid)
+        if fix is None:
+            return None, None
+        return self.__create_result(dtu_sn, fix, datetime.now(timezone.utc))
 
-        # 组织返回结果
-        return {
-            "原始语句": gnrmc_sentence,
-            "UTC时间": utc_time,
-            "定位状态": status,
-            "纬度": round(latitude, 6),  # 保留6位小数（约10cm精度）
-            "纬度方向": latitude_dir,
-            "经度": round(longitude, 6),
-            "经度方向": longitude_dir,
-            "地面速度(节)": round(speed_knots, 3),
-            "地面速度(km/h)": round(speed_knots * 1.852, 3),  # 额外转换为公里/小时
-            "地面航向(度)": course,
-            "UTC日期": utc_date,
-            "磁偏角(度)": magnetic_variation,
-            "磁偏角方向": magnetic_dir,
-            "定位模式": mode,
-            "导航状态": nav_status,
-            "校验状态": "OK" if checksum_valid else "ERROR"}
+    def TryParseBatch(
+            self,
+            device_mqtt_msgs: list[tuple[str, PayloadType]]) -> list[tuple[Optional[DeviceIdentity], Optional[dict]]]:
+        """
+        decode all the candidate sentences of the batch in one go, and split them by the separator,
+        then parse the fields of each, rather than decoding the payloads one by one.
+        the checksum is verified before decoding, so the rejected sentences are not decoded at all.
+        a sentence with a malformed numeric field is (None, None) rather than aborting the batch.
+        """
+        results: list[tuple[Optional[DeviceIdentity], Optional[dict]]] = [
+            (None, None)] * len(device_mqtt_msgs)
+        candidate_indexes = []
+        checksum_valids = []
+        for i, (topic, payload) in enumerate(device_mqtt_msgs):
+            if not isinstance(payload, bytes):
+                try:
+                    results[i] = self.TryParse(topic, payload)
+                except ValueError:
+                    continue
+            elif payload.startswith(b"$GNRMC") and payload.count(b'*') == 1:
+                checksum_valid = GnrmcFix.verify_checksum(payload)
+                if checksum_valid or self.on_checksum_error(topic.split('/')[1]):
+                    candidate_indexes.append(i)
+                    checksum_valids.append(checksum_valid)
+        if not candidate_indexes:
+            return results
+        try:
+            sentences = b"\n".join(
+                device_mqtt_msgs[i][1] for i in candidate_indexes).decode().split("\n")
+        except UnicodeDecodeError:
+            sentences = None
+        if sentences is None or len(sentences) != len(candidate_indexes):
+            # an undecodable payload or one with the separator, fallback to parse one by one
+            # the checksums were verified and counted, so not going through TryParse again
+            sentences = [None] * len(candidate_indexes)
+        received_datetime = datetime.now(timezone.utc)
+        for i, sentence, checksum_valid in zip(candidate_indexes, sentences, checksum_valids):
+            try:
+                fix = GnrmcFix.parse(device_mqtt_msgs[i][1], checksum_valid) if sentence is None \
+                    else GnrmcFix.from_sentence(sentence, device_mqtt_msgs[i][1], checksum_valid)
+            except ValueError:
+                continue
+            if fix is not None:
+                results[i] = self.__create_result(
+                    device_mqtt_msgs[i][0].split('/')[1], fix, received_datetime)
+        return results
+
+    @staticmethod
+    def __create_result(dtu_sn: str, fix: GnrmcFix, received_datetime: datetime) -> tuple[DeviceIdentity, dict]:
+        return DeviceIdentity(
+            name=f"GenericTimelyReportGpsDtuDevice__{dtu_sn}",
+            dtu_sn=dtu_sn,
+            device_type=DEVICE_TYPE.DTU,
+        ), {"received_datetime": received_datetime, "data": fix.to_dict()}
+
+
+def probe_temperature_name(index: int) -> str:
+    """温度A, 温度B, ... for the temperature points from the middle of the probe to the tail"""
+    return f"温度{chr(ord('A') + index)}"
+
+
+# AA 类别号 探棒号 命令 参数 校验和 BB, the doc says 校验和 is 前4字节十进制加和, but the probes
+# accept the binary sum, which is what's been sent since the beginning
+PROBE_READ_REQUEST_FRAME_SPEC = FrameSpec(
+    name="Probe_YiTong_TankTruck read request",
+    start=b"\xAA",
+    end=b"\xBB",
+    fields=(FieldSpec("类别号", fixed_value=0x01),
+            FieldSpec("探棒号"),
+            FieldSpec("命令", fixed_value=0x06),
+            FieldSpec("参数", fixed_value=0x00)),
+    checksum=ChecksumSpec(CHECKSUM_ALGORITHM.Sum8))
+
+# AA 类别号 探棒号 探棒类型 M1(3) M2(3) M3(3) 温度点数 温度(2)×温度点数 备用(2) 校验和 BB
+PROBE_READING_FRAME_SPEC = FrameSpec(
+    name="Probe_YiTong_TankTruck reading",
+    start=b"\xAA",
+    end=b"\xBB",
+    fields=(FieldSpec("类别号", fixed_value=0x01),
+            FieldSpec("探棒号"),
+            FieldSpec("探棒类型", fixed_value=0x02),
+            FieldSpec("M1", FIELD_TYPE.Bcd, 3),
+            FieldSpec("M2", FIELD_TYPE.Bcd, 3),
+            # binary rather than BCD, as the probes report it
+            FieldSpec("M3", FIELD_TYPE.UInt, 3),
+            FieldSpec("温度点数", FIELD_TYPE.Bcd),
+            # 温度加80的值, 3位整数, 1位小数
+            RepeatedFieldSpec("温度", "温度点数",
+                              FieldSpec("温度", FIELD_TYPE.Bcd, 2,
+                                        divisor=10, offset=-80),
+                              item_key=probe_temperature_name),
+            FieldSpec("备用", FIELD_TYPE.Reserved, 2)),
+    checksum=ChecksumSpec(CHECKSUM_ALGORITHM.BcdSum))
+
+
+class ProbeReadingRecordCodec(DataRecordCodec):
+    """
+    keeps a probe reading in typed columns, the first 2 temperatures in a float column
+    (NaN for absent), and the rest ones, which are rare, in an object column.
+    """
+    columns = (("类别号", 'B', 1),
+               ("探棒号", 'B', 1),
+               ("探棒类型", 'B', 1),
+               ("M1", 'q', 1),
+               ("M2", 'q', 1),
+               ("M3", 'q', 1),
+               ("温度点数", 'B', 1),
+               ("温度", 'd', 2),
+               ("额外温度", None, 1),
+               # 0 for the readings not flagged, see `CHECKSUM_POLICY.KeepAndFlag`
+               ("校验状态", 'B', 1))
+    checksum_status_codes = GnrmcRecordCodec.checksum_status_codes
+    checksum_statuses = {code: checksum_status for checksum_status,
+                         code in checksum_status_codes.items()}
+
+    def encode(self, data: dict) -> tuple:
+        temperatures = list(data["温度"][0].values()) if data["温度"] else []
+        return (data["类别号"], data["探棒号"], data["探棒类型"],
+                data["M1"], data["M2"], data["M3"], data["温度点数"],
+                tuple(temperatures[:2]) +
+                (math.nan,) * (2 - len(temperatures[:2])),
+                tuple(temperatures[2:]) or None,
+                self.checksum_status_codes.get(data.get("校验状态"), 0))
+
+    def decode(self, row: tuple) -> dict:
+        temperatures = [t for t in row[7] if not math.isnan(t)]
+        temperatures.extend(row[8] or ())
+        data = {
+            "类别号": row[0],
+            "探棒号": row[1],
+            "探棒类型": row[2],
+            "M1": row[3],
+            "M2": row[4],
+            "M3": row[5],
+            "温度点数": row[6],
+            "温度": [{probe_temperature_name(i): t for i, t in enumerate(temperatures)}] if temperatures else []
+        }
+        if row[9]:
+            data["校验状态"] = self.checksum_statuses[row[9]]
+        return data
 
 
 class Probe_YiTong_TankTruck_Parser(DeviceProtocolParser):
+    payload_signature_prefixes = (b"\xAA",)
+    # the replies come via RS485 at 2400 baud, the dtu may cut one in halves or merge several
+    stream_frame_spec = PROBE_READING_FRAME_SPEC
+    device_type = DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck
+
     def __init__(self):
         super().__init__()
         self.logger = logging.getLogger("mqttClientLogger")
         self.max_keep_data_records_count = 100
+        self.data_record_codec = ProbeReadingRecordCodec()
+        # only 1 read command and 99 probe ids
+        self.serialized_frame_cache = {
+            (REQUEST_ACTION.Read, str(probe_id)): self.__build_read_frame(probe_id) for probe_id in range(1, 100)}
+
+    def MatchesSignature(self, device_mqtt_msg: bytes) -> bool:
+        # AA 数据 校验和 BB, 数据字节数 = 13+2×温度点数
+        return PROBE_READING_FRAME_SPEC.matches(device_mqtt_msg)
 
     def Serialize(self, request: DeviceRequest) -> Union[bytes, str]:
         """
@@ -248,16 +567,17 @@ class Probe_YiTong_TankTruck_Parser(DeviceProtocolParser):
 
         """
         # Implement serialization logic for Probe_YiTong_TankTruck
+        frame = self.serialized_frame_cache.get(
+            (request.request_action, request.device_identity.device_physical_id))
+        if frame is not None:
+            return frame
         if request.request_action == REQUEST_ACTION.Read:
-            msg = b'\xAA\x01'
-            msg += struct.pack('B', int(request.device_identity.device_physical_id))
-            msg += b'\x06\x00'
-            checksum = sum(msg[1:5])
-            msg += struct.pack('B', checksum)
-            msg += b'\xBB'
-            return msg
+            return self.__build_read_frame(int(request.device_identity.device_physical_id))
         raise ValueError("Unsupported request type")
 
+    def __build_read_frame(self, probe_id: int) -> bytes:
+        return PROBE_READ_REQUEST_FRAME_SPEC.encode({"探棒号": probe_id})
+
     def TryParse(
             self,
             device_mqtt_msg_topic: str, device_mqtt_msg: PayloadType) -> tuple[Optional[DeviceIdentity], Optional[dict]]:
@@ -294,115 +614,68 @@ class Probe_YiTong_TankTruck_Parser(DeviceProtocolParser):
         BB结束符。
 
         """
-        if not isinstance(device_mqtt_msg, bytes):
-            return None, None
-        debug_hex_str = codecs.encode(
-            device_mqtt_msg, 'hex').decode('utf-8')
-        if len(device_mqtt_msg) != (1+13+2*device_mqtt_msg[13]+2+1+1):
-            return None, None
-        body: bytes = device_mqtt_msg[1:-1]
-
-        # check the 类别号
-        if body[0] != 0x01:
-            return None, None
-        # check the 探棒号 should the same with the request
-        probe_physical_id = body[1]
-        # check the 探棒类型 should be 0x02
-        if body[2] != 0x02:
+        if not isinstance(device_mqtt_msg, (bytes, bytearray)) or not PROBE_READING_FRAME_SPEC.matches(device_mqtt_msg):
             return None, None
-        # check the 校验和
-        # debug_hex_str = codecs.encode(
-        #     raw_device_response_data[1:-2], 'hex').decode('utf-8')
-        # print(
-        #     f"Probe_YiTong_TankTruck_Parser, CheckIsRequestAndResponsePair: {debug_hex_str}")
-        # checksum = sum(raw_device_response_data[1:-2]) & 0x00FF
-        # if checksum != raw_device_response_data[-2]:
-        #     return existing_device, TryUpdateOrCreateDeviceResult.NotMatched
         # Extract dtu_sn from topic
         dtu_sn = device_mqtt_msg_topic.split('/')[1]
         assert isinstance(dtu_sn, str)
-        parsed_data = self.__parse_probe_reading_data(body)
-        data_record = {"received_datetime": datetime.now(
-            timezone.utc), "data": parsed_data}
-        device_intity = DeviceIdentity(
-            name=f"Probe_YiTong_TankTruck__{dtu_sn}__{body[1]:02d}",
+        return self.__parse_frame(dtu_sn, device_mqtt_msg, datetime.now(timezone.utc))
+
+    def TryParseBatch(
+            self,
+            device_mqtt_msgs: list[tuple[str, PayloadType]]) -> list[tuple[Optional[DeviceIdentity], Optional[dict]]]:
+        """
+        the frames are decoded by the compiled decoder of the spec one by one, which costs less than
+        decoding the stacked frames column by column in python, the batch shares the received datetime.
+        a frame `TryParse` raises on, like the one without temperature point, is (None, None) rather than
+        aborting the batch.
+        """
+        results: list[tuple[Optional[DeviceIdentity], Optional[dict]]] = [
+            (None, None)] * len(device_mqtt_msgs)
+        received_datetime = datetime.now(timezone.utc)
+        for i, (topic, payload) in enumerate(device_mqtt_msgs):
+            if not isinstance(payload, bytes) or not self.MatchesSignature(payload):
+                continue
+            try:
+                results[i] = self.__parse_frame(
+                    topic.split('/')[1], payload, received_datetime)
+            except ValueError:
+                continue
+        return results
+
+    def __parse_frame(
+            self,
+            dtu_sn: str,
+            frame: Union[bytes, bytearray],
+            received_datetime: datetime) -> tuple[Optional[DeviceIdentity], Optional[dict]]:
+        """parse a frame already matching the spec, shared by `TryParse` and `TryParseBatch`"""
+        # check the 校验和 before decoding the fields
+        checksum_valid = PROBE_READING_FRAME_SPEC.verify_checksum(frame)
+        if not checksum_valid and not self.on_checksum_error(dtu_sn, str(frame[2])):
+            return None, None
+        # the 类别号 should be 0x01 and the 探棒类型 should be 0x02
+        parsed_data = PROBE_READING_FRAME_SPEC.decode_matched(frame)
+        if parsed_data is None:
+            return None, None
+        return self.__create_device_identity(dtu_sn, parsed_data), \
+            {"received_datetime": received_datetime,
+             "data": self.__to_reading_data(parsed_data, checksum_valid)}
+
+    @staticmethod
+    def __create_device_identity(dtu_sn: str, parsed_data: dict) -> DeviceIdentity:
+        probe_physical_id = parsed_data["探棒号"]
+        return DeviceIdentity(
+            name=f"Probe_YiTong_TankTruck__{dtu_sn}__{probe_physical_id:02d}",
             dtu_sn=dtu_sn,
             device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck,
             device_physical_id=str(probe_physical_id),
         )
-        return device_intity, data_record
-
-    def __parse_probe_reading_data(self, raw_data: bytes) -> dict:
-        """
-        返回数据格式：
-        AA 数据 校验和 BB     （数据字节数 = 13+2×温度点数）
-        数据定义：（所有数据均为压缩BCD码,一字节表示2位十进制数）
-        字节序号	内容	字节数	说明
-        0	类别号	1	固定为 01
-        1	探棒号	1	
-        2	探棒类型	1	固定为02
-        3-5	M1	3	液面浮子到电子仓的长度，6位十进制整数，BCD码
-        6-8	M2	3	返回6位9
-        9-11	M3	3	备用
-        12	温度点数	02	探棒中安装的温度传感器个数
-        13-14	温度A	2	温度加80的值,3位整数，1位小数，探杆的中间位置温度
-        15-16	温度B	2	温度加80的值,3位整数，1位小数，探杆的尾部位置温度
-        17-18		2	备用
-        校验和为所有数据十进制加和，取低字节。
-        探棒类型 02 输出空高
-        M1  液面浮子到电子仓的长度。
-        举例：探棒收到命令  AA 01 01 06 00 08 BB
-        探棒返回数据  AA 01 01 02 03 21 37 99 99 99 00 25 01 02 10 67 10 49 99 99 87 BB
-        分析数据如下：
-        AA 开始符01类别号01探棒号02探棒类型
-        03 21 37液面浮子到电子仓的长度321.37mm
-        99 99 99 这3字节备用
-        00 25 01 这3字节备用
-        02  标示2个温度点
-        10 67 探杆中间温度 26.7℃
-        10 49 探杆尾部温度24.9℃
-        99 99 这2字节备用 
-        87 校验和 
-        BB结束符。
-
-        """
-        # Implement deserialization logic for Probe_YiTong_TankTruck
-        if not isinstance(raw_data, bytes):
-            raise ValueError("Invalid data type, must be bytes")
-        parsed_data = {}
-        body: bytes = raw_data
-        # check the 类别号
-        类别号 = body[0]
-        # check the 探棒号
-        探棒号 = body[1]
-        # check the 探棒类型
-        探棒类型 = body[2]
-        # check the M1, 6位十进制整数，BCD码
-        M1 = DeviceProtocolParser.bcd_to_int(body[3:6])
-        # check the M2
-        M2 = DeviceProtocolParser.bcd_to_int(body[6:9])
-        # check the M3
-        M3 = int.from_bytes(body[9:12], byteorder='big')
-        # check the 温度点数
-        温度点数 = DeviceProtocolParser.bcd_to_int(body[12:13])
-        parsed_data = {
-            "类别号": 类别号,
-            "探棒号": 探棒号,
-            "探棒类型": 探棒类型,
-            "M1": M1,
-            "M2": M2,
-            "M3": M3,
-            "温度点数": 温度点数,
-            "温度": []
-        }
 
-        if 温度点数 == 0:
+    def __to_reading_data(self, parsed_data: dict, checksum_valid: bool) -> dict:
+        """the decoded frame to the shape of the reading data, the temperatures are kept in a list of 1 dict"""
+        if parsed_data["温度点数"] == 0:
             raise ValueError("No temperature data as 温度点数 is 0")
-        elif 温度点数 == 1:
-            温度A = DeviceProtocolParser.bcd_to_int(body[13:15])/10-80
-            parsed_data["温度"].append({"温度A": 温度A})
-        elif 温度点数 == 2:
-            温度A = DeviceProtocolParser.bcd_to_int(body[13:15])/10-80
-            温度B = DeviceProtocolParser.bcd_to_int(body[15:17])/10-80
-            parsed_data["温度"].append({"温度A": 温度A, "温度B": 温度B})
+        parsed_data["温度"] = [parsed_data["温度"]]
+        if self.checksum_policy == CHECKSUM_POLICY.KeepAndFlag:
+            parsed_data["校验状态"] = "OK" if checksum_valid else "ERROR"
         return parsed_data
@@ -0,0 +1,181 @@
+import logging
+from typing import Optional
+from paho.mqtt.client import PayloadType
+
+from models import DeviceIdentity
+from device.protocol_parser.frame_reassembler import FrameReassembler
+from device.protocol_parser.parser import DeviceProtocolParser
+from queue_logging import SampledLogger, TruncatedPayload
+
+
+class ParserDispatcher:
+    """
+    route a device msg to the parser which could handle it, rather than trying every parser.
+    parsers are indexed by the first byte of their `payload_signature_prefixes`, and the parser
+    last matched for a topic(a dtu) is tried first, as a dtu mostly keeps reporting the same kind of msg.
+    the binary msgs no parser could handle are fed to the frame reassemblers of the parsers with
+    `stream_frame_spec`, see `reassemble`.
+    """
+
+    def __init__(self, parsers: list[DeviceProtocolParser], logger: logging.Logger = None, reassembly_window_ms: int = 500):
+        """
+        :param reassembly_window_ms: the bytes of an incomplete frame are dropped once its dtu hasn't sent more for this long.
+        """
+        self.logger = logger or logging.getLogger(__class__.__name__+"Logger")
+        # a device keeps sending the same malformed msg, so the parse errors are sampled
+        self.sampled_logger = SampledLogger(self.logger)
+        self.parsers = parsers
+        self.reassemblers: list[tuple[FrameReassembler, DeviceProtocolParser]] = [
+            (FrameReassembler(parser.stream_frame_spec, window_ms=reassembly_window_ms), parser)
+            for parser in parsers if parser.stream_frame_spec is not None]
+        # parsers without signature are candidates of every msg
+        self._parsers_without_signature: list[DeviceProtocolParser] = [
+            parser for parser in parsers if not parser.payload_signature_prefixes]
+        self._parsers_by_first_byte: dict[int, list[DeviceProtocolParser]] = {}
+        for parser in parsers:
+            for prefix in parser.payload_signature_prefixes:
+                candidates = self._parsers_by_first_byte.setdefault(
+                    prefix[0], [])
+                if parser not in candidates:
+                    candidates.append(parser)
+        for first_byte in self._parsers_by_first_byte:
+            self._parsers_by_first_byte[first_byte].extend(
+                self._parsers_without_signature)
+        self._last_matched_parser_by_topic: dict[str,
+                                                 DeviceProtocolParser] = {}
+
+    def get_candidate_parsers(self, device_mqtt_msg: bytes) -> list[DeviceProtocolParser]:
+        if not device_mqtt_msg:
+            return self._parsers_without_signature
+        return self._parsers_by_first_byte.get(device_mqtt_msg[0], self._parsers_without_signature)
+
+    def dispatch(
+            self,
+            device_mqtt_msg_topic: str,
+            device_mqtt_msg: PayloadType) -> tuple[Optional[DeviceProtocolParser], Optional[DeviceIdentity], Optional[dict]]:
+        """
+        parse the msg by the first matched parser.
+        @return: the matched parser, the device identity and the data record, or all None if no parser matched.
+        """
+        signature_payload = self._get_signature_payload(device_mqtt_msg)
+        if signature_payload is None:
+            return None, None, None
+        last_matched_parser = self._last_matched_parser_by_topic.get(
+            device_mqtt_msg_topic)
+        if last_matched_parser is not None and last_matched_parser.MatchesSignature(signature_payload):
+            device_identity, data_record = self._try_parse(
+                last_matched_parser, device_mqtt_msg_topic, device_mqtt_msg)
+            if device_identity is not None:
+                return last_matched_parser, device_identity, data_record
+        return self._dispatch_to_candidates(
+            device_mqtt_msg_topic, device_mqtt_msg, signature_payload, last_matched_parser)
+
+    def dispatch_batch(
+            self,
+            device_mqtt_msgs: list[tuple[str, PayloadType]]) -> list[tuple[Optional[DeviceProtocolParser], Optional[DeviceIdentity], Optional[dict]]]:
+        """
+        parse a batch of msgs, the msgs are grouped by the parser picked for them as `dispatch` does,
+        and each group is parsed by one `TryParseBatch` call. a msg not parsed by the picked parser
+        goes on to the rest candidate parsers.
+        @return: the result of each msg in the same order as the input, like the one of `dispatch`.
+        """
+        results: list[tuple[Optional[DeviceProtocolParser], Optional[DeviceIdentity], Optional[dict]]] = [
+            (None, None, None)] * len(device_mqtt_msgs)
+        signature_payloads: list[Optional[bytes]] = []
+        indexes_by_parser: dict[DeviceProtocolParser, list[int]] = {}
+        for i, (topic, payload) in enumerate(device_mqtt_msgs):
+            signature_payload = self._get_signature_payload(payload)
+            signature_payloads.append(signature_payload)
+            if signature_payload is None:
+                continue
+            parser = self._last_matched_parser_by_topic.get(topic)
+            if parser is None or not parser.MatchesSignature(signature_payload):
+                parser = next((candidate for candidate in self.get_candidate_parsers(signature_payload)
+                               if candidate.MatchesSignature(signature_payload)), None)
+            if parser is not None:
+                indexes_by_parser.setdefault(parser, []).append(i)
+        for parser, indexes in indexes_by_parser.items():
+            batch = [device_mqtt_msgs[i] for i in indexes]
+            try:
+                parsed_results = parser.TryParseBatch(batch)
+            except Exception as e:
+                self.sampled_logger.log(
+                    logging.ERROR, parser.__class__.__name__, "batches failed to parse",
+                    "Error parsing a batch of %d messages with parser %s: %s, fallback to parse them one by one",
+                    len(batch), parser.__class__.__name__, e, exc_info=True)
+                parsed_results = [self._try_parse(parser, topic, payload)
+                                  for topic, payload in batch]
+            for i, (device_identity, data_record) in zip(indexes, parsed_results):
+                topic, payload = device_mqtt_msgs[i]
+                if device_identity is not None:
+                    self._last_matched_parser_by_topic[topic] = parser
+                    results[i] = (parser, device_identity, data_record)
+                else:
+                    results[i] = self._dispatch_to_candidates(
+                        topic, payload, signature_payloads[i], parser)
+        return results
+
+    def reassemble(
+            self,
+            device_mqtt_msg_topic: str,
+            device_mqtt_msg: PayloadType) -> list[tuple[DeviceProtocolParser, DeviceIdentity, dict]]:
+        """
+        feed the msg which could not be dispatched to the frame reassemblers, it may be a fragment of
+        a frame, or several frames merged, and parse the complete frames rebuilt.
+        @return: the parsed results of the rebuilt frames, empty if none yet.
+        """
+        if not isinstance(device_mqtt_msg, (bytes, bytearray)):
+            return []
+        results = []
+        for reassembler, parser in self.reassemblers:
+            for frame in reassembler.feed(device_mqtt_msg_topic, device_mqtt_msg):
+                device_identity, data_record = self._try_parse(
+                    parser, device_mqtt_msg_topic, frame)
+                if device_identity is not None:
+                    results.append((parser, device_identity, data_record))
+        return results
+
+    def is_reassembling(self, device_mqtt_msg_topic: str) -> bool:
+        """whether bytes of an incomplete frame are buffered for the topic"""
+        return any(reassembler.buffered_byte_count(device_mqtt_msg_topic) > 0
+                   for reassembler, _ in self.reassemblers)
+
+    @staticmethod
+    def _get_signature_payload(device_mqtt_msg: PayloadType) -> Optional[bytes]:
+        if device_mqtt_msg is None:
+            return None
+        signature_payload = device_mqtt_msg.encode() if isinstance(
+            device_mqtt_msg, str) else device_mqtt_msg
+        if not isinstance(signature_payload, (bytes, bytearray)):
+            return None
+        return signature_payload
+
+    def _dispatch_to_candidates(
+            self,
+            device_mqtt_msg_topic: str,
+            device_mqtt_msg: PayloadType,
+            signature_payload: bytes,
+            tried_parser: Optional[DeviceProtocolParser]) -> tuple[Optional[DeviceProtocolParser], Optional[DeviceIdentity], Optional[dict]]:
+        for parser in self.get_candidate_parsers(signature_payload):
+            if parser is tried_parser or not parser.MatchesSignature(signature_payload):
+                continue
+            device_identity, data_record = self._try_parse(
+                parser, device_mqtt_msg_topic, device_mqtt_msg)
+            if device_identity is not None:
+                self._last_matched_parser_by_topic[device_mqtt_msg_topic] = parser
+                return parser, device_identity, data_record
+        return None, None, None
+
+    def _try_parse(
+            self,
+            parser: DeviceProtocolParser,
+            device_mqtt_msg_topic: str,
+            device_mqtt_msg: PayloadType) -> tuple[Optional[DeviceIdentity], Optional[dict]]:
+        try:
+            return parser.TryParse(device_mqtt_msg_topic, device_mqtt_msg)
+        except Exception as e:
+            self.sampled_logger.log(
+                logging.ERROR, device_mqtt_msg_topic, f"msgs failed to parse by {parser.__class__.__name__}",
+                "Error parsing message from topic: %s, content: %s with parser %s: %s",
+                device_mqtt_msg_topic, TruncatedPayload(device_mqtt_msg), parser.__class__.__name__, e, exc_info=True)
+            return None, None
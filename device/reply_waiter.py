@@ -0,0 +1,74 @@
+import asyncio
+from threading import Lock
+from typing import Optional
+
+from models import DEVICE_TYPE, DeviceIdentity
+
+
+class DeviceReplyWaiter:
+    """
+    correlate a device request with its reply, the reply is the next data record parsed
+    from the same dtu_sn, device type and device physical id.
+    the http handler awaits an `asyncio.Future` created by `expect_reply`, and the ingest path,
+    which runs in MQTT client thread or ingest worker thread, resolves it by `resolve`.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._futures_by_key: dict[tuple, list[asyncio.Future]] = {}
+
+    @staticmethod
+    def _key(dtu_sn: str, device_type: DEVICE_TYPE, device_physical_id: Optional[str]) -> tuple:
+        # the probe id from request may have leading zeros, like "01", while the parsed one doesn't
+        if device_physical_id is not None and device_physical_id.isdigit():
+            device_physical_id = str(int(device_physical_id))
+        return (dtu_sn, device_type, device_physical_id)
+
+    def expect_reply(self, device_identity: DeviceIdentity) -> asyncio.Future:
+        """
+        must be called in the event loop, and before sending the request, otherwise a quick reply could be missed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        key = self._key(device_identity.dtu_sn, device_identity.device_type,
+                        device_identity.device_physical_id)
+        with self._lock:
+            self._futures_by_key.setdefault(key, []).append(future)
+        return future
+
+    def discard(self, device_identity: DeviceIdentity, future: asyncio.Future) -> None:
+        """stop waiting, like on timeout"""
+        key = self._key(device_identity.dtu_sn, device_identity.device_type,
+                        device_identity.device_physical_id)
+        with self._lock:
+            futures = self._futures_by_key.get(key)
+            if futures and future in futures:
+                futures.remove(future)
+                if not futures:
+                    del self._futures_by_key[key]
+
+    def resolve(self, device_identity: DeviceIdentity, data_record: dict) -> int:
+        """
+        hand the data record to all requests waiting for the device, could be called from any thread.
+        @return: the number of resolved requests.
+        """
+        if not self._futures_by_key:
+            return 0
+        key = self._key(device_identity.dtu_sn, device_identity.device_type,
+                        device_identity.device_physical_id)
+        with self._lock:
+            futures = self._futures_by_key.pop(key, None)
+        if not futures:
+            return 0
+        for future in futures:
+            try:
+                future.get_loop().call_soon_threadsafe(
+                    DeviceReplyWaiter._set_result, future, data_record)
+            except RuntimeError:
+                # the event loop of the waiting request was closed
+                pass
+        return len(futures)
+
+    @staticmethod
+    def _set_result(future: asyncio.Future, data_record: dict) -> None:
+        if not future.done():
+            future.set_result(data_record)
@@ -7,8 +7,10 @@ import paho.mqtt.client as mqtt
 from typing import Callable, Any, Dict, Optional, Union
 import time
 import logging
+import threading
 from paho.mqtt.enums import CallbackAPIVersion
 from paho.mqtt.client import PayloadType
+from device.ingest_pipeline import BACKPRESSURE_POLICY, IngestPipeline
 
 
 class SimpleMqttClient:
@@ -21,7 +23,12 @@ class SimpleMqttClient:
                  password=None,
                  on_message_callback: Callable[[str, PayloadType], None] = None,
                  logger: logging.Logger = None,
-                 description: str = "") -> None:
+                 description: str = "",
+                 ingest_worker_count: int = 0,
+                 ingest_max_queued_msg_count: int = 10000,
+                 ingest_backpressure_policy: BACKPRESSURE_POLICY = BACKPRESSURE_POLICY.DropOldest,
+                 on_message_batch_callback: Callable[[list[tuple[str, PayloadType]]], None] = None,
+                 ingest_max_batch_size: int = 1) -> None:
         """
         :param host: The hostname of the MQTT broker.
         :param port: The port of the MQTT broker.
@@ -29,9 +36,14 @@ class SimpleMqttClient:
         :param mqtt_client_id: The client ID to use when connecting to the broker, must be unique.
         :param username: The username to use when connecting to the broker.
         :param password: The password to use when connecting to the broker.
-        :param on_message_callback: A callback function to handle incoming messages, should accept two parameters: topic and payload, DO NOT BLOCK in this callback, as it runs in MQTT client thread, use threadpool or asyncio to handle long-running tasks.
+        :param on_message_callback: A callback function to handle incoming messages, should accept two parameters: topic and payload, DO NOT BLOCK in this callback, as it runs in MQTT client thread(or in ingest worker thread if `ingest_worker_count` > 0), use threadpool or asyncio to handle long-running tasks.
         :param logger: A logger instance to use for logging, if None, a default logger will be created.
         :param description: A description of the purpose of this client, used in logging and online status.
+        :param ingest_worker_count: The number of worker threads for calling the on_message callbacks, 0 means calling them in MQTT client thread.
+        :param ingest_max_queued_msg_count: The max number of received messages waiting for the ingest workers.
+        :param ingest_backpressure_policy: What to do with a received message when the ingest queue is full.
+        :param on_message_batch_callback: A callback function to handle incoming messages in batch, should accept a list of (topic, payload), the messages piled up in an ingest worker queue are handed over in one call, up to `ingest_max_batch_size`.
+        :param ingest_max_batch_size: The max number of messages of a batch, only takes effect when `ingest_worker_count` > 0.
         """
         if not name:
             raise Exception("name must be provided")
@@ -53,21 +65,41 @@ class SimpleMqttClient:
 
         # Set up client callbacks
         self.client.on_connect = self._on_connect
-        self.client.on_disconnect = lambda client, userdata, disconnect_flags, reason_code, properties: print(
-            f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S %f')} - {self.name}, Disconnected from MQTT broker")
+        self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
 
         self.subscribed_topics: list[str] = []
         self.on_message_callbacks: list[Callable[[str, str], None]] = []
         if on_message_callback:
             self.on_message_callbacks.append(on_message_callback)
+        self.on_message_batch_callbacks: list[Callable[[
+            list[tuple[str, PayloadType]]], None]] = []
+        if on_message_batch_callback:
+            self.on_message_batch_callbacks.append(on_message_batch_callback)
 
         self.online_status_topic = f"rpc/rpc_client/{name}/online_status"
 
+        # requests waiting for response, keyed by the response topic
+        self._pending_requests_by_topic: dict[str,
+                                              list[_PendingRequest]] = {}
+        self._pending_requests_lock = threading.Lock()
+
+        self.ingest_pipeline: Optional[IngestPipeline] = None
+        if ingest_worker_count > 0:
+            self.ingest_pipeline = IngestPipeline(
+                handler=self._dispatch_message,
+                worker_count=ingest_worker_count,
+                batch_handler=self._dispatch_message_batch if ingest_max_batch_size > 1 else None,
+                max_batch_size=ingest_max_batch_size,
+                max_queued_msg_count=ingest_max_queued_msg_count,
+                backpressure_policy=ingest_backpressure_policy,
+                name=f"{name}-ingest",
+                logger=self.logger)
+
     def connect(self) -> bool:
         """Connect to the MQTT broker, will not block, the connection will be established in the background"""
-        print(
-            f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S %f')} - {self.name}, Connecting to MQTT broker: {self.host}:{self.port}")
+        self.logger.info("%s - Connecting to MQTT broker: %s:%s",
+                         self.name, self.host, self.port)
         try:
             unplanned_offline_will_message = {"status": "offline", "name": self.name,
                                               "reason": f"unplanned disconnected from mqtt broker",
@@ -76,21 +108,19 @@ class SimpleMqttClient:
             self.client.will_set(self.online_status_topic,
                                  payload=json.dumps(unplanned_offline_will_message), qos=1, retain=True)
 
+            if self.ingest_pipeline:
+                self.ingest_pipeline.start()
             self.client.connect_async(self.host, self.port)
             self.client.loop_start()
             return True
         except Exception as e:
-            print(
-                f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S %f')} - {self.name}, Failed to connect to MQTT broker: {e}")
             self.logger.exception(
-                f"{self.name} - Failed to connect to MQTT broker: {e}")
+                "%s - Failed to connect to MQTT broker: %s", self.name, e)
             return False
 
     def disconnect(self) -> None:
-        print(
-            f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S %f')} - SimpleMqttClient - {self.name}, planned Disconnecting from MQTT broker")
         self.logger.info(
-            f"SimpleMqttClient - {self.name} - planned Disconnecting from MQTT broker")
+            "SimpleMqttClient - %s - planned Disconnecting from MQTT broker", self.name)
         planned_offline_message = {"status": "offline", "name": self.name,
                                    "reason": f"planned disconnected from mqtt broker at local time: {datetime.now(timezone.utc).isoformat()}",
                                    "description": self.description or ""
@@ -101,16 +131,16 @@ class SimpleMqttClient:
         """Disconnect from the MQTT broker"""
         self.client.loop_stop()
         self.client.disconnect()
+        if self.ingest_pipeline:
+            self.ingest_pipeline.stop()
 
     def _on_connect(self, client, userdata, flags, rc, prop):
         """Callback for when the client connects to the broker
         "Client", Any, ConnectFlags, ReasonCode, Union[Properties, None]
         """
         if rc == 0:
-            print(
-                f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S %f')} - {self.name}, Connected to MQTT broker: {self.host}:{self.port}")
             self.logger.info(
-                f"{self.name} - Connected to MQTT broker: {self.host}:{self.port}")
+                "%s - Connected to MQTT broker: %s:%s", self.name, self.host, self.port)
             online_message = {"status": "online", "name": self.name,
                               "data": {},
                               "reason": f"have been connected to mqtt broker since local time: {datetime.now(timezone.utc).isoformat()}",
@@ -123,10 +153,13 @@ class SimpleMqttClient:
                 for tp in self.subscribed_topics:
                     client.subscribe(tp)
         else:
-            print(
-                f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S %f')} - {self.name}, Failed to connect to MQTT broker with code: {rc}")
             self.logger.error(
-                f"{self.name} - Failed to connect to MQTT broker with code: {rc}")
+                "%s - Failed to connect to MQTT broker with code: %s", self.name, rc)
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        """Callback for when the client disconnects from the broker, paho reconnects in the background"""
+        self.logger.warning(
+            "%s - Disconnected from MQTT broker with code: %s", self.name, reason_code)
 
     def _on_message(self, client, userdata, msg):
         """Callback for when a message is received from the broker"""
@@ -135,20 +168,37 @@ class SimpleMqttClient:
             # print(
             #     f"{datetime.now().strftime('%H:%M:%S %f')} - {self.name} - SimpleMqttClient, Received message from topic {msg.topic}: {str(payload)[0:180]}")
             topic = msg.topic
-            for callback in self.on_message_callbacks:
-                callback(topic, payload)
+            if self._pending_requests_by_topic:
+                self._resolve_pending_requests(topic, payload)
+            if self.ingest_pipeline:
+                self.ingest_pipeline.submit(topic, payload)
+            else:
+                self._dispatch_message(topic, payload)
         except json.JSONDecodeError:
-            print(
-                f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S %f')} - {self.name} - SimpleMqttClient, Failed to decode JSON message from topic {msg.topic}")
             self.logger.error(
-                f"{self.name} - SimpleMqttClient -Failed to decode JSON message from topic {msg.topic}")
+                "%s - SimpleMqttClient -Failed to decode JSON message from topic %s", self.name, msg.topic)
         except Exception as e:
-            # get stack trace and log it
-            import traceback
-            print(
-                f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S %f')} - {self.name} - SimpleMqttClient, Failed to handle message: {e} from topic {msg.topic}")
             self.logger.exception(
-                f"{self.name} - SimpleMqttClient - Failed to handle message: {e} from topic {msg.topic}")
+                "%s - SimpleMqttClient - Failed to handle message: %s from topic %s", self.name, e, msg.topic)
+
+    def _dispatch_message(self, topic: str, payload: PayloadType):
+        """call the on_message callbacks, in MQTT client thread or in ingest worker thread"""
+        for callback in self.on_message_callbacks:
+            callback(topic, payload)
+        for callback in self.on_message_batch_callbacks:
+            callback([(topic, payload)])
+
+    def _dispatch_message_batch(self, msgs: list[tuple[str, PayloadType]]):
+        """call the on_message callbacks with the msgs drained by an ingest worker"""
+        for callback in self.on_message_callbacks:
+            for topic, payload in msgs:
+                try:
+                    callback(topic, payload)
+                except Exception as e:
+                    self.logger.exception(
+                        "%s - SimpleMqttClient - Failed to handle message: %s from topic %s", self.name, e, topic)
+        for callback in self.on_message_batch_callbacks:
+            callback(msgs)
 
     def subscribe(self, topic: str):
         """
@@ -163,12 +213,16 @@ class SimpleMqttClient:
 
     def publish(self,
                 topic: str,
-                msg: PayloadType) -> bool:
+                msg: PayloadType,
+                qos: int = 0) -> bool:
+        """
+        :param qos: the messages of qos 1 and 2 are queued by the MQTT client and re-sent until acknowledged, this does not wait for that.
+        """
         if not topic:
             raise Exception("topic must be provided")
 
         try:
-            ret = self.client.publish(topic, msg, qos=0)
+            ret = self.client.publish(topic, msg, qos=qos)
             # print(
             #     f"{datetime.now().strftime('%H:%M:%S %f')} - {self.name} - SimpleMqttClient, Published(msg len: {len(json.dumps(msg))}) with result: {ret.rc.name}, {topic}-> {str(msg)[0:200]}")
             # qos 0 always has the is_published() as False, and infinite timeout of wait_for_publish, so we don't need to wait for it.
@@ -178,17 +232,13 @@ class SimpleMqttClient:
             #         f"{datetime.now().strftime('%H:%M:%S %f')} - {self.name} - SimpleMqttClient, wait_for_publish Message sent to topic {topic} successfully")
             # Ensure message is sent before proceeding
             if ret.rc != mqtt.MQTT_ERR_SUCCESS:
-                print(
-                    f"{datetime.now().strftime('%H:%M:%S %f')} - {self.name} - SimpleMqttClient, Failed to publish message to topic {topic}: {ret.rc.name}")
                 self.logger.error(
-                    f"{self.name} - Failed to publish message to topic {topic}: {ret.rc.name}")
+                    "%s - Failed to publish message to topic %s: %s", self.name, topic, ret.rc.name)
                 return False
             return True
         except Exception as e:
-            print(
-                f"{datetime.now().strftime('%H:%M:%S %f')} - {self.name} - SimpleMqttClient, Failed to publish message to topic {topic}: {e}")
             self.logger.exception(
-                f"{self.name} - SimpleMqttClient - Failed to publish message to topic {topic}: {e}")
+                "%s - SimpleMqttClient - Failed to publish message to topic %s: %s", self.name, topic, e)
             return False
 
     def send_request(
@@ -199,80 +249,130 @@ class SimpleMqttClient:
             timeout: int = 3000) -> Optional[Dict]:
         """
         发送请求到指定的topic, 然后等待响应, 超时返回None.
-        这是一个blocking call, 会阻塞当前线程, 直到收到响应或者超时.
+        这是一个blocking call, 会阻塞当前线程, 直到收到响应或者超时, 在asyncio中请使用`send_request_async`.
         @param request_to_topic: The topic to send the request to.
         @param response_from_topic: The topic to receive the response from.
-        @param request_id: The ID of the request.
-        @param action: The action name for the request.
-        @param msg: The sending msg, default is None.
+        @param msg: The sending msg.
+        @param capture_response: Tells whether a msg from `response_from_topic` is the response of the request.
         @param timeout: The timeout for the request in milliseconds, default is 3000.
         @return: The response from the remote peer, or None if timed out.
-
-        @return: response
         """
-        if not self.client.is_connected():
-            self.logger.error(f"{self.name} - Not connected to MQTT broker")
-            raise Exception(f"{self.name} - Not connected to MQTT broker")
-
-        # Store response in a dict that can be accessed from the callback
-        response_container = {"response": None}
-        response_received = False
-        request_send_timestamp = datetime.now()
-        # Create an event to signal when response is received
-        import threading
         response_event = threading.Event()
+        response_container = {"response": None}
 
-        # Create temporary callback function to handle the response
-        def temp_callback(topic: str, payload: PayloadType):
-            # Skip if topic doesn't match
-            if topic != response_from_topic:
-                return
-
-            if not capture_response(msg, payload,
-                                    {"request_send_timestamp": request_send_timestamp,
-                                     "request_topic": request_to_topic}):
-                return
-
-            # We found our response
+        def on_response(payload: PayloadType):
             response_container["response"] = payload
             response_event.set()
 
-        # Add temporary callback and subscribe to response topic
-        self.on_message_callbacks.append(temp_callback)
-        was_already_subscribed = response_from_topic in self.subscribed_topics
-        if not was_already_subscribed:
-            self.subscribe(response_from_topic)
-            # Small delay to ensure subscription is registered before sending request
-            import time
-            time.sleep(0.1)
-
+        pending_request = self._start_request(
+            request_to_topic, response_from_topic, msg, capture_response, on_response)
         try:
-            # Publish request
-            result = self.client.publish(request_to_topic, msg)
-            # Ensure message was published before waiting for response
-            # result.wait_for_publish()
+            if response_event.wait(timeout / 1000):
+                return response_container["response"]
+            self.logger.warning(
+                f"{self.name} - Request timed out")
+            return None
+        finally:
+            self._remove_pending_request(pending_request)
 
-            # Wait for response with timeout
-            response_received = response_event.wait(timeout / 1000)
+    async def send_request_async(
+            self,
+            request_to_topic: str, response_from_topic: str,
+            msg: PayloadType,
+            capture_response: Callable[[Union[str, bytes], bytes, dict], bool],
+            timeout: int = 3000) -> Optional[PayloadType]:
+        """
+        the asyncio version of `send_request`, awaits the response without blocking the event loop.
+        @return: The response from the remote peer, or None if timed out.
+        """
+        loop = asyncio.get_running_loop()
+        response_future = loop.create_future()
 
-            if response_received:
-                return response_container["response"]
-            else:
-                self.logger.warning(
-                    f"{self.name} - Request timed out")
-                return None
+        def on_response(payload: PayloadType):
+            # called from MQTT client thread
+            loop.call_soon_threadsafe(
+                lambda: response_future.done() or response_future.set_result(payload))
 
+        pending_request = self._start_request(
+            request_to_topic, response_from_topic, msg, capture_response, on_response)
+        try:
+            return await asyncio.wait_for(response_future, timeout / 1000)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"{self.name} - Request timed out")
+            return None
         finally:
-            # Clean up: remove callback and unsubscribe if we subscribed
+            self._remove_pending_request(pending_request)
+
+    def _start_request(
+            self,
+            request_to_topic: str, response_from_topic: str,
+            msg: PayloadType,
+            capture_response: Callable[[Union[str, bytes], bytes, dict], bool],
+            on_response: Callable[[PayloadType], None]) -> "_PendingRequest":
+        """register the pending request, then publish the request msg"""
+        if not self.client.is_connected():
+            self.logger.error("%s - Not connected to MQTT broker", self.name)
+            raise Exception(f"{self.name} - Not connected to MQTT broker")
+
+        pending_request = _PendingRequest(
+            response_from_topic, msg, capture_response, on_response,
+            {"request_send_timestamp": datetime.now(),
+             "request_topic": request_to_topic})
+        with self._pending_requests_lock:
+            self._pending_requests_by_topic.setdefault(
+                response_from_topic, []).append(pending_request)
+        if response_from_topic not in self.subscribed_topics:
+            # the broker handles the SUBSCRIBE before the following PUBLISH from the same connection,
+            # and the response is only sent after the request is received, so no need to wait for SUBACK.
+            self.subscribe(response_from_topic)
+        try:
+            self.client.publish(request_to_topic, msg)
+        except Exception:
+            self._remove_pending_request(pending_request)
+            raise
+        return pending_request
+
+    def _remove_pending_request(self, pending_request: "_PendingRequest") -> None:
+        with self._pending_requests_lock:
+            pending_requests = self._pending_requests_by_topic.get(
+                pending_request.response_from_topic)
+            if pending_requests and pending_request in pending_requests:
+                pending_requests.remove(pending_request)
+                if not pending_requests:
+                    del self._pending_requests_by_topic[pending_request.response_from_topic]
+
+    def _resolve_pending_requests(self, topic: str, payload: PayloadType) -> None:
+        """match the msg only against the requests waiting on its topic"""
+        with self._pending_requests_lock:
+            pending_requests = self._pending_requests_by_topic.get(topic)
+            if not pending_requests:
+                return
+            pending_requests = list(pending_requests)
+        for pending_request in pending_requests:
             try:
-                if temp_callback in self.on_message_callbacks:
-                    self.on_message_callbacks.remove(temp_callback)
-            except ValueError:
-                # Callback might have been removed already
-                pass
-
-            # Only unsubscribe if we weren't already subscribed and no other request is using this topic
-            if not was_already_subscribed and response_from_topic in self.subscribed_topics:
-                # Don't unsubscribe immediately as other concurrent requests might be using this topic
-                # Just remove from our tracking list
-                pass
+                if not pending_request.capture_response(pending_request.request_msg, payload, pending_request.context):
+                    continue
+            except Exception as e:
+                self.logger.exception(
+                    f"{self.name} - SimpleMqttClient - Failed to capture response from topic {topic}: {e}")
+                continue
+            self._remove_pending_request(pending_request)
+            pending_request.on_response(payload)
+
+
+class _PendingRequest:
+    __slots__ = ("response_from_topic", "request_msg",
+                 "capture_response", "on_response", "context")
+
+    def __init__(self,
+                 response_from_topic: str,
+                 request_msg: PayloadType,
+                 capture_response: Callable[[Union[str, bytes], bytes, dict], bool],
+                 on_response: Callable[[PayloadType], None],
+                 context: dict) -> None:
+        self.response_from_topic = response_from_topic
+        self.request_msg = request_msg
+        self.capture_response = capture_response
+        self.on_response = on_response
+        self.context = context
@@ -0,0 +1,121 @@
+import asyncio
+from collections import deque
+from threading import Lock
+from typing import Optional
+
+from pydantic_core import to_json
+
+from models import DEVICE_TYPE, DeviceIdentity
+
+
+class TelemetrySubscription:
+    """
+    the live data records of the devices matching the filters, the None filter means not filtering on that field.
+    the records are queued for the subscriber in a bounded queue, when a slow subscriber lets it fill up,
+    the oldest one is dropped, as the live consumers are interested in the latest values.
+    """
+
+    def __init__(self,
+                 loop: asyncio.AbstractEventLoop,
+                 dtu_sn: Optional[str] = None,
+                 device_type: Optional[DEVICE_TYPE] = None,
+                 device_physical_id: Optional[str] = None,
+                 max_queued_count: int = 100):
+        if max_queued_count <= 0:
+            raise ValueError("max_queued_count must be positive")
+        self.loop = loop
+        self.dtu_sn = dtu_sn
+        self.device_type = device_type
+        self.device_physical_id = device_physical_id
+        self.dropped_count = 0
+        self._queue: deque[bytes] = deque(maxlen=max_queued_count)
+        self._not_empty = asyncio.Event()
+
+    def matches(self, device_identity: DeviceIdentity) -> bool:
+        return (self.dtu_sn is None or device_identity.dtu_sn == self.dtu_sn) \
+            and (self.device_type is None or device_identity.device_type == self.device_type) \
+            and (self.device_physical_id is None or device_identity.device_physical_id == self.device_physical_id)
+
+    def put(self, encoded_record: bytes) -> None:
+        """must be called in the loop of the subscription"""
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped_count += 1
+        self._queue.append(encoded_record)
+        self._not_empty.set()
+
+    async def get(self) -> bytes:
+        """the next encoded record, a JSON object like: {"device_identity": {...}, "data_record": {...}}"""
+        while not self._queue:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self._queue.popleft()
+
+
+class TelemetryBroadcaster:
+    """
+    fan out the newly parsed data records to the live subscribers, like the websocket and SSE clients.
+    `publish` is called by the ingest path, which runs in the MQTT client thread or an ingest worker thread,
+    a record is encoded once for all its subscribers, and handed to each event loop by one `call_soon_threadsafe`,
+    so a record costs the ingest path nearly nothing when no one subscribes it.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # indexed by the dtu_sn filter, the subscriptions without the dtu_sn filter are keyed by None
+        self._subscriptions_by_dtu_sn: dict[Optional[str],
+                                            set[TelemetrySubscription]] = {}
+
+    def subscribe(self,
+                  dtu_sn: Optional[str] = None,
+                  device_type: Optional[DEVICE_TYPE] = None,
+                  device_physical_id: Optional[str] = None,
+                  max_queued_count: int = 100) -> TelemetrySubscription:
+        """must be called in the event loop where the subscription is consumed"""
+        subscription = TelemetrySubscription(asyncio.get_running_loop(
+        ), dtu_sn, device_type, device_physical_id, max_queued_count)
+        with self._lock:
+            self._subscriptions_by_dtu_sn.setdefault(
+                dtu_sn, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: TelemetrySubscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions_by_dtu_sn.get(
+                subscription.dtu_sn)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions_by_dtu_sn[subscription.dtu_sn]
+
+    def publish(self, device_identity: DeviceIdentity, data_record: dict) -> None:
+        with self._lock:
+            matched_subscriptions = [subscription
+                                     for dtu_sn in (device_identity.dtu_sn, None)
+                                     for subscription in self._subscriptions_by_dtu_sn.get(dtu_sn, ())
+                                     if subscription.matches(device_identity)]
+        if not matched_subscriptions:
+            return
+        encoded_record = to_json(
+            {"device_identity": device_identity, "data_record": data_record})
+        subscriptions_by_loop: dict[asyncio.AbstractEventLoop,
+                                    list[TelemetrySubscription]] = {}
+        for subscription in matched_subscriptions:
+            subscriptions_by_loop.setdefault(
+                subscription.loop, []).append(subscription)
+        for loop, subscriptions in subscriptions_by_loop.items():
+            try:
+                loop.call_soon_threadsafe(
+                    self._put_all, subscriptions, encoded_record)
+            except RuntimeError:
+                # the loop is closed, like on shutdown
+                pass
+
+    @staticmethod
+    def _put_all(subscriptions: list[TelemetrySubscription], encoded_record: bytes) -> None:
+        for subscription in subscriptions:
+            subscription.put(encoded_record)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions_by_dtu_sn.values())
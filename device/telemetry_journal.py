@@ -0,0 +1,347 @@
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Iterator, Optional
+
+from models import DEVICE_TYPE, DeviceIdentity
+from device.data_record_history import DataRecordHistory, to_epoch_ms
+
+# body length, crc32 of the type and body, type
+_FRAME_HEADER = struct.Struct("<IIB")
+# device index
+_DEVICE_HEADER = struct.Struct("<I")
+# device index, epoch ms of received_datetime
+_RECORD_HEADER = struct.Struct("<Iq")
+_RECEIVED_EPOCH_MS = struct.Struct("<q")
+_FRAME_TYPE_DEVICE = 1
+_FRAME_TYPE_RECORD = 2
+# the last frame of a snapshot
+_FRAME_TYPE_END = 3
+# a longer one must be garbage from a torn write
+_MAX_FRAME_BODY_LENGTH = 16 * 1024 * 1024
+
+_SEGMENT_FILE_NAME = re.compile(r"^journal-(\d{8})\.bin$")
+_SNAPSHOT_FILE_NAME = re.compile(r"^snapshot-(\d{8})\.bin$")
+
+
+def _encode_frame(frame_type: int, body: bytes) -> bytes:
+    type_and_body = bytes((frame_type,)) + body
+    return _FRAME_HEADER.pack(len(body), zlib.crc32(type_and_body), frame_type) + body
+
+
+def _encode_device(device_index: int, device_identity: DeviceIdentity, parser_name: str) -> bytes:
+    return _encode_frame(_FRAME_TYPE_DEVICE, _DEVICE_HEADER.pack(device_index) + json.dumps(
+        [device_identity.dtu_sn, device_identity.device_type.value, device_identity.name,
+         device_identity.device_physical_id, parser_name], ensure_ascii=False).encode())
+
+
+def _encode_record_body(data_record: dict) -> bytes:
+    """the body of a record frame without the leading device index"""
+    return _RECEIVED_EPOCH_MS.pack(to_epoch_ms(data_record["received_datetime"])) + json.dumps(
+        data_record["data"], ensure_ascii=False, separators=(",", ":"), default=str).encode()
+
+
+def _decode_device(body: bytes) -> tuple[int, DeviceIdentity, str]:
+    device_index, = _DEVICE_HEADER.unpack_from(body)
+    dtu_sn, device_type, name, device_physical_id, parser_name = json.loads(
+        body[_DEVICE_HEADER.size:])
+    return device_index, DeviceIdentity(name=name, dtu_sn=dtu_sn, device_type=DEVICE_TYPE(device_type),
+                                        device_physical_id=device_physical_id), parser_name
+
+
+def _read_frames(data: bytes) -> tuple[list[tuple[int, bytes]], int]:
+    """
+    read the (type, body) of the frames, stop at the first torn or corrupted frame,
+    which is the tail being written when the process crashed.
+    @return: the frames, and the length of the bytes they take.
+    """
+    frames = []
+    offset = 0
+    while offset + _FRAME_HEADER.size <= len(data):
+        body_length, crc, frame_type = _FRAME_HEADER.unpack_from(data, offset)
+        body_offset = offset + _FRAME_HEADER.size
+        if body_length > _MAX_FRAME_BODY_LENGTH or body_offset + body_length > len(data):
+            break
+        body = data[body_offset:body_offset + body_length]
+        if zlib.crc32(bytes((frame_type,)) + body) != crc:
+            break
+        frames.append((frame_type, body))
+        offset = body_offset + body_length
+    return frames, offset
+
+
+class _JournaledDevice:
+    __slots__ = ("device_index", "device_identity", "parser_name", "history")
+
+    def __init__(self, device_index: int, device_identity: DeviceIdentity, parser_name: str, history: DataRecordHistory) -> None:
+        self.device_index = device_index
+        self.device_identity = device_identity
+        self.parser_name = parser_name
+        self.history = history
+
+
+class TelemetryJournal:
+    """
+    append-only journal of the parsed data records, so the devices' histories survive restarts.
+    the journal is a sequence of segment files of length prefixed, crc32 checked binary frames: a device
+    frame declares a device index once, then the record frames carry the index, the received epoch ms and
+    the data as json.
+    the appends only go to a memory buffer, which a background thread writes and fsyncs every `commit_interval_ms`
+    (group commit), so a crash loses at most the records of the last interval.
+    every `snapshot_interval_s` the thread switches to a new segment, compacts the files before it into a snapshot
+    file, which keeps only the latest records of each device up to its history capacity, and deletes those files,
+    so replaying on startup costs the snapshot plus the segments after it, regardless of the total traffic.
+    the snapshot is built from the journal files rather than from the histories, so appending to the journal
+    needs no lock in common with appending to the history.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 commit_interval_ms: int = 200,
+                 snapshot_interval_s: float = 600,
+                 logger: logging.Logger = None) -> None:
+        """
+        :param directory: where the segment and snapshot files are, created if not existed.
+        :param commit_interval_ms: the interval of writing and fsyncing the appended records.
+        :param snapshot_interval_s: the interval of taking the snapshot, only if any record was appended since the last one.
+        """
+        self.directory = directory
+        self.commit_interval_s = commit_interval_ms / 1000
+        self.snapshot_interval_s = snapshot_interval_s
+        self.logger = logger or logging.getLogger(
+            __class__.__name__+"Logger")
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # serializes the writes of the committing and the snapshot
+        self._io_lock = threading.Lock()
+        self._devices_by_key: dict[tuple, _JournaledDevice] = {}
+        self._pending = bytearray()
+        self._appended_count_since_snapshot = 0
+        self._segment_seq = max(self._list_seqs(_SEGMENT_FILE_NAME) +
+                                self._list_seqs(_SNAPSHOT_FILE_NAME), default=0)
+        self._segment_file = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.appended_count = 0
+
+    def replay(self, restore_history: Callable[[DeviceIdentity, str], Optional[DataRecordHistory]]) -> int:
+        """
+        load the latest snapshot and the segments after it, must be called before `start` and `append`.
+        :param restore_history: accepts the identity and the parser name of a journaled device, returns the history
+        to append its records to, like the one of the device twin added to the registry, None to skip the device.
+        @return: the number of replayed records.
+        """
+        file_names = self._list_live_file_names()
+        devices_by_index: dict[int, Optional[_JournaledDevice]] = {}
+        replayed_count = 0
+        for frame_type, body in self._read_files(file_names):
+            if frame_type == _FRAME_TYPE_RECORD:
+                device_index, received_epoch_ms = _RECORD_HEADER.unpack_from(
+                    body)
+                device = devices_by_index.get(device_index)
+                if device is not None:
+                    device.history.append({
+                        "received_datetime": datetime.fromtimestamp(received_epoch_ms / 1000, timezone.utc),
+                        "data": json.loads(body[_RECORD_HEADER.size:])})
+                    replayed_count += 1
+            elif frame_type == _FRAME_TYPE_DEVICE:
+                device_index, device_identity, parser_name = _decode_device(
+                    body)
+                devices_by_index[device_index] = self._restore_device(
+                    device_identity, parser_name, restore_history)
+        self.logger.info("Replayed %d records of %d devices from %d journal files",
+                         replayed_count, len(self._devices_by_key), len(file_names))
+        return replayed_count
+
+    def _restore_device(self, device_identity: DeviceIdentity, parser_name: str,
+                        restore_history: Callable[[DeviceIdentity, str], Optional[DataRecordHistory]]) -> Optional[_JournaledDevice]:
+        device = self._devices_by_key.get(device_identity.identity_key())
+        if device is not None:
+            return device
+        history = restore_history(device_identity, parser_name)
+        if history is None:
+            return None
+        device = self._devices_by_key[device_identity.identity_key()] = _JournaledDevice(
+            len(self._devices_by_key), device_identity, parser_name, history)
+        # the devices of the replayed segments are declared again in the new one, in case no snapshot is taken
+        self._pending += _encode_device(device.device_index,
+                                        device_identity, parser_name)
+        return device
+
+    def start(self) -> None:
+        """open a new segment and start the background thread"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._open_next_segment()
+        self._thread = threading.Thread(
+            target=self._work, name="telemetry-journal", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """commit the appended records and stop the background thread"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self._commit()
+        self._segment_file.close()
+        self._segment_file = None
+
+    def append(self, device_identity: DeviceIdentity, parser_name: str, history: DataRecordHistory, data_record: dict) -> None:
+        """
+        append the data record to the journal, could be called from any thread, the record is encoded out of the lock.
+        :param history: the history the record is appended to, its capacity bounds the records of the device in snapshot.
+        """
+        key = device_identity.identity_key()
+        # the device index is only fixed once declared, so the record body is encoded without it
+        encoded_record_body = _encode_record_body(data_record)
+        with self._lock:
+            device = self._devices_by_key.get(key)
+            if device is None or device.history is not history:
+                device = self._devices_by_key[key] = _JournaledDevice(
+                    len(self._devices_by_key) if device is None else device.device_index,
+                    device_identity, parser_name, history)
+                self._pending += _encode_device(device.device_index,
+                                                device_identity, parser_name)
+            self._pending += _encode_frame(_FRAME_TYPE_RECORD, _DEVICE_HEADER.pack(
+                device.device_index) + encoded_record_body)
+            self._appended_count_since_snapshot += 1
+            self.appended_count += 1
+
+    def take_snapshot(self) -> None:
+        """switch to a new segment, and write the histories as of the switch to the snapshot of it"""
+        with self._io_lock:
+            self._take_snapshot()
+
+    def _take_snapshot(self) -> None:
+        with self._lock:
+            pending = self._pending
+            self._pending = bytearray()
+            devices = list(self._devices_by_key.values())
+            self._appended_count_since_snapshot = 0
+            previous_segment_file = self._segment_file
+            snapshot_seq = self._open_next_segment()
+        self._write(previous_segment_file, pending)
+        previous_segment_file.close()
+
+        # compact the files before the new segment, the latest records of each device up to its history capacity
+        record_bodies_by_key: dict[tuple, deque[bytes]] = {
+            device.device_identity.identity_key(): deque(maxlen=device.history.max_count) for device in devices}
+        keys_by_index: dict[int, tuple] = {}
+        for frame_type, body in self._read_files(self._list_live_file_names(snapshot_seq)):
+            if frame_type == _FRAME_TYPE_RECORD:
+                device_index, = _DEVICE_HEADER.unpack_from(body)
+                record_bodies = record_bodies_by_key.get(
+                    keys_by_index.get(device_index))
+                if record_bodies is not None:
+                    record_bodies.append(body[_DEVICE_HEADER.size:])
+            elif frame_type == _FRAME_TYPE_DEVICE:
+                device_index, device_identity, _ = _decode_device(body)
+                keys_by_index[device_index] = device_identity.identity_key()
+
+        snapshot_file_name = self._snapshot_file_name(snapshot_seq)
+        with open(snapshot_file_name + ".tmp", "wb") as f:
+            for device in devices:
+                f.write(_encode_device(device.device_index,
+                        device.device_identity, device.parser_name))
+                encoded_device_index = _DEVICE_HEADER.pack(device.device_index)
+                f.write(b"".join(_encode_frame(_FRAME_TYPE_RECORD, encoded_device_index + record_body)
+                                 for record_body in record_bodies_by_key[device.device_identity.identity_key()]))
+            f.write(_encode_frame(_FRAME_TYPE_END, b""))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(snapshot_file_name + ".tmp", snapshot_file_name)
+        self._fsync_directory()
+        for seq in self._list_seqs(_SEGMENT_FILE_NAME):
+            if seq < snapshot_seq:
+                os.remove(self._segment_file_name(seq))
+        for seq in self._list_seqs(_SNAPSHOT_FILE_NAME):
+            if seq < snapshot_seq:
+                os.remove(self._snapshot_file_name(seq))
+        self.logger.info("Took journal snapshot %d of %d devices",
+                         snapshot_seq, len(devices))
+
+    def _work(self) -> None:
+        next_snapshot_time = time.monotonic() + self.snapshot_interval_s
+        while not self._stop_event.wait(self.commit_interval_s):
+            try:
+                if time.monotonic() >= next_snapshot_time:
+                    next_snapshot_time = time.monotonic() + self.snapshot_interval_s
+                    if self._appended_count_since_snapshot > 0:
+                        self.take_snapshot()
+                        continue
+                self._commit()
+            except Exception as e:
+                self.logger.exception(
+                    "Failed to write the telemetry journal: %s", e)
+
+    def _commit(self) -> None:
+        with self._io_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                pending = self._pending
+                self._pending = bytearray()
+                segment_file = self._segment_file
+            self._write(segment_file, pending)
+
+    @staticmethod
+    def _write(segment_file, pending: bytearray) -> None:
+        if pending:
+            segment_file.write(pending)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+
+    def _open_next_segment(self) -> int:
+        self._segment_seq += 1
+        self._segment_file = open(
+            self._segment_file_name(self._segment_seq), "ab")
+        return self._segment_seq
+
+    def _fsync_directory(self) -> None:
+        if hasattr(os, "O_DIRECTORY"):
+            directory_fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+
+    def _list_live_file_names(self, before_seq: Optional[int] = None) -> list[str]:
+        """the latest snapshot and the segments after it, only the files before `before_seq` if given"""
+        snapshot_seqs = [seq for seq in self._list_seqs(_SNAPSHOT_FILE_NAME)
+                         if before_seq is None or seq < before_seq]
+        file_names = []
+        if snapshot_seqs:
+            file_names.append(self._snapshot_file_name(snapshot_seqs[-1]))
+        file_names.extend(self._segment_file_name(seq) for seq in self._list_seqs(_SEGMENT_FILE_NAME)
+                          if (not snapshot_seqs or seq >= snapshot_seqs[-1]) and (before_seq is None or seq < before_seq))
+        return file_names
+
+    def _read_files(self, file_names: list[str]) -> Iterator[tuple[int, bytes]]:
+        """the (type, body) of the frames in the files, skipping the torn or corrupted tail of each"""
+        for file_name in file_names:
+            with open(file_name, "rb") as f:
+                data = f.read()
+            frames, valid_length = _read_frames(data)
+            if valid_length < len(data):
+                self.logger.warning("Skipped the torn or corrupted %d bytes at the end of journal file %s",
+                                    len(data) - valid_length, file_name)
+            yield from frames
+
+    def _list_seqs(self, file_name_pattern: re.Pattern) -> list[int]:
+        return sorted(int(match.group(1)) for match in map(file_name_pattern.match, os.listdir(self.directory)) if match)
+
+    def _segment_file_name(self, seq: int) -> str:
+        return os.path.join(self.directory, f"journal-{seq:08d}.bin")
+
+    def _snapshot_file_name(self, seq: int) -> str:
+        return os.path.join(self.directory, f"snapshot-{seq:08d}.bin")
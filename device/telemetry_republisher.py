@@ -0,0 +1,159 @@
+import logging
+import threading
+from typing import Callable, Optional
+
+from pydantic_core import to_json
+
+from models import DEVICE_TYPE, DeviceIdentity
+
+
+class TelemetryRepublisher:
+    """
+    re-publish the parsed data records to the MQTT broker, so the downstream systems subscribe the broker
+    rather than polling the hub, a device's records go to the topic: `<topic_prefix>/<dtu_sn>/<device_type>/<id>`,
+    where the id of the dtu itself is its dtu_sn.
+    the records are micro-batched: `submit` only puts the record in a pending map, which a background thread
+    publishes every `batch_interval_ms`, or once `max_batch_size` records are pending, each topic gets one
+    message per flush, a JSON array of its records, the oldest first, like:
+    [{"dtu_sn": ..., "device_type": ..., "device_physical_id": ..., "received_datetime": ..., "data": {...}}].
+    with `coalesce_latest`, only the latest record of a topic is kept in a flush, as the consumers of live values
+    don't need the intermediate ones.
+    """
+
+    def __init__(self,
+                 publish: Callable[[str, bytes, int], bool],
+                 topic_prefix: str = "dtu_hub",
+                 batch_interval_ms: int = 200,
+                 max_batch_size: int = 100,
+                 coalesce_latest: bool = True,
+                 qos: int = 0,
+                 max_pending_count: int = 10000,
+                 is_connected: Callable[[], bool] = None,
+                 logger: logging.Logger = None) -> None:
+        """
+        :param publish: publishes a message, accepts the topic, the payload and the qos, returns False on failure.
+        :param topic_prefix: the first level of the topics.
+        :param batch_interval_ms: the interval of publishing the pending records.
+        :param max_batch_size: publish once this many records are pending, and the max records of a message.
+        :param coalesce_latest: keep only the latest pending record of a topic.
+        :param qos: the MQTT qos of the messages, 0, 1 or 2.
+        :param max_pending_count: the records submitted beyond this are dropped, like when the broker is gone.
+        :param is_connected: the pending records are kept rather than published while it returns False.
+        """
+        if qos not in (0, 1, 2):
+            raise ValueError(f"qos must be 0, 1 or 2, but got: {qos}")
+        if max_batch_size <= 0:
+            raise ValueError("max_batch_size must be positive")
+        self.publish = publish
+        self.topic_prefix = topic_prefix
+        self.batch_interval_s = batch_interval_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.coalesce_latest = coalesce_latest
+        self.qos = qos
+        self.max_pending_count = max_pending_count
+        self.is_connected = is_connected
+        self.logger = logger or logging.getLogger(
+            __class__.__name__+"Logger")
+        self._lock = threading.Lock()
+        # topic -> the pending normalized records, the oldest first
+        self._pending_records_by_topic: dict[str, list[dict]] = {}
+        self._pending_count = 0
+        self._wake_event = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self.published_message_count = 0
+        self.coalesced_count = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+
+    def topic_of(self, device_identity: DeviceIdentity) -> str:
+        device_id = device_identity.dtu_sn if device_identity.device_type == DEVICE_TYPE.DTU \
+            else device_identity.device_physical_id
+        return f"{self.topic_prefix}/{device_identity.dtu_sn}/{device_identity.device_type.value}/{device_id}"
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._work, name="telemetry-republisher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """publish the pending records and stop the background thread"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, device_identity: DeviceIdentity, data_record: dict) -> None:
+        """called from the ingest path, which runs in the MQTT client thread or an ingest worker thread"""
+        topic = self.topic_of(device_identity)
+        record = {"dtu_sn": device_identity.dtu_sn,
+                  "device_type": device_identity.device_type,
+                  "device_physical_id": device_identity.device_physical_id,
+                  "received_datetime": data_record["received_datetime"],
+                  "data": data_record["data"]}
+        with self._lock:
+            records = self._pending_records_by_topic.get(topic)
+            if records is not None and self.coalesce_latest:
+                records[0] = record
+                self.coalesced_count += 1
+                return
+            if self._pending_count >= self.max_pending_count:
+                self.dropped_count += 1
+                return
+            if records is None:
+                self._pending_records_by_topic[topic] = [record]
+            else:
+                records.append(record)
+            self._pending_count += 1
+            if self._pending_count >= self.max_batch_size:
+                self._wake_event.set()
+
+    def flush(self) -> None:
+        """publish the pending records, a topic's records are kept for the next flush if publishing them failed"""
+        if self.is_connected is not None and not self.is_connected():
+            return
+        with self._lock:
+            if not self._pending_records_by_topic:
+                return
+            pending_records_by_topic = self._pending_records_by_topic
+            self._pending_records_by_topic = {}
+            self._pending_count = 0
+        for topic, records in pending_records_by_topic.items():
+            for offset in range(0, len(records), self.max_batch_size):
+                if self.publish(topic, to_json(records[offset:offset + self.max_batch_size]), self.qos):
+                    self.published_message_count += 1
+                    continue
+                self.failed_count += 1
+                self._put_back(topic, records[offset:])
+                break
+
+    def _put_back(self, topic: str, records: list[dict]) -> None:
+        with self._lock:
+            newer_records = self._pending_records_by_topic.get(topic)
+            if newer_records is not None and self.coalesce_latest:
+                return
+            self._pending_records_by_topic[topic] = records + \
+                (newer_records or [])
+            self._pending_count += len(records)
+
+    def _work(self) -> None:
+        last_dropped_count = 0
+        while True:
+            self._wake_event.wait(self.batch_interval_s)
+            self._wake_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.exception(
+                    "Failed to re-publish the telemetry: %s", e)
+            if self.dropped_count > last_dropped_count:
+                self.logger.warning("%d telemetry records were dropped from re-publishing, as %d ones were pending",
+                                    self.dropped_count - last_dropped_count, self.max_pending_count)
+                last_dropped_count = self.dropped_count
+            if self._stopping:
+                return
@@ -1,23 +1,60 @@
+import gzip
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
 class enhanced_rotating_file_handler(logging.handlers.TimedRotatingFileHandler, logging.handlers.RotatingFileHandler):
     '''
         cf http://stackoverflow.com/questions/29602352/how-to-mix-logging-handlers-file-timed-and-compress-log-in-the-same-config-f
 
          Spec:
          Log files limited in size & date. I.E. when the size or date is overtaken, there is a file rollover
+         The rollover only renames the file, the finished segment is compressed(gzip, or zstd if `zstandard`
+         is installed) by a background thread, and the backups are pruned by the total bytes `maxTotalBytes`
+         (and by `backupCount` if > 0) in that thread as well, so the logging thread never stalls on rotation.
+         maxTotalBytes = 0 keeps the original behavior: no compression, pruned by `backupCount` on rollover.
      '''
 
+    compression_extensions = {"gzip": ".gz", "zstd": ".zst"}
+
     ########################################
 
 
     def __init__(self, filename, mode = 'a', maxBytes = 0, backupCount = 0, encoding = None,
-             delay = 0, when = 'h', interval = 1, utc = False):
+             delay = 0, when = 'h', interval = 1, utc = False, maxTotalBytes = 0, compression = "gzip"):
 
         logging.handlers.TimedRotatingFileHandler.__init__(
         self, filename, when, interval, backupCount, encoding, delay, utc)
 
         logging.handlers.RotatingFileHandler.__init__(self, filename, mode, maxBytes, backupCount, encoding, delay)
 
+        if compression not in self.compression_extensions:
+            raise ValueError(f"Unsupported compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        self.maxTotalBytes = maxTotalBytes
+        self.compression = compression
+        self._compress_queue: queue.Queue = queue.Queue()
+        self._compress_thread = None
+        if self.maxTotalBytes > 0:
+            self.rotator = self._rotate_and_compress
+            self._compress_thread = threading.Thread(
+                target=self._compress_backups, name=f"{os.path.basename(self.baseFilename)}-compressor", daemon=True)
+            self._compress_thread.start()
+            # the segments left uncompressed when the process exited
+            for fileName in self._get_backup_file_names():
+                if not fileName.endswith(self.compression_extensions[self.compression]):
+                    self._compress_queue.put(fileName)
+            self._compress_queue.put(None)
+
      ########################################
 
     def computeRollover(self, currentTime):
@@ -26,6 +63,9 @@ class enhanced_rotating_file_handler(logging.handlers.TimedRotatingFileHandler,
     ########################################
 
     def getFilesToDelete(self):
+        if self.maxTotalBytes > 0:
+            # pruned by the compressor thread
+            return []
         return logging.handlers.TimedRotatingFileHandler.getFilesToDelete(self)
 
     ########################################
@@ -38,3 +78,107 @@ class enhanced_rotating_file_handler(logging.handlers.TimedRotatingFileHandler,
     def shouldRollover(self, record):
          """ Determine if rollover should occur. """
          return (logging.handlers.TimedRotatingFileHandler.shouldRollover(self, record) or logging.handlers.RotatingFileHandler.shouldRollover(self, record))
+
+    ########################################
+
+    def close(self):
+        """ stop the compressor once the queued segments are compressed, those left by a crash are compressed on next start """
+        if self._compress_thread is not None:
+            self._compress_queue.put(False)
+            self._compress_thread.join()
+            self._compress_thread = None
+        logging.handlers.TimedRotatingFileHandler.close(self)
+
+    ########################################
+
+    def rotation_filename(self, default_name):
+        name = logging.handlers.TimedRotatingFileHandler.rotation_filename(self, default_name)
+        if self.maxTotalBytes <= 0:
+            return name
+        # rolled over again within the same time suffix, while the last segment may be still waiting
+        # for the compressor, rather than overwriting it like the base one does
+        extension = self.compression_extensions[self.compression]
+        uniqueName = name
+        index = 1
+        while os.path.exists(uniqueName) or os.path.exists(uniqueName + extension):
+            uniqueName = f"{name}.{index}"
+            index += 1
+        return uniqueName
+
+    def _rotate_and_compress(self, source, dest):
+        # a rename, the compression is left to the compressor thread
+        if os.path.exists(source):
+            os.rename(source, dest)
+            self._compress_queue.put(dest)
+
+    def _compress_backups(self):
+        """ runs in the compressor thread, None asks for pruning only, False asks for stopping """
+        while True:
+            fileName = self._compress_queue.get()
+            try:
+                if fileName is False:
+                    return
+                if fileName is not None:
+                    try:
+                        self._compress(fileName)
+                    except Exception:
+                        self.handleError(logging.makeLogRecord(
+                            {"msg": f"Failed to compress log file {fileName}"}))
+                try:
+                    self._prune()
+                except Exception:
+                    self.handleError(logging.makeLogRecord(
+                        {"msg": f"Failed to prune the backups of {self.baseFilename}"}))
+            finally:
+                self._compress_queue.task_done()
+
+    def _compress(self, fileName):
+        compressedFileName = fileName + self.compression_extensions[self.compression]
+        tempFileName = compressedFileName + ".tmp"
+        with open(fileName, "rb") as source:
+            if self.compression == "zstd":
+                with open(tempFileName, "wb") as dest, \
+                        zstandard.ZstdCompressor().stream_writer(dest) as writer:
+                    shutil.copyfileobj(source, writer, 1024 * 1024)
+            else:
+                with gzip.open(tempFileName, "wb", compresslevel=6) as dest:
+                    shutil.copyfileobj(source, dest, 1024 * 1024)
+        # keep the time of the segment, the backups are pruned by it
+        shutil.copystat(fileName, tempFileName)
+        os.replace(tempFileName, compressedFileName)
+        os.remove(fileName)
+
+    def _prune(self):
+        """
+        delete the oldest compressed backups beyond `maxTotalBytes` or `backupCount`, the segments
+        still waiting in the queue are neither counted nor deleted, as they are not finished yet
+        """
+        extension = self.compression_extensions[self.compression]
+        backups = []
+        for fileName in self._get_backup_file_names():
+            if not fileName.endswith(extension):
+                continue
+            try:
+                stat = os.stat(fileName)
+            except FileNotFoundError:
+                continue
+            backups.append((stat.st_mtime, fileName, stat.st_size))
+        backups.sort()
+        totalBytes = sum(size for _, _, size in backups)
+        backupCount = len(backups)
+        for _, fileName, size in backups:
+            if totalBytes <= self.maxTotalBytes and (self.backupCount <= 0 or backupCount <= self.backupCount):
+                break
+            os.remove(fileName)
+            totalBytes -= size
+            backupCount -= 1
+
+    def _get_backup_file_names(self):
+        dirName, baseName = os.path.split(self.baseFilename)
+        prefix = baseName + "."
+        result = []
+        for fileName in os.listdir(dirName):
+            if fileName.startswith(prefix) and not fileName.endswith(".tmp") \
+                    and self.extMatch.match(fileName[len(prefix):].split(".")[0]):
+                result.append(os.path.join(dirName, fileName))
+        return result
@@ -1,7 +1,11 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
 import time
 from typing import List
 import uuid
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, Response, WebSocket, status, Request
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
@@ -11,21 +15,34 @@ import logging
 from logging.handlers import TimedRotatingFileHandler
 from pydantic import BaseModel
 import yaml
-from threading import Lock
 
 from models import *
 from device.simple_mqtt_client import SimpleMqttClient
+from device.ingest_pipeline import BACKPRESSURE_POLICY
+from device.data_record_history import DataRecordHistory, to_epoch_ms
+from device.device_registry import DeviceRegistry
+from device.latest_state_table import LatestStateTable
+from device.telemetry_broadcaster import TelemetryBroadcaster
+from device.telemetry_republisher import TelemetryRepublisher
+from device.reply_waiter import DeviceReplyWaiter
+from device.command_scheduler import DtuCommandQueueFullError, DtuCommandScheduler
 from fastapi.middleware import Middleware
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
 from paho.mqtt.client import PayloadType
-from device.protocol_parser.parser import DeviceProtocolParser
+from device.protocol_parser.parser import CHECKSUM_POLICY, DeviceProtocolParser, Probe_YiTong_TankTruck_Parser
+from device.probe_polling_engine import ProbePollingEngine
+from device.protocol_parser.parser_dispatcher import ParserDispatcher
+from device.telemetry_journal import TelemetryJournal
+from queue_logging import SampledLogger, TruncatedPayload, enable_queue_logging
 import inspect
 with open('log_config.yaml', 'r') as f:
     config = yaml.safe_load(f.read())
     logging.config.dictConfig(config)
+    if "queue_logging" in config:
+        enable_queue_logging(**config["queue_logging"])
 
 
-def _initialize_protocol_parsers() -> list[DeviceProtocolParser]:
+def _initialize_protocol_parsers(checksum_policy: CHECKSUM_POLICY) -> list[DeviceProtocolParser]:
     parser_classes = [
         cls for _, cls in inspect.getmembers(
             __import__('device.protocol_parser.parser', fromlist=['']),
@@ -33,52 +50,159 @@ def _initialize_protocol_parsers() -> list[DeviceProtocolParser]:
                 member, DeviceProtocolParser) and member is not DeviceProtocolParser
         )
     ]
-    return [parser_class() for parser_class in parser_classes]
+    parsers = [parser_class() for parser_class in parser_classes]
+    for parser in parsers:
+        parser.checksum_policy = checksum_policy
+    return parsers
 
 
 # Setup logging
 main_logger = logging.getLogger("mainLogger")
+# a dtu with wrong baud rate keeps sending garbage, log a few of its msgs per minute and a summary
+sampled_main_logger = SampledLogger(
+    main_logger, window_s=60, max_logged_count_per_window=5)
+
+# the probes only report when asked, poll them periodically, dtu_sn -> probe ids(1-99)
+PROBE_POLLING_TARGETS: dict[str, list[int]] = {}
+PROBE_POLLING_INTERVAL_S = 60
+PROBE_POLLING_REPLY_TIMEOUT_MS = 1000
+# the frames failed the checksum are dropped before decoding, and counted per device
+PARSER_CHECKSUM_POLICY = CHECKSUM_POLICY.Reject
+# the parsed data records are journaled here and replayed on startup, so the histories survive restarts,
+# in the container it must be on a volume, otherwise a redeploy loses it
+TELEMETRY_JOURNAL_DIRECTORY = os.environ.get(
+    "DTU_HUB_TELEMETRY_JOURNAL_DIRECTORY", "journal")
+# encode the `/device_data/` responses straight from the histories with the records' JSON cached,
+# rather than validating and encoding the models on each request
+DEVICE_DATA_FAST_JSON_RESPONSE = False
+# the live records queued for a slow websocket or SSE client beyond this are dropped, the oldest first
+TELEMETRY_STREAM_MAX_QUEUED_COUNT = 100
+# a comment is sent to an idle SSE client at this interval, so the proxies won't close the connection
+TELEMETRY_STREAM_KEEPALIVE_S = 15
+# re-publish the parsed records to the broker as dtu_hub/<dtu_sn>/<device_type>/<id>, for the downstream systems
+TELEMETRY_REPUBLISH_ENABLED = False
+TELEMETRY_REPUBLISH_BATCH_INTERVAL_MS = 200
+# only the latest record of a device is published in a batch interval
+TELEMETRY_REPUBLISH_COALESCE_LATEST = True
+TELEMETRY_REPUBLISH_QOS = 0
 
 device_protocol_parsers: list[DeviceProtocolParser] = _initialize_protocol_parsers(
-)
-devices: list[DeviceDigitalTwin] = []
+    PARSER_CHECKSUM_POLICY)
+parser_dispatcher = ParserDispatcher(device_protocol_parsers, main_logger)
+device_registry = DeviceRegistry()
+# what the dashboards poll, with the encoded response cached per dtu
+latest_state_table = LatestStateTable()
+# pushes the newly parsed records to the websocket and SSE clients
+telemetry_broadcaster = TelemetryBroadcaster()
+telemetry_journal = TelemetryJournal(
+    TELEMETRY_JOURNAL_DIRECTORY, commit_interval_ms=200, snapshot_interval_s=600, logger=main_logger)
+device_reply_waiter = DeviceReplyWaiter()
+# the probes on a dtu share one RS485 bus at 2400 baud, and drop the overlapped requests
+dtu_command_scheduler = DtuCommandScheduler(
+    min_frame_interval_ms=300, logger=main_logger)
 
 
 def on_msg_from_dtu_callback(topic: str, raw_msg: PayloadType):
     # if topic is like dtu/02500525101100024659/outbox
     # dtu_sn = topic.split('/')[1]
-    ever_parsed = False
-    for parser in device_protocol_parsers:
+    parser, device_identity, data_record = parser_dispatcher.dispatch(
+        topic, raw_msg)
+    on_data_record_parsed(topic, raw_msg, parser,
+                          device_identity, data_record)
+
+
+def on_msgs_from_dtu_callback(msgs: list[tuple[str, PayloadType]]):
+    """the msgs piled up in an ingest worker queue, parsed in batch"""
+    for (topic, raw_msg), (parser, device_identity, data_record) in zip(msgs, parser_dispatcher.dispatch_batch(msgs)):
+        # a msg failed to handle costs only itself, not the rest of the batch
         try:
-            device_identity, data_record = parser.TryParse(topic, raw_msg)
+            on_data_record_parsed(topic, raw_msg, parser,
+                                  device_identity, data_record)
         except Exception as e:
-            main_logger.exception(
-                f"Error parsing message from topic: {topic}, content: {raw_msg} with parser {parser.__class__.__name__}: {str(e)}")
-            continue
-        if device_identity is None:
-            continue
-        ever_parsed = True
-        existing_device_updated = False
-        for device in devices:
-            if device.equals_to_device_identity(device_identity):
-                existing_device_updated = True
-                device.last_device_msg_received_datetime = datetime.now(
-                    timezone.utc)
-                device.data_records.append(data_record)
-                # Keep only the latest N records
-                if len(device.data_records) > parser.max_keep_data_records_count:
-                    device.data_records = device.data_records[-parser.max_keep_data_records_count:]
-        if not existing_device_updated:
-            main_logger.info(f"Adding new device: {device_identity}")
-            new_device = DeviceDigitalTwin(
-                device_identity=device_identity,
-                last_device_msg_received_datetime=datetime.now(timezone.utc),
-                data_records=[data_record],
-            )
-            devices.append(new_device)
-    if not ever_parsed:
+            sampled_main_logger.log(
+                logging.ERROR, topic, "msgs failed to handle",
+                "Error handling message from topic: %s, content: %s: %s", topic, TruncatedPayload(raw_msg), e, exc_info=True)
+
+
+def on_data_record_parsed(topic: str, raw_msg: PayloadType, parser: DeviceProtocolParser, device_identity: DeviceIdentity, data_record: dict):
+    if device_identity is None:
+        # may be a fragment of a serial frame, or several frames merged by the dtu
+        reassembled_results = parser_dispatcher.reassemble(topic, raw_msg)
+        if reassembled_results:
+            for reassembled_result in reassembled_results:
+                on_data_record_parsed(topic, raw_msg, *reassembled_result)
+        elif parser_dispatcher.is_reassembling(topic):
+            sampled_main_logger.log(
+                logging.DEBUG, topic, "msgs buffered for reassembling",
+                "message from topic: %s, content: %s is buffered for reassembling frames", topic, TruncatedPayload(raw_msg))
+        else:
+            sampled_main_logger.log(
+                logging.WARNING, topic, "unparsed msgs",
+                "message from topic: %s, content: %s could not be parsed by any parser", topic, TruncatedPayload(raw_msg))
+        return
+    device, is_new_device = device_registry.get_or_add(
+        device_identity,
+        lambda: DeviceDigitalTwin(
+            device_identity=device_identity,
+            last_device_msg_received_datetime=datetime.now(timezone.utc),
+            data_records=parser.create_data_record_history(),
+        ))
+    if is_new_device:
+        main_logger.info("Adding new device: %s", device_identity)
+    device.last_device_msg_received_datetime = datetime.now(
+        timezone.utc)
+    device.checksum_error_count = parser.get_checksum_error_count(
+        device_identity.dtu_sn, device_identity.device_physical_id)
+    # the history keeps only the latest N records
+    device.data_records.append(data_record)
+    telemetry_journal.append(
+        device_identity, parser.__class__.__name__, device.data_records, data_record)
+    latest_state_table.update(device, data_record)
+    telemetry_broadcaster.publish(device_identity, data_record)
+    if telemetry_republisher is not None:
+        telemetry_republisher.submit(device_identity, data_record)
+    device_reply_waiter.resolve(device_identity, data_record)
+    probe_polling_engine.on_reading(device_identity)
+
+
+def on_frame_checksum_error(parser: DeviceProtocolParser, dtu_sn: str, device_physical_id: Optional[str], checksum_error_count: int):
+    """the frames rejected by the checksum never reach `on_data_record_parsed`, so the count is refreshed here"""
+    for device in device_registry.find(dtu_sn=dtu_sn, device_type=parser.device_type, device_physical_id=device_physical_id):
+        device.checksum_error_count = checksum_error_count
+        latest_state_table.update(device)
+
+
+for device_protocol_parser in device_protocol_parsers:
+    device_protocol_parser.on_checksum_error_callbacks.append(
+        lambda dtu_sn, device_physical_id, checksum_error_count, parser=device_protocol_parser:
+        on_frame_checksum_error(parser, dtu_sn, device_physical_id, checksum_error_count))
+
+
+def restore_device_from_journal(device_identity: DeviceIdentity, parser_name: str) -> Optional[DataRecordHistory]:
+    parser = next((parser for parser in device_protocol_parsers
+                   if parser.__class__.__name__ == parser_name), None)
+    if parser is None:
         main_logger.warning(
-            f"message from topic: {topic}, content: {raw_msg} could not be parsed by any parser")
+            "Skipped the journaled device %s, as its parser %s is gone", device_identity, parser_name)
+        return None
+    device, _ = device_registry.get_or_add(
+        device_identity,
+        lambda: DeviceDigitalTwin(
+            device_identity=device_identity,
+            data_records=parser.create_data_record_history(),
+        ))
+    return device.data_records
+
+
+# restore the histories before any msg comes in
+telemetry_journal.replay(restore_device_from_journal)
+for restored_device in device_registry:
+    latest_data_records = restored_device.data_records.latest()
+    if latest_data_records:
+        restored_device.last_device_msg_received_datetime = latest_data_records[
+            0]["received_datetime"]
+        latest_state_table.update(restored_device, latest_data_records[0])
+telemetry_journal.start()
 
 
 simple_mqtt_client = SimpleMqttClient(
@@ -88,13 +212,42 @@ simple_mqtt_client = SimpleMqttClient(
     mqtt_client_id=f"main_simple_mqtt_client_{uuid.getnode()}",
     username="test_user",
     password="test_pass",
-    on_message_callback=on_msg_from_dtu_callback,
+    on_message_batch_callback=on_msgs_from_dtu_callback,
     logger=main_logger,
     description="DTU Hub Main Simple MQTT Client",
+    # parse msgs out of the MQTT client thread, so a burst of msgs won't stall the broker connection
+    ingest_worker_count=4,
+    ingest_max_queued_msg_count=20000,
+    ingest_backpressure_policy=BACKPRESSURE_POLICY.DropOldest,
+    # parse the msgs piled up in a worker queue in one go
+    ingest_max_batch_size=64,
 )
 
 simple_mqtt_client.subscribe("dtu/+/outbox")
-app = FastAPI()
+
+telemetry_republisher: Optional[TelemetryRepublisher] = None
+if TELEMETRY_REPUBLISH_ENABLED:
+    telemetry_republisher = TelemetryRepublisher(
+        publish=simple_mqtt_client.publish,
+        batch_interval_ms=TELEMETRY_REPUBLISH_BATCH_INTERVAL_MS,
+        coalesce_latest=TELEMETRY_REPUBLISH_COALESCE_LATEST,
+        qos=TELEMETRY_REPUBLISH_QOS,
+        is_connected=simple_mqtt_client.client.is_connected,
+        logger=main_logger)
+    telemetry_republisher.start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    probe_polling_engine.start()
+    yield
+    await probe_polling_engine.stop()
+    sampled_main_logger.flush_summaries()
+    telemetry_journal.stop()
+    if telemetry_republisher is not None:
+        telemetry_republisher.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Hardcoded credentials
 USERNAME = "user"
@@ -158,32 +311,223 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 @app.get("/device_data/")
 async def query_device_data(
+        response: Response,
         dtu_sn: Optional[str] = "02500525102900023669",
         device_type: Optional[DEVICE_TYPE] = None,
         device_physical_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: Optional[int] = Query(None, ge=1),
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = Query(None),
         token: str = Depends(oauth2_scheme)) -> List[DeviceDigitalTwin]:
-    result_devices = []
-    for device in devices:
-        if device.device_identity.dtu_sn != dtu_sn:
-            continue
-        if device_type is not None and device.device_identity.device_type != device_type:
-            continue
-        if device_physical_id is not None and device.device_identity.device_physical_id != device_physical_id:
-            continue
-        result_devices.append(device)
-    return result_devices
+    """
+    query devices with their data records received in [`since`, `until`], the latest `limit` ones per device,
+    and only the `fields` kept in the `data` of records, the naive datetimes are taken as UTC.
+    if some device has more records than `limit`, the response header `X-Next-Cursor` is set, pass it as `cursor`
+    for the next(older) page, a page covers the same time span for all devices, so no record is repeated or missed.
+    """
+    before_epoch_ms = None if until is None else to_epoch_ms(until) + 1
+    if cursor is not None:
+        try:
+            cursor_epoch_ms = int(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid cursor: {cursor}")
+        before_epoch_ms = cursor_epoch_ms if before_epoch_ms is None else min(
+            before_epoch_ms, cursor_epoch_ms)
+    before = None if before_epoch_ms is None else datetime.fromtimestamp(
+        before_epoch_ms / 1000, timezone.utc)
+    devices = device_registry.find(
+        dtu_sn=dtu_sn, device_type=device_type, device_physical_id=device_physical_id)
+    if since is None and before is None and limit is None and fields is None:
+        return _to_device_data_response(devices)
+
+    pages = [device.data_records.query(since, before, limit, fields)
+             for device in devices]
+    # the page ends at the newest of the oldest records of the truncated devices, the records older than it
+    # from the other devices are left to the next page
+    next_cursor_epoch_ms = max((to_epoch_ms(records[0]["received_datetime"])
+                                for records, truncated in pages if truncated), default=None)
+    result = []
+    for device, (records, _) in zip(devices, pages):
+        if next_cursor_epoch_ms is not None:
+            records = [data_record for data_record in records
+                       if to_epoch_ms(data_record["received_datetime"]) >= next_cursor_epoch_ms]
+        result.append(device.model_copy(update={"data_records": DataRecordHistory(
+            max(len(records), 1), records)}))
+    if next_cursor_epoch_ms is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor_epoch_ms)
+    return _to_device_data_response(result, response)
+
+
+def _to_device_data_response(devices: List[DeviceDigitalTwin], response: Optional[Response] = None):
+    if not DEVICE_DATA_FAST_JSON_RESPONSE:
+        return devices
+    # the headers set on the injected `response` are not applied to a returned one
+    headers = {} if response is None or "X-Next-Cursor" not in response.headers else {
+        "X-Next-Cursor": response.headers["X-Next-Cursor"]}
+    return Response(content=b"[" + b",".join(device.to_json() for device in devices) + b"]",
+                    media_type="application/json", headers=headers)
+
+
+@app.get("/device_state", response_model=List[DeviceState])
+async def query_device_state(
+        dtu_sn: Optional[str] = None,
+        token: str = Depends(oauth2_scheme)) -> Response:
+    """
+    the latest state of each device of the dtu, or of the whole fleet if no `dtu_sn`.
+    the encoded response is cached per dtu until a device of it reports again.
+    """
+    return Response(content=latest_state_table.get_json(dtu_sn), media_type="application/json")
+
+
+def _is_valid_access_token(token: str) -> bool:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return payload.get("sub") == USERNAME
 
 
-# Dictionary to store locks for each dtu_sn
-dtu_locks = {}
-# Global lock to synchronize access to dtu_locks
-global_lock = Lock()
+@app.websocket("/ws/telemetry")
+async def stream_telemetry_over_websocket(
+        websocket: WebSocket,
+        dtu_sn: Optional[str] = None,
+        device_type: Optional[DEVICE_TYPE] = None,
+        device_physical_id: Optional[str] = None,
+        token: Optional[str] = None):
+    """
+    push each newly parsed data record of the matched devices as a text message of JSON like:
+    {"device_identity": {...}, "data_record": {...}}, the browsers can't set headers for websocket,
+    so the access token is passed by the `token` query parameter.
+    """
+    if token is None or not _is_valid_access_token(token):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    subscription = telemetry_broadcaster.subscribe(
+        dtu_sn, device_type, device_physical_id, TELEMETRY_STREAM_MAX_QUEUED_COUNT)
+    main_logger.info("Websocket client %s subscribed telemetry of dtu_sn: %s, device_type: %s, device_physical_id: %s",
+                     websocket.client, dtu_sn, device_type, device_physical_id)
+    # keep receiving, so the client leaving is noticed even no record is pushed
+    receive_task = asyncio.create_task(websocket.receive())
+    try:
+        while True:
+            get_task = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait({get_task, receive_task}, return_when=asyncio.FIRST_COMPLETED)
+            if get_task in done:
+                await websocket.send_text(get_task.result().decode())
+            else:
+                get_task.cancel()
+            if receive_task in done:
+                if receive_task.result()["type"] == "websocket.disconnect":
+                    break
+                # the msgs from client are ignored
+                receive_task = asyncio.create_task(websocket.receive())
+    except Exception as e:
+        main_logger.debug("Websocket client %s left: %s", websocket.client, e)
+    finally:
+        receive_task.cancel()
+        telemetry_broadcaster.unsubscribe(subscription)
+        main_logger.info("Websocket client %s unsubscribed telemetry, %d records dropped as it was slow",
+                         websocket.client, subscription.dropped_count)
+
+
+@app.get("/sse/telemetry")
+async def stream_telemetry_over_sse(
+        dtu_sn: Optional[str] = None,
+        device_type: Optional[DEVICE_TYPE] = None,
+        device_physical_id: Optional[str] = None,
+        token: str = Depends(oauth2_scheme)) -> StreamingResponse:
+    """
+    server-sent events of the newly parsed data records of the matched devices, the `data` of an event is
+    the JSON like: {"device_identity": {...}, "data_record": {...}}.
+    """
+    async def stream_events():
+        subscription = telemetry_broadcaster.subscribe(
+            dtu_sn, device_type, device_physical_id, TELEMETRY_STREAM_MAX_QUEUED_COUNT)
+        try:
+            while True:
+                try:
+                    encoded_record = await asyncio.wait_for(subscription.get(), TELEMETRY_STREAM_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"data: " + encoded_record + b"\n\n"
+        finally:
+            telemetry_broadcaster.unsubscribe(subscription)
+            main_logger.info("SSE client unsubscribed telemetry, %d records dropped as it was slow",
+                             subscription.dropped_count)
+
+    return StreamingResponse(stream_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def send_frame_and_wait_reply(
+        device_identity: DeviceIdentity,
+        raw_msg: PayloadType,
+        reply_timeout_ms: int,
+        raise_on_timeout: bool) -> Optional[dict]:
+    """
+    the command run by `dtu_command_scheduler`, the reply is awaited even if the caller is not interested in it,
+    so the bus is kept for the reply rather than being overlapped by the next request.
+    """
+    reply_future = device_reply_waiter.expect_reply(device_identity)
+    try:
+        simple_mqtt_client.publish(
+            f"dtu/{device_identity.dtu_sn}/inbox", raw_msg)
+        return await asyncio.wait_for(reply_future, reply_timeout_ms / 1000)
+    except asyncio.TimeoutError:
+        if raise_on_timeout:
+            raise
+        main_logger.debug("No reply from device %s of DTU %s in %dms",
+                          device_identity.device_physical_id, device_identity.dtu_sn, reply_timeout_ms)
+        return None
+    finally:
+        device_reply_waiter.discard(device_identity, reply_future)
+
+
+def _log_command_error(command_future: asyncio.Future) -> None:
+    if not command_future.cancelled() and command_future.exception() is not None:
+        main_logger.error(
+            "Error processing device request: %s", command_future.exception())
+
+
+async def poll_probe(dtu_sn: str, probe_id: str, raw_msg: bytes) -> None:
+    device_identity = DeviceIdentity(
+        name="", dtu_sn=dtu_sn, device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, device_physical_id=probe_id)
+    dtu_command_scheduler.submit(
+        dtu_sn,
+        lambda: send_frame_and_wait_reply(device_identity, raw_msg, PROBE_POLLING_REPLY_TIMEOUT_MS, raise_on_timeout=False)
+    ).add_done_callback(_log_command_error)
+
+
+probe_polling_engine = ProbePollingEngine(
+    parser=next(parser for parser in device_protocol_parsers
+                if isinstance(parser, Probe_YiTong_TankTruck_Parser)),
+    send_frame=poll_probe,
+    targets=PROBE_POLLING_TARGETS,
+    interval_s=PROBE_POLLING_INTERVAL_S,
+    # a dtu's bus holds a poll for up to the reply timeout, so the polls not fitting the interval are skipped
+    is_dtu_busy=lambda dtu_sn: dtu_command_scheduler.queued_command_count(
+        dtu_sn) > 0,
+    logger=main_logger,
+)
 
 
 @app.post("/device_request")
-async def send_device_request(request: DeviceRequest, token: str = Depends(oauth2_scheme)):
+async def send_device_request(
+        request: DeviceRequest,
+        wait_for_reply: bool = False,
+        reply_timeout_ms: int = 3000,
+        token: str = Depends(oauth2_scheme)) -> Optional[dict]:
+    """
+    send request to device, if `wait_for_reply`, the data record parsed from the device reply is returned,
+    otherwise returns nothing once the request is queued, and the reply could be queried later via `/device_data/`.
+    requests to the same dtu are sent one by one, as its sub-devices share one bus.
+    """
     target_dtu_sn = request.device_identity.dtu_sn
-    main_logger.debug(f"Sending device request: {request}")
+    main_logger.debug("Sending device request: %s", request)
 
     try:
         parser = next(
@@ -196,23 +540,39 @@ async def send_device_request(request: DeviceRequest, token: str = Depends(oauth
         except Exception as e:
             raise ValueError(
                 f"Failed to serialize request for device type {request.device_identity.device_type} with parser, detail: {str(e)}")
-        simple_mqtt_client.publish(
-            f"dtu/{request.device_identity.dtu_sn}/inbox", raw_msg)
     except Exception as e:
         main_logger.exception(
-            f"Error processing request for DTU {target_dtu_sn}: {e}")
+            "Error processing request for DTU %s: %s", target_dtu_sn, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Internal server error while processing request for DTU {target_dtu_sn}, detail: {str(e)}"
         )
 
+    try:
+        command_future = dtu_command_scheduler.submit(
+            target_dtu_sn,
+            lambda: send_frame_and_wait_reply(request.device_identity, raw_msg, reply_timeout_ms, raise_on_timeout=wait_for_reply))
+    except DtuCommandQueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    if not wait_for_reply:
+        command_future.add_done_callback(_log_command_error)
+        return None
+    try:
+        return await command_future
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"Timeout to receive reply from device {request.device_identity.device_physical_id} of DTU {target_dtu_sn} in {reply_timeout_ms}ms"
+        )
+
 
 @app.middleware("http")
 async def log_request_data(request: Request, call_next):
     client_ip = request.client.host
     user_agent = request.headers.get('user-agent', 'unknown')
     main_logger.info(
-        f"Handle HTTP Request from {client_ip} with User-Agent: {user_agent}")
+        "Handle HTTP Request from %s with User-Agent: %s", client_ip, user_agent)
     response = await call_next(request)
     return response
 
@@ -2,7 +2,9 @@ from datetime import datetime, timezone
 from enum import Enum
 from typing import List, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from device.data_record_history import DataRecordHistory
 
 class DEVICE_TYPE(str, Enum):
     DTU = "DTU"
@@ -27,6 +29,10 @@ class DeviceIdentity(BaseModel):
     # likely only sub-device uses this field
     device_physical_id: Optional[str] = None
 
+    def identity_key(self) -> tuple:
+        """hashable key which identifies a device, used for indexing devices in registry"""
+        return (self.dtu_sn, self.device_type, self.name, self.device_physical_id)
+
 
 class DeviceRequest(BaseModel):
     device_identity: DeviceIdentity = DeviceIdentity(
@@ -55,11 +61,30 @@ class DeviceDigitalTwin(BaseModel):
     device_identity: DeviceIdentity
 
     last_device_msg_received_datetime: Optional[datetime] = None
+    # the frames from the device failed the checksum, refreshed on each data record
+    checksum_error_count: int = 0
     description: Optional[str] = None
-    data_records: Optional[List[dict]] = []
+    data_records: DataRecordHistory = Field(default_factory=DataRecordHistory)
+
+    def to_json(self) -> bytes:
+        """
+        same as `model_dump_json()`, but the records are encoded by the history, which skips the
+        validation and the records encoded before, for the large responses.
+        """
+        encoded_fields = self.model_dump_json(exclude={"data_records"}).encode()
+        return encoded_fields[:-1] + b',"data_records":' + self.data_records.to_json() + b"}"
 
     def equals_to_device_identity(self, device_identity: DeviceIdentity) -> bool:
         return self.device_identity.dtu_sn == device_identity.dtu_sn and \
             self.device_identity.device_type == device_identity.device_type and \
             self.device_identity.name == device_identity.name and \
             self.device_identity.device_physical_id == device_identity.device_physical_id
+
+
+class DeviceState(BaseModel):
+    """the latest state of a device, which is what the dashboards poll for"""
+    device_identity: DeviceIdentity
+
+    last_device_msg_received_datetime: Optional[datetime] = None
+    checksum_error_count: int = 0
+    latest_data_record: Optional[dict] = None
@@ -0,0 +1,174 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+from threading import Lock
+from typing import Callable, Iterable
+
+
+class TruncatedPayload:
+    """
+    a msg payload as the %-style arg of a log record, only formatted when the record is emitted, and
+    with at most `max_length` leading bytes(or chars), so logging a large payload costs the caller nothing.
+    """
+    __slots__ = ("payload", "max_length")
+
+    def __init__(self, payload, max_length: int = 100) -> None:
+        self.payload = payload
+        self.max_length = max_length
+
+    def __str__(self) -> str:
+        payload = self.payload
+        if isinstance(payload, (bytes, bytearray, str)) and len(payload) > self.max_length:
+            return f"{payload[:self.max_length]}...({len(payload)} in total)"
+        return str(payload)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    puts the records into a bounded queue drained by a listener thread, which runs the actual handlers.
+    unlike the base one, the record is not formatted here, the msg, args and exception are all formatted
+    in the listener thread, so the args must not be mutated after logging.
+    the records are dropped and counted when the queue is full, rather than blocking the caller.
+    """
+
+    def __init__(self, record_queue: queue.Queue) -> None:
+        super().__init__(record_queue)
+        self.dropped_record_count = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_record_count += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # the base one uses put_nowait, which fails on a full bounded queue, while
+        # the listener thread is still draining it
+        self.queue.put(self._sentinel)
+
+    def stop(self) -> None:
+        # could be stopped before exit
+        if self._thread is not None:
+            super().stop()
+
+
+def enable_queue_logging(loggers: Iterable[str], max_queued_record_count: int = 10000) -> list[logging.handlers.QueueListener]:
+    """
+    move the handlers of the loggers to a background listener thread for each logger, the logger keeps
+    only a `NonBlockingQueueHandler`, so the disk I/O and formatting are off the logging thread.
+    must be called after `logging.config.dictConfig`, the listeners are stopped at exit, which flushes
+    the queued records.
+    """
+    listeners = []
+    for logger_name in loggers:
+        logger = logging.getLogger(logger_name)
+        handlers = [handler for handler in logger.handlers
+                    if not isinstance(handler, NonBlockingQueueHandler)]
+        if not handlers:
+            continue
+        record_queue = queue.Queue(maxsize=max_queued_record_count)
+        queue_handler = NonBlockingQueueHandler(record_queue)
+        # the records no handler would emit are not queued at all
+        queue_handler.setLevel(min(handler.level for handler in handlers))
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(queue_handler)
+        listener = _QueueListener(
+            record_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        listeners.append(listener)
+    return listeners
+
+
+class _SampleWindow:
+    __slots__ = ("start_time", "level", "count", "logged_count")
+
+    def __init__(self, start_time: float, level: int) -> None:
+        self.start_time = start_time
+        self.level = level
+        self.count = 0
+        self.logged_count = 0
+
+
+class SampledLogger:
+    """
+    log the records of each (key, subject), like a dtu topic and the reason, at most `max_logged_count_per_window`
+    times per window, the rest are only counted, and once the window ends, a summary is logged if
+    any was suppressed, like: "dtu/X/outbox: 4812 unparsed msgs in last 60s, 5 logged".
+    so a misconfigured device flooding the same record costs a few lines per window.
+    the summaries are logged by the later `log` calls or by `flush_summaries`, rather than a timer thread.
+    """
+
+    def __init__(self,
+                 logger: logging.Logger,
+                 window_s: float = 60,
+                 max_logged_count_per_window: int = 5,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.logger = logger
+        self.window_s = window_s
+        self.max_logged_count_per_window = max_logged_count_per_window
+        self.clock = clock
+        self._lock = Lock()
+        self._windows: dict[tuple[str, str], _SampleWindow] = {}
+        self._next_sweep_time = clock() + window_s
+
+    def log(self, level: int, key: str, subject: str, msg: str, *args, exc_info=None) -> bool:
+        """
+        :param key: what the records are about, like the topic "dtu/001/outbox", shown in the summary.
+        :param subject: what is counted, like "unparsed msgs", shown in the summary.
+        @return: whether the record is logged rather than suppressed.
+        """
+        if not self.logger.isEnabledFor(level):
+            return False
+        now = self.clock()
+        with self._lock:
+            summaries = self._sweep(now) if now >= self._next_sweep_time else []
+            window = self._windows.get((key, subject))
+            if window is not None and now - window.start_time >= self.window_s:
+                summaries.append(self._summarize(key, subject, window))
+                window = None
+            if window is None:
+                window = self._windows[(key, subject)] = _SampleWindow(
+                    now, level)
+            window.count += 1
+            should_log = window.logged_count < self.max_logged_count_per_window
+            if should_log:
+                window.logged_count += 1
+        self._log_summaries(summaries)
+        if should_log:
+            self.logger.log(level, msg, *args, exc_info=exc_info)
+        return should_log
+
+    def flush_summaries(self) -> None:
+        """log the summaries of all the windows, ended or not"""
+        with self._lock:
+            summaries = self._sweep(None)
+        self._log_summaries(summaries)
+
+    def _sweep(self, now) -> list[tuple]:
+        """remove the windows ended by `now`(all if None), @return: their summaries"""
+        summaries = []
+        for (key, subject), window in list(self._windows.items()):
+            if now is None or now - window.start_time >= self.window_s:
+                del self._windows[(key, subject)]
+                summaries.append(self._summarize(key, subject, window))
+        if now is not None:
+            self._next_sweep_time = now + self.window_s
+        return summaries
+
+    def _summarize(self, key: str, subject: str, window: _SampleWindow) -> tuple:
+        return (window.level, key, window.count, subject, self.window_s, window.logged_count)
+
+    def _log_summaries(self, summaries: list[tuple]) -> None:
+        for level, key, count, subject, window_s, logged_count in summaries:
+            if count > logged_count:
+                self.logger.log(level, "%s: %d %s in last %ds, %d logged",
+                                key, count, subject, window_s, logged_count)
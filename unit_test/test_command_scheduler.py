@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+from device.command_scheduler import DtuCommandQueueFullError, DtuCommandScheduler
+
+
+class TestDtuCommandScheduler(unittest.TestCase):
+
+    def test_commands_to_a_dtu_are_serialized_and_paced(self):
+        async def run_test():
+            scheduler = DtuCommandScheduler(
+                min_frame_interval_ms=50, logger=MagicMock())
+            loop = asyncio.get_running_loop()
+            running: dict[str, int] = {}
+            timeline: list[tuple[str, float, float]] = []
+
+            def create_command(dtu_sn: str, result: int):
+                async def command():
+                    running[dtu_sn] = running.get(dtu_sn, 0) + 1
+                    self.assertEqual(running[dtu_sn], 1)
+                    start = loop.time()
+                    await asyncio.sleep(0.02)
+                    running[dtu_sn] -= 1
+                    timeline.append((dtu_sn, start, loop.time()))
+                    return result
+                return command
+
+            start = loop.time()
+            futures = [scheduler.submit(dtu_sn, create_command(dtu_sn, i))
+                       for i in range(3) for dtu_sn in ["001", "002"]]
+            results = await asyncio.gather(*futures)
+            self.assertEqual(results, [0, 0, 1, 1, 2, 2])
+            # 3 commands of 20ms with 2 gaps of 50ms for each dtu, and the dtus run in parallel
+            self.assertLess(loop.time() - start, 0.3)
+            for dtu_sn in ["001", "002"]:
+                dtu_timeline = [t for t in timeline if t[0] == dtu_sn]
+                for previous, current in zip(dtu_timeline, dtu_timeline[1:]):
+                    self.assertGreaterEqual(
+                        current[1] - previous[2], 0.045)
+        asyncio.run(run_test())
+
+    def test_command_exception_is_propagated(self):
+        async def run_test():
+            scheduler = DtuCommandScheduler(
+                min_frame_interval_ms=0, logger=MagicMock())
+
+            async def failed_command():
+                raise asyncio.TimeoutError()
+
+            async def command():
+                return 1
+            with self.assertRaises(asyncio.TimeoutError):
+                await scheduler.submit("001", failed_command)
+            self.assertEqual(await scheduler.submit("001", command), 1)
+        asyncio.run(run_test())
+
+    def test_queue_full(self):
+        async def run_test():
+            scheduler = DtuCommandScheduler(
+                max_queued_command_count=1, logger=MagicMock())
+
+            async def command():
+                return 1
+            future = scheduler.submit("001", command)
+            with self.assertRaises(DtuCommandQueueFullError):
+                scheduler.submit("001", command)
+            self.assertEqual(await future, 1)
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from device.data_record_history import ColumnarDataRecordHistory, DataRecordHistory
+from device.protocol_parser.parser import CHECKSUM_POLICY, GenericTimelyReportGpsDtuDeviceParser, GnrmcFix, Probe_YiTong_TankTruck_Parser
+from models import DEVICE_TYPE, DeviceDigitalTwin, DeviceIdentity
+
+
+class TestDataRecordHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.start_datetime = datetime(2025, 11, 11, tzinfo=timezone.utc)
+        self.history = DataRecordHistory(3)
+        for i in range(5):
+            self.history.append({"received_datetime": self.start_datetime + timedelta(seconds=i),
+                                 "data": {"M1": i}})
+
+    def test_append_evicts_oldest(self):
+        self.assertEqual(len(self.history), 3)
+        self.assertEqual([r["data"]["M1"] for r in self.history], [2, 3, 4])
+        self.assertEqual(self.history[-1]["data"]["M1"], 4)
+
+    def test_latest_and_since(self):
+        self.assertEqual([r["data"]["M1"]
+                         for r in self.history.latest(2)], [3, 4])
+        self.assertEqual([r["data"]["M1"]
+                         for r in self.history.latest(10)], [2, 3, 4])
+        self.assertEqual(self.history.latest(0), [])
+        self.assertEqual([r["data"]["M1"] for r in self.history.since(
+            self.start_datetime + timedelta(seconds=3))], [3, 4])
+        self.assertEqual(self.history.since(
+            self.start_datetime + timedelta(seconds=10)), [])
+
+    def test_serialize_with_device_digital_twin(self):
+        device = DeviceDigitalTwin(
+            device_identity=DeviceIdentity(
+                name="test", dtu_sn="001", device_type=DEVICE_TYPE.DTU),
+            data_records=self.history)
+        self.assertIs(device.data_records, self.history)
+        dumped = device.model_dump(mode="json")
+        self.assertEqual([r["data"]["M1"]
+                         for r in dumped["data_records"]], [2, 3, 4])
+        self.assertIsInstance(dumped["data_records"][0]["received_datetime"], str)
+
+        restored = DeviceDigitalTwin.model_validate_json(
+            device.model_dump_json())
+        self.assertIsInstance(restored.data_records, DataRecordHistory)
+        self.assertEqual(len(restored.data_records), 3)
+
+    def test_query_by_time_range_and_limit(self):
+        records, truncated = self.history.query(
+            since=self.start_datetime + timedelta(seconds=3))
+        self.assertEqual(([r["data"]["M1"] for r in records], truncated), ([3, 4], False))
+        records, truncated = self.history.query(
+            before=self.start_datetime + timedelta(seconds=4), limit=1)
+        self.assertEqual(([r["data"]["M1"] for r in records], truncated), ([3], True))
+        records, truncated = self.history.query(limit=3)
+        self.assertEqual(([r["data"]["M1"] for r in records], truncated), ([2, 3, 4], False))
+
+    def test_query_keeps_records_of_same_ms_in_one_page(self):
+        history = DataRecordHistory(5)
+        for i in range(4):
+            history.append({"received_datetime": self.start_datetime + timedelta(seconds=i // 2),
+                            "data": {"M1": i}})
+        records, truncated = history.query(limit=1)
+        self.assertEqual(([r["data"]["M1"] for r in records], truncated), ([2, 3], True))
+
+    def test_query_projects_fields(self):
+        self.history.append({"received_datetime": self.start_datetime + timedelta(seconds=5),
+                             "data": {"M1": 5, "M2": 6}})
+        records, _ = self.history.query(limit=1, fields=["M2"])
+        self.assertEqual(records[0]["data"], {"M2": 6})
+        # the stored record is not touched
+        self.assertEqual(self.history[-1]["data"], {"M1": 5, "M2": 6})
+
+
+class TestColumnarDataRecordHistory(unittest.TestCase):
+
+    def test_probe_readings_round_trip(self):
+        parser = Probe_YiTong_TankTruck_Parser()
+        history = parser.create_data_record_history()
+        self.assertIsInstance(history, ColumnarDataRecordHistory)
+        parsed_records = []
+        for i in range(parser.max_keep_data_records_count + 5):
+            _, data_record = parser.TryParse("dtu/001/outbox", bytes.fromhex(
+                "aa0101020179589999990011470209960991099912bb"))
+            data_record["data"]["M1"] = i
+            data_record["received_datetime"] = datetime(
+                2025, 11, 11, tzinfo=timezone.utc) + timedelta(seconds=i)
+            parsed_records.append(data_record)
+            history.append(data_record)
+        self.assertEqual(len(history), parser.max_keep_data_records_count)
+        self.assertEqual(history.to_list(
+        ), parsed_records[-parser.max_keep_data_records_count:])
+        self.assertEqual(history[0], parsed_records[5])
+        self.assertEqual(history[-1], parsed_records[-1])
+        self.assertEqual(history.latest(2), parsed_records[-2:])
+        self.assertEqual(history.since(
+            parsed_records[-3]["received_datetime"]), parsed_records[-3:])
+
+    def test_gps_fixes_round_trip(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        history = parser.create_data_record_history()
+        _, data_record = parser.TryParse(
+            "dtu/001/outbox", b"$GNRMC,111700.00,A,2906.78084,N,11207.29890,E,0.114,,111125,,,A,V*10")
+        data_record["received_datetime"] = datetime(
+            2025, 11, 11, 1, 2, 3, 456000, tzinfo=timezone.utc)
+        history.append(data_record)
+        self.assertEqual(history.latest(), [data_record])
+
+    def test_gps_fixes_decoded_from_columns(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        parser.checksum_policy = CHECKSUM_POLICY.KeepAndFlag
+        history = parser.create_data_record_history()
+        data_records = [parser.TryParse("dtu/001/outbox", sentence)[1] for sentence in (
+            b"$GNRMC,111700.00,A,2906.78084,S,11207.29890,W,0.1145,,111125,,,A,V*2A",
+            # checksum error, and the unknown status
+            b"$GNRMC,111700.00,X,2906.78084,N,11207.29890,E,,,111125,,,N*00")]
+        for data_record in data_records:
+            history.append(data_record)
+        with patch("device.protocol_parser.parser.GnrmcFix.parse") as parse:
+            self.assertEqual([record["data"] for record in history.latest(2)],
+                             [data_record["data"] for data_record in data_records])
+            parse.assert_not_called()
+        self.assertEqual([data_record["data"]["校验状态"] for data_record in data_records], ["OK", "ERROR"])
+        self.assertEqual(data_records[1]["data"]["定位状态"], "未知(X)")
+        records, _ = history.query(fields=["定位状态", "校验状态", "地面速度(km/h)"])
+        self.assertEqual([record["data"] for record in records],
+                         [{key: data_record["data"][key] for key in ("定位状态", "校验状态", "地面速度(km/h)")}
+                          for data_record in data_records])
+
+    def test_query_same_as_plain_history(self):
+        parser = Probe_YiTong_TankTruck_Parser()
+        history = parser.create_data_record_history()
+        plain_history = DataRecordHistory(parser.max_keep_data_records_count)
+        for i in range(parser.max_keep_data_records_count + 5):
+            _, data_record = parser.TryParse("dtu/001/outbox", bytes.fromhex(
+                "aa0101020179589999990011470209960991099912bb"))
+            data_record["data"]["M1"] = i
+            data_record["received_datetime"] = datetime(
+                2025, 11, 11, tzinfo=timezone.utc) + timedelta(milliseconds=500 * (i // 2) + 1)
+            history.append(data_record)
+            plain_history.append(data_record)
+        since = datetime(2025, 11, 11, 0, 0, 10, tzinfo=timezone.utc)
+        for kwargs in [{}, {"limit": 3}, {"since": since}, {"since": since, "before": since + timedelta(seconds=5), "limit": 4},
+                       {"limit": 2, "fields": ["M1", "温度"]}]:
+            self.assertEqual(history.query(**kwargs),
+                             plain_history.query(**kwargs), kwargs)
+
+    def test_query_gps_plain_fields_without_parsing_sentence(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        history = parser.create_data_record_history()
+        _, data_record = parser.TryParse(
+            "dtu/001/outbox", b"$GNRMC,111700.00,A,2906.78084,N,11207.29890,E,0.114,,111125,,,A,V*10")
+        history.append(data_record)
+        with patch("device.protocol_parser.parser.GnrmcFix.parse") as parse:
+            records, _ = history.query(fields=["纬度", "经度"])
+            parse.assert_not_called()
+        self.assertEqual(records[0]["data"], {
+                         "纬度": 29.113014, "经度": 112.121648})
+        records, _ = history.query(fields=["纬度", "定位状态"])
+        self.assertEqual(records[0]["data"], {
+                         "定位状态": "有效定位", "纬度": 29.113014})
+
+    def test_to_json_same_as_pydantic_serialized(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        history = parser.create_data_record_history()
+        device = DeviceDigitalTwin(
+            device_identity=DeviceIdentity(
+                name="test", dtu_sn="001", device_type=DEVICE_TYPE.DTU),
+            data_records=history)
+        _, data_record = parser.TryParse(
+            "dtu/001/outbox", b"$GNRMC,111700.00,A,2906.78084,N,11207.29890,E,0.114,,111125,,,A,V*10")
+        for i in range(parser.max_keep_data_records_count + 3):
+            history.append(
+                {**data_record, "received_datetime": datetime(2025, 11, 11, tzinfo=timezone.utc) + timedelta(seconds=i)})
+            if i % 40 == 0:
+                self.assertEqual(device.to_json(),
+                                 device.model_dump_json().encode())
+        self.assertEqual(device.to_json(), device.model_dump_json().encode())
+
+    def test_to_json_encodes_only_appended_records(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        history = parser.create_data_record_history()
+        _, data_record = parser.TryParse(
+            "dtu/001/outbox", b"$GNRMC,111700.00,A,2906.78084,N,11207.29890,E,0.114,,111125,,,A,V*10")
+        for _ in range(5):
+            history.append(data_record)
+        history.to_json()
+        history.append(data_record)
+        with patch.object(parser.data_record_codec, "decode", wraps=parser.data_record_codec.decode) as decode:
+            self.assertEqual(len(json.loads(history.to_json())), 6)
+            self.assertEqual(decode.call_count, 1)
+
+    def test_serialize_with_device_digital_twin(self):
+        history = Probe_YiTong_TankTruck_Parser().create_data_record_history()
+        device = DeviceDigitalTwin(
+            device_identity=DeviceIdentity(
+                name="test", dtu_sn="001", device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck),
+            data_records=history)
+        self.assertEqual(device.model_dump(mode="json")["data_records"], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
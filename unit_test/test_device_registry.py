@@ -0,0 +1,55 @@
+import unittest
+from device.device_registry import DeviceRegistry
+from models import DEVICE_TYPE, DeviceDigitalTwin, DeviceIdentity
+
+
+class TestDeviceRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = DeviceRegistry()
+
+    def _create_device(self, dtu_sn: str, device_type: DEVICE_TYPE, physical_id: str = None) -> DeviceDigitalTwin:
+        return DeviceDigitalTwin(device_identity=DeviceIdentity(
+            name=f"{device_type.value}__{dtu_sn}__{physical_id}",
+            dtu_sn=dtu_sn,
+            device_type=device_type,
+            device_physical_id=physical_id))
+
+    def test_get_or_add(self):
+        device = self._create_device(
+            "001", DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, "1")
+        identity = device.device_identity.model_copy()
+        added, is_new = self.registry.get_or_add(identity, lambda: device)
+        self.assertTrue(is_new)
+        self.assertIs(added, device)
+        existing, is_new = self.registry.get_or_add(
+            identity, lambda: self.fail("should not create again"))
+        self.assertFalse(is_new)
+        self.assertIs(existing, device)
+        self.assertEqual(len(self.registry), 1)
+
+        with self.assertRaises(ValueError):
+            self.registry.add(device)
+
+    def test_find(self):
+        self.registry.add(self._create_device("001", DEVICE_TYPE.DTU))
+        for physical_id in ["1", "2"]:
+            self.registry.add(self._create_device(
+                "001", DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, physical_id))
+            self.registry.add(self._create_device(
+                "002", DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, physical_id))
+
+        self.assertEqual(len(self.registry.find()), 5)
+        self.assertEqual(len(self.registry.find(dtu_sn="001")), 3)
+        self.assertEqual(len(self.registry.find(dtu_sn="003")), 0)
+        self.assertEqual(
+            len(self.registry.find(device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck)), 4)
+        found = self.registry.find(
+            dtu_sn="002", device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, device_physical_id="2")
+        self.assertEqual(len(found), 1)
+        self.assertEqual(found[0].device_identity.dtu_sn, "002")
+        self.assertEqual(found[0].device_identity.device_physical_id, "2")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import gzip
+import logging
+import os
+import random
+import tempfile
+import unittest
+
+from enhanced_rotating_file_handler import enhanced_rotating_file_handler
+
+
+class TestEnhancedRotatingFileHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.temp_dir.name, "main.log")
+        self.logger = logging.getLogger(f"{self.id()}Logger")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = None
+
+    def tearDown(self):
+        self.logger.handlers.clear()
+        if self.handler is not None:
+            self.handler.close()
+        self.temp_dir.cleanup()
+
+    def _create_handler(self, **kwargs) -> enhanced_rotating_file_handler:
+        self.handler = enhanced_rotating_file_handler(
+            self.file_name, when="S", interval=86400, encoding="utf8", **kwargs)
+        self.logger.addHandler(self.handler)
+        return self.handler
+
+    def _backup_file_names(self) -> list[str]:
+        return sorted(file_name for file_name in os.listdir(self.temp_dir.name) if file_name != "main.log")
+
+    def test_rolled_over_segments_compressed_in_background(self):
+        self._create_handler(maxBytes=2000, maxTotalBytes=10 ** 6)
+        lines = [f"line {i} " + "x" * 50 for i in range(100)]
+        for line in lines:
+            self.logger.info(line)
+        self.handler.close()
+        self.handler = None
+
+        backups = self._backup_file_names()
+        self.assertGreater(len(backups), 1)
+        self.assertTrue(all(file_name.endswith(".gz") for file_name in backups))
+        logged = []
+        for file_name in sorted(backups, key=lambda file_name: os.stat(os.path.join(self.temp_dir.name, file_name)).st_mtime_ns):
+            with gzip.open(os.path.join(self.temp_dir.name, file_name), "rt", encoding="utf8") as f:
+                logged.extend(f.read().splitlines())
+        with open(self.file_name, encoding="utf8") as f:
+            logged.extend(f.read().splitlines())
+        self.assertEqual(logged, lines)
+
+    def test_backups_pruned_by_total_bytes(self):
+        # seeded random lines, so each segment is compressed to about 800 bytes, the budget fits 3 of them
+        random_lines = random.Random(0)
+        self._create_handler(maxBytes=10 ** 6, maxTotalBytes=2500)
+        rolled_over_file_names = []
+        for i in range(6):
+            for _ in range(20):
+                self.logger.info(random_lines.randbytes(32).hex())
+            backups_before = set(self._backup_file_names())
+            self.handler.doRollover()
+            # wait for the compressor to drain
+            self.handler._compress_queue.join()
+            rolled_over_file_names.extend(
+                set(self._backup_file_names()) - backups_before)
+        self.assertEqual(len(rolled_over_file_names), 6)
+        self.assertEqual(set(self._backup_file_names()),
+                         set(rolled_over_file_names[-3:]))
+
+    def test_queued_segments_not_pruned(self):
+        self._create_handler(maxBytes=10 ** 6, maxTotalBytes=100)
+        self.handler._compress_queue.join()
+        # a segment renamed by rollover but not compressed yet, way larger than the budget
+        queued_file_name = self.file_name + ".2025-01-01_00-00-00"
+        with open(queued_file_name, "w", encoding="utf8") as f:
+            f.write("queued\n" * 100)
+        self.handler._prune()
+        self.assertTrue(os.path.exists(queued_file_name))
+
+    def test_uncompressed_segments_left_from_last_run_compressed(self):
+        left_file_name = self.file_name + ".2025-01-01_00-00-00"
+        with open(left_file_name, "w", encoding="utf8") as f:
+            f.write("left\n")
+        self._create_handler(maxBytes=2000, maxTotalBytes=10 ** 6)
+        self.handler.close()
+        self.handler = None
+        self.assertEqual(self._backup_file_names(), [
+                         "main.log.2025-01-01_00-00-00.gz"])
+
+    def test_no_compression_without_total_bytes_budget(self):
+        self._create_handler(maxBytes=2000, backupCount=2)
+        for i in range(100):
+            self.logger.info(f"line {i} " + "x" * 50)
+        self.assertEqual(self.handler.rotator, None)
+        self.assertLessEqual(len(self._backup_file_names()), 2)
+        self.assertFalse(any(file_name.endswith(".gz")
+                         for file_name in self._backup_file_names()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from device.protocol_parser.frame_reassembler import FrameReassembler
+from device.protocol_parser.parser import PROBE_READING_FRAME_SPEC
+
+PROBE_MSG = bytes.fromhex("aa0101020179589999990011470209960991099912bb")
+
+
+class TestFrameReassembler(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.reassembler = FrameReassembler(
+            PROBE_READING_FRAME_SPEC, window_ms=500, clock=lambda: self.now)
+
+    def test_fragmented_frame(self):
+        self.assertEqual(self.reassembler.feed(
+            "dtu/001/outbox", PROBE_MSG[:9]), [])
+        self.assertEqual(
+            self.reassembler.buffered_byte_count("dtu/001/outbox"), 9)
+        self.now += 0.2
+        self.assertEqual(self.reassembler.feed(
+            "dtu/001/outbox", PROBE_MSG[9:]), [PROBE_MSG])
+        self.assertEqual(
+            self.reassembler.buffered_byte_count("dtu/001/outbox"), 0)
+        self.assertEqual(self.reassembler.reassembled_frame_count, 1)
+
+    def test_merged_frames(self):
+        self.assertEqual(self.reassembler.feed(
+            "dtu/001/outbox", PROBE_MSG + PROBE_MSG + PROBE_MSG[:5]), [PROBE_MSG, PROBE_MSG])
+        self.assertEqual(self.reassembler.feed(
+            "dtu/001/outbox", PROBE_MSG[5:]), [PROBE_MSG])
+
+    def test_topics_are_buffered_separately(self):
+        self.reassembler.feed("dtu/001/outbox", PROBE_MSG[:9])
+        self.assertEqual(self.reassembler.feed(
+            "dtu/002/outbox", PROBE_MSG[9:]), [])
+        self.assertEqual(self.reassembler.feed(
+            "dtu/001/outbox", PROBE_MSG[9:]), [PROBE_MSG])
+
+    def test_fragment_expires(self):
+        self.reassembler.feed("dtu/001/outbox", PROBE_MSG[:9])
+        self.now += 1
+        self.assertEqual(self.reassembler.feed(
+            "dtu/001/outbox", PROBE_MSG[9:]), [])
+        self.assertEqual(
+            self.reassembler.buffered_byte_count("dtu/001/outbox"), 0)
+        self.assertEqual(self.reassembler.discarded_byte_count,
+                         len(PROBE_MSG))
+
+    def test_resync_on_garbage_and_bad_checksum(self):
+        bad_checksum_msg = PROBE_MSG[:-2] + b"\x13\xBB"
+        self.assertEqual(self.reassembler.feed(
+            "dtu/001/outbox", b"\x00\x12" + bad_checksum_msg + b"\xAA\x01" + PROBE_MSG), [PROBE_MSG])
+        self.assertEqual(
+            self.reassembler.buffered_byte_count("dtu/001/outbox"), 0)
+
+    def test_buffer_is_bounded(self):
+        reassembler = FrameReassembler(
+            PROBE_READING_FRAME_SPEC, max_buffered_byte_count=16, clock=lambda: self.now)
+        reassembler.feed("dtu/001/outbox", PROBE_MSG[:-1])
+        self.assertEqual(reassembler.buffered_byte_count("dtu/001/outbox"), 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import struct
+import unittest
+from device.protocol_parser.frame_spec import (CHECKSUM_ALGORITHM, FIELD_TYPE, ChecksumSpec, FieldSpec,
+                                               FrameSpec, RepeatedFieldSpec, compute_checksum)
+
+SPEC = FrameSpec(
+    name="test",
+    start=b"\xAA",
+    end=b"\xBB",
+    fields=(FieldSpec("kind", fixed_value=0x01),
+            FieldSpec("id"),
+            FieldSpec("level", FIELD_TYPE.Bcd, 3),
+            FieldSpec("counter", FIELD_TYPE.UInt, 3),
+            FieldSpec("count", FIELD_TYPE.Bcd),
+            RepeatedFieldSpec("temperatures", "count", FieldSpec(
+                "temperature", FIELD_TYPE.Bcd, 2, divisor=10, offset=-80)),
+            FieldSpec("reserved", FIELD_TYPE.Reserved, 2),
+            FieldSpec("delta", FIELD_TYPE.Int, 2),
+            FieldSpec("ratio", FIELD_TYPE.Float, 4)),
+    checksum=ChecksumSpec(CHECKSUM_ALGORITHM.Sum8))
+
+
+class TestFrameSpec(unittest.TestCase):
+
+    def _build_frame(self, count: int = 2) -> bytes:
+        body = bytes.fromhex("0107017958001147") + bytes([count]) + bytes.fromhex("0996") * count + \
+            bytes.fromhex("9999fffe") + struct.pack(">f", 1.5)
+        return b"\xAA" + body + bytes([sum(body) & 0xFF]) + b"\xBB"
+
+    def test_decode(self):
+        frame = self._build_frame()
+        self.assertEqual(SPEC.frame_length(frame), len(frame))
+        self.assertTrue(SPEC.matches(frame))
+        self.assertTrue(SPEC.verify_checksum(frame))
+        self.assertEqual(SPEC.decode(frame), {
+            "kind": 1, "id": 7, "level": 17958, "counter": 0x001147, "count": 2,
+            "temperatures": [996/10-80, 996/10-80], "delta": -2, "ratio": 1.5})
+        self.assertEqual(SPEC.decode(memoryview(frame)), SPEC.decode(frame))
+
+    def test_decode_repeat_count(self):
+        self.assertEqual(SPEC.decode(self._build_frame(0))["temperatures"], [])
+        self.assertEqual(
+            len(SPEC.decode(self._build_frame(5))["temperatures"]), 5)
+
+    def test_decode_not_matched(self):
+        frame = self._build_frame()
+        self.assertIsNone(SPEC.decode(frame[:-1]))
+        self.assertIsNone(SPEC.decode(frame + b"\xBB"))
+        self.assertIsNone(SPEC.decode(b"\xAB" + frame[1:]))
+        # unexpected fixed value
+        self.assertIsNone(SPEC.decode(frame[:1] + b"\x02" + frame[2:]))
+
+    def test_encode_round_trip(self):
+        frame = self._build_frame()
+        encoded = SPEC.encode(SPEC.decode(frame))
+        self.assertTrue(SPEC.verify_checksum(encoded))
+        self.assertEqual(SPEC.decode(encoded), SPEC.decode(frame))
+        # the count field is derived from the repeated field when absent
+        values = SPEC.decode(frame)
+        del values["count"]
+        values["temperatures"] = [20.5]
+        self.assertEqual(SPEC.decode(SPEC.encode(values))["count"], 1)
+
+    def test_checksum(self):
+        # sample reply of the tank-truck probe, 十进制加和 of the BCD bytes
+        frame = bytes.fromhex("aa0101020179589999990011470209960991099912bb")
+        self.assertEqual(compute_checksum(
+            CHECKSUM_ALGORITHM.BcdSum, frame[1:-2]), 0x12)
+        self.assertEqual(compute_checksum(
+            CHECKSUM_ALGORITHM.Sum8, b"\x01\x63\x06\x00"), 0x6A)
+        self.assertEqual(compute_checksum(
+            CHECKSUM_ALGORITHM.Xor8, b"\x01\x03\x02"), 0x00)
+        self.assertFalse(SPEC.verify_checksum(
+            self._build_frame()[:-2] + b"\x00\xBB"))
+
+    def test_invalid_spec(self):
+        with self.assertRaises(ValueError):
+            FrameSpec("count after repeated", b"\xAA", b"\xBB", (
+                RepeatedFieldSpec("items", "count", FieldSpec("item")), FieldSpec("count")))
+        with self.assertRaises(ValueError):
+            FrameSpec("float of 3 bytes", b"\xAA", b"\xBB",
+                      (FieldSpec("value", FIELD_TYPE.Float, 3),))
+
+
+if __name__ == '__main__':
+    unittest.main()
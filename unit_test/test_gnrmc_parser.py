@@ -0,0 +1,158 @@
+import unittest
+from functools import reduce
+from operator import xor
+from device.protocol_parser.parser import CHECKSUM_POLICY, GenericTimelyReportGpsDtuDeviceParser, GnrmcFix
+from models import DEVICE_TYPE
+
+SAMPLE_SENTENCE = b"$GNRMC,111700.00,A,2906.78084,N,11207.29890,E,0.114,,111125,,,A,V*10"
+
+
+class TestGnrmcFix(unittest.TestCase):
+
+    def test_parse_bytes(self):
+        fix = GnrmcFix.parse(SAMPLE_SENTENCE)
+        self.assertTrue(fix.checksum_valid)
+        self.assertEqual(fix.status, "A")
+        self.assertAlmostEqual(fix.latitude, 29 + 6.78084 / 60)
+        self.assertAlmostEqual(fix.longitude, 112 + 7.29890 / 60)
+        self.assertAlmostEqual(fix.speed_knots, 0.114)
+        self.assertEqual(fix.mode, "A")
+        self.assertEqual(fix.nav_status, "V")
+
+    def test_parse_str_equals_bytes(self):
+        self.assertEqual(GnrmcFix.parse(SAMPLE_SENTENCE.decode()),
+                         GnrmcFix.parse(SAMPLE_SENTENCE))
+
+    def test_checksum_mismatch(self):
+        fix = GnrmcFix.parse(SAMPLE_SENTENCE[:-2] + b"11")
+        self.assertFalse(fix.checksum_valid)
+        self.assertEqual(fix.to_dict()["校验状态"], "ERROR")
+
+    def test_south_west_hemisphere(self):
+        fix = GnrmcFix.parse(
+            b"$GNRMC,111700.00,A,2906.78084,S,11207.29890,W,1.5,45.2,111125,3.1,W,D*10")
+        self.assertLess(fix.latitude, 0)
+        self.assertLess(fix.longitude, 0)
+        self.assertEqual(fix.nav_status, "")
+
+    def test_not_gnrmc(self):
+        self.assertIsNone(GnrmcFix.parse(b"$GPGGA,111700.00*10"))
+        self.assertIsNone(GnrmcFix.parse(b"$GNRMC,1*2"))
+        self.assertIsNone(GnrmcFix.parse(b"$GNRMC,a*b*c"))
+        self.assertIsNone(GnrmcFix.parse(b"$GNRMC,\xff,,,,,,,,,,,*00"))
+        self.assertIsNone(GnrmcFix.parse(None))
+
+    def test_to_dict(self):
+        data = GnrmcFix.parse(SAMPLE_SENTENCE).to_dict()
+        self.assertEqual(data["原始语句"], SAMPLE_SENTENCE.decode())
+        self.assertEqual(data["UTC时间"], "11:17:00.00")
+        self.assertEqual(data["定位状态"], "有效定位")
+        self.assertEqual(data["纬度"], 29.113014)
+        self.assertEqual(data["纬度方向"], "N")
+        self.assertEqual(data["经度"], 112.121648)
+        self.assertEqual(data["经度方向"], "E")
+        self.assertEqual(data["地面速度(节)"], 0.114)
+        self.assertEqual(data["地面速度(km/h)"], 0.211)
+        self.assertEqual(data["地面航向(度)"], "无数据")
+        self.assertEqual(data["UTC日期"], "11/11/25")
+        self.assertEqual(data["定位模式"], "自主定位")
+        self.assertEqual(data["导航状态"], "未定位")
+        self.assertEqual(data["校验状态"], "OK")
+
+
+class TestGenericTimelyReportGpsDtuDeviceParser(unittest.TestCase):
+
+    def test_try_parse(self):
+        device_identity, data_record = GenericTimelyReportGpsDtuDeviceParser(
+        ).TryParse("dtu/ABC123/outbox", SAMPLE_SENTENCE)
+        self.assertEqual(device_identity.dtu_sn, "ABC123")
+        self.assertEqual(device_identity.device_type, DEVICE_TYPE.DTU)
+        self.assertEqual(data_record["data"],
+                         GnrmcFix.parse(SAMPLE_SENTENCE).to_dict())
+
+    def test_try_parse_batch_same_as_one_by_one(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        msgs = [("dtu/001/outbox", SAMPLE_SENTENCE),
+                ("dtu/002/outbox", b"\xAA\x01\x01\x06\x00\x08\xBB"),
+                ("dtu/003/outbox", b"$GNRMC,111700.00,V,,,,,,,111125,,,N,V*18"),
+                ("dtu/004/outbox", b"$GNRMC,1*2")]
+        results = parser.TryParseBatch(msgs)
+        self.assertEqual([device_identity.dtu_sn if device_identity else None for device_identity, _ in results],
+                         ["001", None, "003", None])
+        for (topic, payload), (_, data_record) in zip(msgs, results):
+            _, expected_data_record = parser.TryParse(topic, payload)
+            if expected_data_record is not None:
+                self.assertEqual(
+                    data_record["data"], expected_data_record["data"])
+
+    def test_try_parse_batch_with_separator_in_payload(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        parser.checksum_policy = CHECKSUM_POLICY.KeepAndFlag
+        results = parser.TryParseBatch(
+            [("dtu/001/outbox", SAMPLE_SENTENCE + b"\r\n"), ("dtu/002/outbox", SAMPLE_SENTENCE)])
+        self.assertEqual(results[0][1]["data"]["校验状态"], "OK")
+        self.assertEqual(results[1][1]["data"]["校验状态"], "OK")
+        self.assertEqual(results[0][1]["data"]["纬度"], results[1][1]["data"]["纬度"])
+
+    def test_try_parse_batch_skips_malformed_sentence(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        body = b"GNRMC,111700.00,A,29XX.78084,N,11207.29890,E,0.114,,111125,,,A,V"
+        malformed_sentence = b"$%s*%02X" % (body, reduce(xor, body, 0))
+        with self.assertRaises(ValueError):
+            parser.TryParse("dtu/002/outbox", malformed_sentence)
+        # joined in one go, and one by one as the separator is in a payload
+        for last_sentence in (SAMPLE_SENTENCE, SAMPLE_SENTENCE + b"\r\n"):
+            results = parser.TryParseBatch(
+                [("dtu/001/outbox", SAMPLE_SENTENCE), ("dtu/002/outbox", malformed_sentence),
+                 ("dtu/003/outbox", last_sentence)])
+            self.assertEqual([device_identity.dtu_sn if device_identity else None for device_identity, _ in results],
+                             ["001", None, "003"])
+
+    def test_crlf_terminated_sentence_kept_by_default(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        self.assertTrue(GnrmcFix.verify_checksum(SAMPLE_SENTENCE + b"\r\n"))
+        device_identity, data_record = parser.TryParse(
+            "dtu/001/outbox", SAMPLE_SENTENCE + b"\r\n")
+        self.assertEqual(device_identity.dtu_sn, "001")
+        self.assertEqual(data_record["data"]["校验状态"], "OK")
+        self.assertEqual(parser.get_checksum_error_count("001"), 0)
+
+    def test_checksum_error_rejected_by_default(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        bad_sentence = SAMPLE_SENTENCE[:-2] + b"11"
+        self.assertEqual(parser.TryParse(
+            "dtu/001/outbox", bad_sentence), (None, None))
+        results = parser.TryParseBatch(
+            [("dtu/001/outbox", bad_sentence), ("dtu/001/outbox", SAMPLE_SENTENCE)])
+        self.assertEqual(results[0], (None, None))
+        self.assertEqual(results[1][1]["data"]["校验状态"], "OK")
+        self.assertEqual(parser.get_checksum_error_count("001"), 2)
+        self.assertEqual(parser.get_checksum_error_count("002"), 0)
+
+    def test_checksum_error_callbacks_called_for_rejected(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        checksum_errors = []
+        parser.on_checksum_error_callbacks.append(
+            lambda *args: checksum_errors.append(args))
+        for _ in range(2):
+            self.assertEqual(parser.TryParse(
+                "dtu/001/outbox", SAMPLE_SENTENCE[:-2] + b"11"), (None, None))
+        parser.TryParse("dtu/001/outbox", SAMPLE_SENTENCE)
+        self.assertEqual(checksum_errors, [("001", None, 1), ("001", None, 2)])
+
+    def test_checksum_error_kept_by_policy(self):
+        parser = GenericTimelyReportGpsDtuDeviceParser()
+        for checksum_policy in (CHECKSUM_POLICY.KeepAndFlag, CHECKSUM_POLICY.CountOnly):
+            parser.checksum_policy = checksum_policy
+            _, data_record = parser.TryParse(
+                "dtu/001/outbox", SAMPLE_SENTENCE[:-2] + b"11")
+            self.assertEqual(data_record["data"]["校验状态"], "ERROR")
+        self.assertEqual(parser.get_checksum_error_count("001"), 2)
+
+    def test_try_parse_not_gnrmc(self):
+        self.assertEqual(GenericTimelyReportGpsDtuDeviceParser().TryParse(
+            "dtu/ABC123/outbox", b"\xAA\x01\x01\x06\x00\x08\xBB"), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
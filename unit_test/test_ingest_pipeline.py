@@ -0,0 +1,105 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+from device.ingest_pipeline import BACKPRESSURE_POLICY, IngestPipeline
+
+
+class TestIngestPipeline(unittest.TestCase):
+
+    def test_msgs_of_a_topic_are_handled_in_order(self):
+        handled: dict[str, list[int]] = {}
+        lock = threading.Lock()
+
+        def handler(topic, payload):
+            with lock:
+                handled.setdefault(topic, []).append(payload)
+
+        # topics may be hashed to the same worker, block rather than dropping msgs
+        pipeline = IngestPipeline(
+            handler, worker_count=3, max_queued_msg_count=300,
+            backpressure_policy=BACKPRESSURE_POLICY.Block, logger=MagicMock())
+        pipeline.start()
+        for i in range(500):
+            for dtu_sn in ["001", "002", "003", "004"]:
+                pipeline.submit(f"dtu/{dtu_sn}/outbox", i)
+        pipeline.stop()
+        self.assertEqual(len(handled), 4)
+        for payloads in handled.values():
+            self.assertEqual(payloads, list(range(500)))
+
+    def test_drop_oldest(self):
+        handler = MagicMock()
+        pipeline = IngestPipeline(handler, worker_count=1, max_queued_msg_count=2,
+                                  backpressure_policy=BACKPRESSURE_POLICY.DropOldest, logger=MagicMock())
+        for i in range(5):
+            self.assertTrue(pipeline.submit("dtu/001/outbox", i))
+        self.assertEqual(pipeline.dropped_msg_count, 3)
+        pipeline.start()
+        pipeline.stop()
+        self.assertEqual([c.args[1] for c in handler.call_args_list], [3, 4])
+
+    def test_drop_oldest_keeps_stop_signal(self):
+        handling = threading.Event()
+        release = threading.Event()
+        handled = []
+
+        def handler(topic, payload):
+            handled.append(payload)
+            handling.set()
+            release.wait()
+
+        pipeline = IngestPipeline(handler, worker_count=1, max_queued_msg_count=1,
+                                  backpressure_policy=BACKPRESSURE_POLICY.DropOldest, logger=MagicMock())
+        pipeline.start()
+        pipeline.submit("dtu/001/outbox", 0)
+        handling.wait(1)
+        stopping = threading.Thread(target=pipeline.stop)
+        stopping.start()
+        while pipeline.queued_msg_count() < 1:
+            threading.Event().wait(0.01)
+        # the queue is full of the stop signal
+        self.assertFalse(pipeline.submit("dtu/001/outbox", 1))
+        release.set()
+        stopping.join(1)
+        self.assertFalse(stopping.is_alive())
+        self.assertEqual(handled, [0])
+        self.assertEqual(pipeline.dropped_msg_count, 1)
+
+    def test_drop_new(self):
+        handler = MagicMock()
+        pipeline = IngestPipeline(handler, worker_count=1, max_queued_msg_count=2,
+                                  backpressure_policy=BACKPRESSURE_POLICY.DropNew, logger=MagicMock())
+        results = [pipeline.submit("dtu/001/outbox", i) for i in range(5)]
+        self.assertEqual(results, [True, True, False, False, False])
+        pipeline.start()
+        pipeline.stop()
+        self.assertEqual([c.args[1] for c in handler.call_args_list], [0, 1])
+
+    def test_handler_exception_does_not_stop_worker(self):
+        handler = MagicMock(side_effect=[Exception("boom"), None])
+        pipeline = IngestPipeline(
+            handler, worker_count=1, max_queued_msg_count=10, logger=MagicMock())
+        pipeline.start()
+        pipeline.submit("dtu/001/outbox", 1)
+        pipeline.submit("dtu/001/outbox", 2)
+        pipeline.stop()
+        self.assertEqual(handler.call_count, 2)
+
+    def test_queued_msgs_are_handled_in_batch(self):
+        handler = MagicMock()
+        batch_handler = MagicMock()
+        pipeline = IngestPipeline(handler, worker_count=1, max_queued_msg_count=100,
+                                  batch_handler=batch_handler, max_batch_size=4, logger=MagicMock())
+        for i in range(10):
+            pipeline.submit("dtu/001/outbox", i)
+        pipeline.start()
+        pipeline.stop()
+        handler.assert_not_called()
+        batches = [c.args[0] for c in batch_handler.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+        self.assertEqual([payload for batch in batches for _, payload in batch],
+                         list(range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from device.latest_state_table import LatestStateTable
+from models import DEVICE_TYPE, DeviceDigitalTwin, DeviceIdentity
+
+
+class TestLatestStateTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = LatestStateTable()
+        self.received_datetime = datetime(2025, 11, 11, tzinfo=timezone.utc)
+
+    def _create_device(self, dtu_sn: str, physical_id: str) -> DeviceDigitalTwin:
+        return DeviceDigitalTwin(device_identity=DeviceIdentity(
+            name="", dtu_sn=dtu_sn, device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck,
+            device_physical_id=physical_id), last_device_msg_received_datetime=self.received_datetime)
+
+    def _update(self, device: DeviceDigitalTwin, m1: int) -> None:
+        self.table.update(device, {"received_datetime": self.received_datetime + timedelta(seconds=m1),
+                                   "data": {"M1": m1}})
+
+    @staticmethod
+    def _latest_m1s(encoded_states: bytes) -> list:
+        return sorted((state["device_identity"]["dtu_sn"], state["device_identity"]["device_physical_id"],
+                       state["latest_data_record"]["data"]["M1"]) for state in json.loads(encoded_states))
+
+    def test_latest_record_kept_per_device(self):
+        device_1, device_2 = self._create_device(
+            "001", "1"), self._create_device("001", "2")
+        self._update(device_1, 1)
+        self._update(device_2, 2)
+        self._update(device_1, 3)
+        self.assertEqual(len(self.table), 2)
+        self.assertEqual(self._latest_m1s(self.table.get_json("001")), [
+                         ("001", "1", 3), ("001", "2", 2)])
+        state = json.loads(self.table.get_json("001"))[0]
+        self.assertEqual(state["latest_data_record"]["received_datetime"], "2025-11-11T00:00:03Z")
+        self.assertEqual(self.table.get_json("002"), b"[]")
+
+    def test_encoded_states_cached_until_dtu_updated(self):
+        device_1, device_2 = self._create_device(
+            "001", "1"), self._create_device("002", "1")
+        self._update(device_1, 1)
+        self._update(device_2, 2)
+        encoded_states = self.table.get_json("001")
+        encoded_fleet_states = self.table.get_json()
+        with patch.object(LatestStateTable, "_states_adapter") as states_adapter:
+            self.assertIs(self.table.get_json("001"), encoded_states)
+            self.assertIs(self.table.get_json(), encoded_fleet_states)
+            states_adapter.dump_json.assert_not_called()
+
+        self._update(device_2, 3)
+        self.assertIs(self.table.get_json("001"), encoded_states)
+        self.assertEqual(self._latest_m1s(self.table.get_json()), [
+                         ("001", "1", 1), ("002", "1", 3)])
+
+    def test_update_without_record_keeps_latest_one(self):
+        device = self._create_device("001", "1")
+        self._update(device, 1)
+        encoded_states = self.table.get_json("001")
+        device.checksum_error_count = 5
+        self.table.update(device)
+        self.assertIsNot(self.table.get_json("001"), encoded_states)
+        state = json.loads(self.table.get_json("001"))[0]
+        self.assertEqual(state["checksum_error_count"], 5)
+        self.assertEqual(state["latest_data_record"]["data"], {"M1": 1})
+
+    def test_empty_fleet(self):
+        self.assertEqual(json.loads(self.table.get_json()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
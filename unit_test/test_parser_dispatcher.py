@@ -0,0 +1,123 @@
+import unittest
+from collections import Counter
+from unittest.mock import MagicMock
+from device.protocol_parser.parser import CHECKSUM_POLICY, GenericTimelyReportGpsDtuDeviceParser, Probe_YiTong_TankTruck_Parser
+from device.protocol_parser.parser_dispatcher import ParserDispatcher
+from models import DEVICE_TYPE
+
+GNRMC_MSG = b"$GNRMC,111700.00,A,2906.78084,N,11207.29890,E,0.114,,111125,,,A,V*10"
+PROBE_MSG = bytes.fromhex(
+    "aa0101020179589999990011470209960991099912bb")
+
+
+class TestParserDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.gps_parser = GenericTimelyReportGpsDtuDeviceParser()
+        self.probe_parser = Probe_YiTong_TankTruck_Parser()
+        self.dispatcher = ParserDispatcher(
+            [self.gps_parser, self.probe_parser], MagicMock())
+
+    def test_dispatch_by_signature(self):
+        parser, device_identity, data_record = self.dispatcher.dispatch(
+            "dtu/001/outbox", GNRMC_MSG)
+        self.assertIs(parser, self.gps_parser)
+        self.assertEqual(device_identity.device_type, DEVICE_TYPE.DTU)
+        self.assertEqual(data_record["data"]["经度方向"], "E")
+
+        parser, device_identity, data_record = self.dispatcher.dispatch(
+            "dtu/001/outbox", PROBE_MSG)
+        self.assertIs(parser, self.probe_parser)
+        self.assertEqual(device_identity.device_physical_id, "1")
+        self.assertEqual(data_record["data"]["M1"], 17958)
+
+        self.assertEqual(self.dispatcher.dispatch(
+            "dtu/001/outbox", b"02500525102900023669"), (None, None, None))
+        self.assertEqual(self.dispatcher.dispatch(
+            "dtu/001/outbox", b""), (None, None, None))
+
+    def test_only_candidate_parser_is_tried(self):
+        self.gps_parser.TryParse = MagicMock(
+            wraps=self.gps_parser.TryParse)
+        for _ in range(3):
+            parser, _, _ = self.dispatcher.dispatch(
+                "dtu/001/outbox", PROBE_MSG)
+            self.assertIs(parser, self.probe_parser)
+        self.gps_parser.TryParse.assert_not_called()
+
+    def test_str_msg(self):
+        parser, device_identity, _ = self.dispatcher.dispatch(
+            "dtu/001/outbox", GNRMC_MSG.decode())
+        self.assertIs(parser, self.gps_parser)
+        self.assertEqual(device_identity.dtu_sn, "001")
+
+    def test_dispatch_batch(self):
+        msgs = [("dtu/001/outbox", GNRMC_MSG),
+                ("dtu/002/outbox", PROBE_MSG),
+                ("dtu/003/outbox", b"02500525102900023669"),
+                ("dtu/004/outbox", GNRMC_MSG.decode()),
+                ("dtu/005/outbox", PROBE_MSG)]
+        results = self.dispatcher.dispatch_batch(msgs)
+        self.assertEqual([parser for parser, _, _ in results],
+                         [self.gps_parser, self.probe_parser, None, self.gps_parser, self.probe_parser])
+        for (topic, payload), (_, device_identity, data_record) in zip(msgs, results):
+            expected_parser, expected_identity, expected_data_record = self.dispatcher.dispatch(
+                topic, payload)
+            if expected_parser is None:
+                self.assertIsNone(device_identity)
+                continue
+            self.assertEqual(device_identity, expected_identity)
+            self.assertEqual(data_record["data"], expected_data_record["data"])
+
+    def test_reassemble(self):
+        self.assertEqual(self.dispatcher.dispatch(
+            "dtu/001/outbox", PROBE_MSG[:10]), (None, None, None))
+        self.assertEqual(self.dispatcher.reassemble(
+            "dtu/001/outbox", PROBE_MSG[:10]), [])
+        self.assertTrue(self.dispatcher.is_reassembling("dtu/001/outbox"))
+        results = self.dispatcher.reassemble(
+            "dtu/001/outbox", PROBE_MSG[10:] + PROBE_MSG)
+        self.assertEqual([parser for parser, _, _ in results],
+                         [self.probe_parser, self.probe_parser])
+        self.assertEqual(results[0][2]["data"]["M1"], 17958)
+        self.assertFalse(self.dispatcher.is_reassembling("dtu/001/outbox"))
+        self.assertEqual(self.dispatcher.reassemble(
+            "dtu/001/outbox", GNRMC_MSG.decode()), [])
+
+    def test_dispatch_batch_fallback_on_batch_error(self):
+        self.probe_parser.TryParseBatch = MagicMock(
+            side_effect=Exception("boom"))
+        results = self.dispatcher.dispatch_batch(
+            [("dtu/001/outbox", PROBE_MSG), ("dtu/002/outbox", PROBE_MSG)])
+        self.assertEqual([device_identity.dtu_sn for _, device_identity, _ in results],
+                         ["001", "002"])
+
+    def test_dispatch_batch_counts_checksum_error_once(self):
+        checksum_errors = []
+        for parser in (self.gps_parser, self.probe_parser):
+            parser.checksum_policy = CHECKSUM_POLICY.CountOnly
+            parser.on_checksum_error_callbacks.append(
+                lambda *args: checksum_errors.append(args))
+            # the batch is not re-parsed one by one for a malformed msg
+            parser.TryParse = MagicMock(wraps=parser.TryParse)
+        results = self.dispatcher.dispatch_batch(
+            [("dtu/A/outbox", GNRMC_MSG),
+             ("dtu/B/outbox", GNRMC_MSG[:-2] + b"11"),
+             ("dtu/C/outbox", b"$GNRMC,111700.00,A,29XX.78084,N,11207.29890,E,0.114,,111125,,,A,V*00"),
+             ("dtu/A/outbox", PROBE_MSG),
+             ("dtu/B/outbox", PROBE_MSG[:-2] + b"\x00\xBB"),
+             # no temperature point
+             ("dtu/C/outbox", bytes.fromhex("aa01010201795899999900114700999995bb"))])
+        self.assertEqual([device_identity.dtu_sn if device_identity else None for _, device_identity, _ in results],
+                         ["A", "B", None, "A", "B", None])
+        self.gps_parser.TryParse.assert_not_called()
+        self.probe_parser.TryParse.assert_not_called()
+        self.assertEqual(self.gps_parser.checksum_error_counts,
+                         Counter({("B", None): 1, ("C", None): 1}))
+        self.assertEqual(self.probe_parser.checksum_error_counts,
+                         Counter({("B", "1"): 1}))
+        self.assertEqual(checksum_errors, [("B", None, 1), ("C", None, 1), ("B", "1", 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+from device.protocol_parser.parser import CHECKSUM_POLICY, Probe_YiTong_TankTruck_Parser
+from models import DEVICE_TYPE, REQUEST_ACTION, DeviceIdentity, DeviceRequest
+
+
+class TestProbe_YiTong_TankTruck_Parser(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = Probe_YiTong_TankTruck_Parser()
+
+    def _create_request(self, physical_id: str, request_action: REQUEST_ACTION = REQUEST_ACTION.Read) -> DeviceRequest:
+        return DeviceRequest(
+            device_identity=DeviceIdentity(
+                name="", dtu_sn="001", device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, device_physical_id=physical_id),
+            request_action=request_action)
+
+    def test_serialize_read_request(self):
+        # sample from doc: AA 01 01 06 00 08 BB
+        self.assertEqual(self.parser.Serialize(
+            self._create_request("1")), b'\xAA\x01\x01\x06\x00\x08\xBB')
+        self.assertEqual(self.parser.Serialize(
+            self._create_request("01")), b'\xAA\x01\x01\x06\x00\x08\xBB')
+        self.assertEqual(self.parser.Serialize(
+            self._create_request("99")), b'\xAA\x01\x63\x06\x00\x6A\xBB')
+
+    def test_serialize_uses_precomputed_frame(self):
+        self.assertEqual(len(self.parser.serialized_frame_cache), 99)
+        self.assertIs(self.parser.Serialize(self._create_request("7")),
+                      self.parser.serialized_frame_cache[(REQUEST_ACTION.Read, "7")])
+
+    def test_try_parse(self):
+        # sample from doc, but its checksum 87 is not the 十进制加和 of the data, which is 26
+        device_identity, data_record = self.parser.TryParse(
+            "dtu/001/outbox", bytes.fromhex("aa0103020321379999990025010210671049999926bb"))
+        self.assertEqual(device_identity.dtu_sn, "001")
+        self.assertEqual(device_identity.device_physical_id, "3")
+        self.assertEqual(device_identity.name, "Probe_YiTong_TankTruck__001__03")
+        data = data_record["data"]
+        self.assertEqual([data["类别号"], data["探棒号"], data["探棒类型"], data["M1"], data["M2"], data["温度点数"]],
+                         [1, 3, 2, 32137, 999999, 2])
+        self.assertEqual(data["M3"], 0x002501)
+        self.assertAlmostEqual(data["温度"][0]["温度A"], 26.7)
+        self.assertAlmostEqual(data["温度"][0]["温度B"], 24.9)
+        self.assertNotIn("校验状态", data)
+
+    def test_try_parse_any_temperature_count(self):
+        _, data_record = self.parser.TryParse(
+            "dtu/001/outbox", bytes.fromhex("aa01050200012399999900000003095009600970999937bb"))
+        self.assertEqual(data_record["data"]["温度点数"], 3)
+        self.assertEqual(list(data_record["data"]["温度"][0].items()),
+                         [("温度A", 15.0), ("温度B", 16.0), ("温度C", 17.0)])
+
+    def test_try_parse_invalid_frame(self):
+        # wrong length, 类别号 and 探棒类型
+        for hex_str in ["aa0101020179589999990011470209960991099912", "aa0201020179589999990011470209960991099912bb",
+                        "aa0101030179589999990011470209960991099912bb"]:
+            self.assertEqual(self.parser.TryParse(
+                "dtu/001/outbox", bytes.fromhex(hex_str)), (None, None))
+        self.assertEqual(self.parser.TryParse(
+            "dtu/001/outbox", "aa01"), (None, None))
+        with self.assertRaises(ValueError):
+            # no temperature point
+            self.parser.TryParse("dtu/001/outbox",
+                                 bytes.fromhex("aa01010201795899999900114700999995bb"))
+
+    def test_try_parse_batch_same_as_one_by_one(self):
+        msgs = [("dtu/001/outbox", bytes.fromhex("aa0101020179589999990011470209960991099912bb")),
+                ("dtu/001/outbox", b"$GNRMC,,V,,,,,,,,,,N*4D"),
+                ("dtu/002/outbox", bytes.fromhex("aa0103020321379999990025010210671049999926bb")),
+                ("dtu/003/outbox", bytes.fromhex("aa010502000123999999000000010950999987bb")),
+                # checksum error
+                ("dtu/003/outbox", bytes.fromhex("aa010502000123999999000000010950999900bb")),
+                ("dtu/004/outbox", bytes.fromhex("aa0101030179589999990011470209960991099912bb")),
+                ("dtu/005/outbox", bytes.fromhex("aa01050200012399999900000003095009600970999937bb"))]
+        results = self.parser.TryParseBatch(msgs)
+        self.assertEqual(len(results), len(msgs))
+        self.assertEqual(sum(1 for device_identity, _ in results if device_identity), 4)
+        for (topic, payload), (device_identity, data_record) in zip(msgs, results):
+            expected_identity, expected_data_record = self.parser.TryParse(
+                topic, payload)
+            self.assertEqual(device_identity, expected_identity)
+            if expected_data_record is not None:
+                self.assertEqual(
+                    data_record["data"], expected_data_record["data"])
+
+    def test_try_parse_batch_skips_frame_without_temperature(self):
+        msgs = [("dtu/001/outbox", bytes.fromhex("aa0103020321379999990025010210671049999926bb")),
+                # no temperature point, with a valid checksum
+                ("dtu/001/outbox", bytes.fromhex("aa01010201795899999900114700999995bb")),
+                ("dtu/002/outbox", bytes.fromhex("aa01050200012399999900000003095009600970999937bb"))]
+        results = self.parser.TryParseBatch(msgs)
+        self.assertEqual([device_identity is not None for device_identity, _ in results],
+                         [True, False, True])
+        self.assertEqual(results[1], (None, None))
+
+    def test_checksum_error_rejected_before_decoding(self):
+        frame = bytes.fromhex("aa0103020321379999990025010210671049999987bb")
+        self.assertEqual(self.parser.TryParse(
+            "dtu/001/outbox", frame), (None, None))
+        self.assertEqual(self.parser.TryParseBatch(
+            [("dtu/001/outbox", frame), ("dtu/002/outbox", frame)]), [(None, None), (None, None)])
+        self.assertEqual(self.parser.get_checksum_error_count("001", "3"), 2)
+        self.assertEqual(self.parser.get_checksum_error_count("002", "3"), 1)
+        self.assertEqual(self.parser.get_checksum_error_count("001", "1"), 0)
+        # a frame with the wrong length is not counted, as it's not a frame of this parser at all
+        self.assertEqual(self.parser.TryParse(
+            "dtu/001/outbox", frame[:-1]), (None, None))
+        self.assertEqual(self.parser.get_checksum_error_count("001", "3"), 2)
+
+    def test_checksum_error_kept_and_flagged(self):
+        self.parser.checksum_policy = CHECKSUM_POLICY.KeepAndFlag
+        _, data_record = self.parser.TryParse(
+            "dtu/001/outbox", bytes.fromhex("aa0103020321379999990025010210671049999987bb"))
+        self.assertEqual(data_record["data"]["M1"], 32137)
+        self.assertEqual(data_record["data"]["校验状态"], "ERROR")
+        _, data_record = self.parser.TryParse(
+            "dtu/001/outbox", bytes.fromhex("aa0103020321379999990025010210671049999926bb"))
+        self.assertEqual(data_record["data"]["校验状态"], "OK")
+        self.assertEqual(self.parser.get_checksum_error_count("001", "3"), 1)
+
+        history = self.parser.create_data_record_history()
+        history.append(data_record)
+        self.assertEqual(history[-1]["data"]["校验状态"], "OK")
+
+    def test_checksum_error_count_only(self):
+        self.parser.checksum_policy = CHECKSUM_POLICY.CountOnly
+        results = self.parser.TryParseBatch(
+            [("dtu/001/outbox", bytes.fromhex("aa0103020321379999990025010210671049999987bb"))])
+        self.assertEqual(results[0][1]["data"]["M1"], 32137)
+        self.assertNotIn("校验状态", results[0][1]["data"])
+        self.assertEqual(self.parser.get_checksum_error_count("001", "3"), 1)
+
+    def test_serialize_invalid_request(self):
+        with self.assertRaises(ValueError):
+            self.parser.Serialize(self._create_request(
+                "1", REQUEST_ACTION.Write))
+
+
+if __name__ == '__main__':
+    unittest.main()
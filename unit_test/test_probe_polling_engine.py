@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+from device.probe_polling_engine import ProbePollingEngine
+from device.protocol_parser.parser import Probe_YiTong_TankTruck_Parser
+from models import DEVICE_TYPE, DeviceIdentity
+
+
+class TestProbePollingEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.sent_frames: list[tuple[str, str, bytes]] = []
+
+        async def send_frame(dtu_sn, probe_id, frame):
+            self.sent_frames.append((dtu_sn, probe_id, frame))
+
+        self.engine = ProbePollingEngine(
+            parser=Probe_YiTong_TankTruck_Parser(),
+            send_frame=send_frame,
+            targets={"001": [1, 2, 3], "002": [1]},
+            interval_s=0.04,
+            max_missed_cycles=2,
+            revive_every_cycles=5,
+            logger=MagicMock())
+
+    def _answer(self, dtu_sn: str, probe_id: str):
+        self.engine.on_reading(DeviceIdentity(
+            name="", dtu_sn=dtu_sn, device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, device_physical_id=probe_id))
+
+    def test_polls_are_interleaved_and_frames_are_prebuilt(self):
+        self.assertEqual(self.engine.targets, [
+                         ("001", "1"), ("002", "1"), ("001", "2"), ("001", "3")])
+        self.assertEqual(self.engine.frames["1"], b'\xAA\x01\x01\x06\x00\x08\xBB')
+        asyncio.run(self.engine.run_cycle())
+        self.assertEqual([(dtu_sn, probe_id) for dtu_sn, probe_id,
+                         _ in self.sent_frames], self.engine.targets)
+        self.assertIs(self.sent_frames[0][2], self.sent_frames[1][2])
+
+    def test_skip_probe_not_answering(self):
+        async def run_test():
+            for _ in range(6):
+                self._answer("001", "1")
+                self.sent_frames.clear()
+                await self.engine.run_cycle()
+                yield [(dtu_sn, probe_id) for dtu_sn, probe_id, _ in self.sent_frames]
+                self.engine.cycle += 1
+
+        async def collect():
+            return [polled async for polled in run_test()]
+        polled_by_cycle = asyncio.run(collect())
+        self.assertEqual(len(polled_by_cycle[0]), 4)
+        self.assertEqual(len(polled_by_cycle[1]), 4)
+        # only the answering one is polled after missing 2 cycles
+        self.assertEqual(polled_by_cycle[2], [("001", "1")])
+        self.assertEqual(polled_by_cycle[4], [("001", "1")])
+        # revived in cycle 5
+        self.assertEqual(len(polled_by_cycle[5]), 4)
+
+    def test_skip_poll_while_dtu_busy(self):
+        busy_dtu_sns = set()
+
+        async def send_frame(dtu_sn, probe_id, frame):
+            self.sent_frames.append((dtu_sn, probe_id, frame))
+            # the first poll to a dtu keeps its bus busy for the rest of the cycle
+            busy_dtu_sns.add(dtu_sn)
+        self.engine.send_frame = send_frame
+        self.engine.is_dtu_busy = lambda dtu_sn: dtu_sn in busy_dtu_sns
+        self.assertEqual(asyncio.run(self.engine.run_cycle()), 2)
+        self.assertEqual([(dtu_sn, probe_id) for dtu_sn, probe_id, _ in self.sent_frames],
+                         [("001", "1"), ("002", "1")])
+        self.engine.logger.error.assert_not_called()
+
+    def test_invalid_probe_id(self):
+        with self.assertRaises(ValueError):
+            ProbePollingEngine(Probe_YiTong_TankTruck_Parser(), MagicMock(), {"001": [100]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import logging
+import queue
+import threading
+import unittest
+
+from queue_logging import NonBlockingQueueHandler, SampledLogger, TruncatedPayload, enable_queue_logging
+
+
+class _RecordingHandler(logging.Handler):
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.messages: list[str] = []
+        self.emitting_threads: set[threading.Thread] = set()
+
+    def emit(self, record):
+        self.emitting_threads.add(threading.current_thread())
+        self.messages.append(record.getMessage())
+
+
+class _FormattingCounter:
+    def __init__(self):
+        self.formatted_threads: list[threading.Thread] = []
+
+    def __str__(self):
+        self.formatted_threads.append(threading.current_thread())
+        return "counter"
+
+
+class TestTruncatedPayload(unittest.TestCase):
+
+    def test_short_payload_as_is(self):
+        self.assertEqual(str(TruncatedPayload(b"\xaa\x01")), "b'\\xaa\\x01'")
+        self.assertEqual(str(TruncatedPayload("abc")), "abc")
+        self.assertEqual(str(TruncatedPayload(None)), "None")
+
+    def test_long_payload_truncated(self):
+        self.assertEqual(str(TruncatedPayload(b"a" * 10, max_length=4)),
+                         "b'aaaa'...(10 in total)")
+
+
+class TestQueueLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger(f"{self.id()}Logger")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.listeners = []
+
+    def tearDown(self):
+        for listener in self.listeners:
+            listener.stop()
+        self.logger.handlers.clear()
+
+    def test_records_formatted_and_emitted_by_listener_thread(self):
+        target_handler = _RecordingHandler()
+        self.logger.addHandler(target_handler)
+        self.listeners = enable_queue_logging([self.logger.name])
+        self.assertEqual(len(self.listeners), 1)
+        self.assertIsInstance(self.logger.handlers[0], NonBlockingQueueHandler)
+        self.assertEqual(len(self.logger.handlers), 1)
+
+        counter = _FormattingCounter()
+        for i in range(100):
+            self.logger.info("msg %d from %s", i, counter)
+        self.listeners[0].stop()
+        self.listeners = []
+        self.assertEqual(target_handler.messages, [
+                         f"msg {i} from counter" for i in range(100)])
+        self.assertNotIn(threading.current_thread(),
+                         target_handler.emitting_threads)
+        self.assertNotIn(threading.current_thread(),
+                         counter.formatted_threads)
+
+    def test_handler_level_respected(self):
+        info_handler = _RecordingHandler(logging.INFO)
+        warning_handler = _RecordingHandler(logging.WARNING)
+        self.logger.addHandler(info_handler)
+        self.logger.addHandler(warning_handler)
+        self.listeners = enable_queue_logging([self.logger.name])
+        self.logger.debug("debug")
+        self.logger.info("info")
+        self.logger.warning("warning")
+        self.listeners[0].stop()
+        self.listeners = []
+        self.assertEqual(info_handler.messages, ["info", "warning"])
+        self.assertEqual(warning_handler.messages, ["warning"])
+
+    def test_logger_without_handler_skipped(self):
+        self.assertEqual(enable_queue_logging([self.logger.name]), [])
+        self.assertEqual(self.logger.handlers, [])
+
+    def test_records_dropped_when_queue_full(self):
+        queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=2))
+        self.logger.addHandler(queue_handler)
+        for i in range(5):
+            self.logger.info("msg %d", i)
+        self.assertEqual(queue_handler.queue.qsize(), 2)
+        self.assertEqual(queue_handler.dropped_record_count, 3)
+        # not formatted in the logging thread
+        record = queue_handler.queue.get_nowait()
+        self.assertEqual((record.msg, record.args), ("msg %d", (0,)))
+
+
+class TestSampledLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.logger = logging.getLogger(f"{self.id()}Logger")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = _RecordingHandler()
+        self.logger.addHandler(self.handler)
+        self.sampled_logger = SampledLogger(
+            self.logger, window_s=60, max_logged_count_per_window=2, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.logger.handlers.clear()
+
+    def test_suppressed_per_key_and_summarized(self):
+        logged = [self.sampled_logger.log(logging.WARNING, "dtu 001", "unparsed msgs", "bad msg %d", i)
+                  for i in range(100)]
+        self.assertEqual(logged, [True, True] + [False] * 98)
+        # other keys and subjects have their own budget
+        self.assertTrue(self.sampled_logger.log(
+            logging.WARNING, "dtu 002", "unparsed msgs", "bad msg"))
+        self.assertTrue(self.sampled_logger.log(
+            logging.WARNING, "dtu 001", "msgs buffered for reassembling", "buffered"))
+        self.assertEqual(self.handler.messages, [
+                         "bad msg 0", "bad msg 1", "bad msg", "buffered"])
+
+        self.now = 61
+        self.assertTrue(self.sampled_logger.log(
+            logging.WARNING, "dtu 001", "unparsed msgs", "bad msg again"))
+        # only the windows with suppressed records are summarized
+        self.assertEqual(self.handler.messages[4:], [
+                         "dtu 001: 100 unparsed msgs in last 60s, 2 logged", "bad msg again"])
+
+    def test_quiet_key_summarized_by_sweep(self):
+        for _ in range(5):
+            self.sampled_logger.log(
+                logging.WARNING, "dtu 001", "unparsed msgs", "bad msg")
+        self.now = 130
+        self.sampled_logger.log(
+            logging.WARNING, "dtu 002", "unparsed msgs", "bad msg")
+        self.assertIn("dtu 001: 5 unparsed msgs in last 60s, 2 logged",
+                      self.handler.messages)
+
+    def test_flush_summaries(self):
+        for _ in range(3):
+            self.sampled_logger.log(
+                logging.WARNING, "dtu 001", "unparsed msgs", "bad msg")
+        self.sampled_logger.flush_summaries()
+        self.assertEqual(self.handler.messages[-1],
+                         "dtu 001: 3 unparsed msgs in last 60s, 2 logged")
+
+    def test_disabled_level_not_counted(self):
+        self.assertFalse(self.sampled_logger.log(
+            logging.DEBUG, "dtu 001", "msgs buffered for reassembling", "buffered"))
+        self.sampled_logger.flush_summaries()
+        self.assertEqual(self.handler.messages, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+import unittest
+from device.reply_waiter import DeviceReplyWaiter
+from models import DEVICE_TYPE, DeviceIdentity
+
+
+class TestDeviceReplyWaiter(unittest.TestCase):
+
+    def setUp(self):
+        self.waiter = DeviceReplyWaiter()
+        self.request_identity = DeviceIdentity(
+            name="", dtu_sn="001", device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, device_physical_id="01")
+        self.reply_identity = DeviceIdentity(
+            name="Probe_YiTong_TankTruck__001__01", dtu_sn="001",
+            device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, device_physical_id="1")
+
+    def test_resolve_from_other_thread(self):
+        async def run_test():
+            future = self.waiter.expect_reply(self.request_identity)
+            other_identity = self.reply_identity.model_copy(
+                update={"device_physical_id": "2"})
+            threading.Thread(target=lambda: (
+                self.waiter.resolve(other_identity, {"data": {"M1": 2}}),
+                self.waiter.resolve(self.reply_identity, {"data": {"M1": 1}}))).start()
+            data_record = await asyncio.wait_for(future, 1)
+            self.assertEqual(data_record, {"data": {"M1": 1}})
+        asyncio.run(run_test())
+
+    def test_discard(self):
+        async def run_test():
+            future = self.waiter.expect_reply(self.request_identity)
+            self.waiter.discard(self.request_identity, future)
+            self.assertEqual(self.waiter.resolve(
+                self.reply_identity, {"data": {}}), 0)
+            self.assertFalse(future.done())
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from device.simple_mqtt_client import SimpleMqttClient
+
+
+class TestSimpleMqttClientRequest(unittest.TestCase):
+
+    def setUp(self):
+        self.on_message_callback = MagicMock()
+        self.client = SimpleMqttClient(
+            name="TestSimpleMqttClient", on_message_callback=self.on_message_callback, logger=MagicMock())
+        self.client.client = MagicMock()
+        self.client.client.is_connected.return_value = True
+        self.reply_timers: list[threading.Timer] = []
+
+        def publish(topic, msg, *args, **kwargs):
+            # the remote peer echoes the request to its outbox in MQTT client thread
+            if topic.endswith("/inbox"):
+                reply_timer = threading.Timer(0.05, self.client._on_message, args=(None, None, SimpleNamespace(
+                    topic=topic.replace("inbox", "outbox"), payload=b"reply:" + msg)))
+                self.reply_timers.append(reply_timer)
+                reply_timer.start()
+        self.client.client.publish.side_effect = publish
+
+    def test_send_request_async(self):
+        async def run_test():
+            responses = await asyncio.gather(*[self.client.send_request_async(
+                f"dtu/{i}/inbox", f"dtu/{i}/outbox", f"{i}".encode(),
+                lambda req, resp, context: resp == b"reply:" + req, 1000) for i in range(20)])
+            self.assertEqual(responses, [f"reply:{i}".encode()
+                             for i in range(20)])
+            self.assertEqual(self.client._pending_requests_by_topic, {})
+        asyncio.run(run_test())
+        # the response is still handed to the on_message callbacks, after resolving the request
+        for reply_timer in self.reply_timers:
+            reply_timer.join()
+        self.assertEqual(self.on_message_callback.call_count, 20)
+
+    def test_send_request_async_timeout(self):
+        async def run_test():
+            response = await self.client.send_request_async(
+                "dtu/1/inbox", "dtu/1/outbox", b"1", lambda req, resp, context: False, 200)
+            self.assertIsNone(response)
+            self.assertEqual(self.client._pending_requests_by_topic, {})
+        asyncio.run(run_test())
+
+    def test_send_request(self):
+        response = self.client.send_request(
+            "dtu/1/inbox", "dtu/1/outbox", b"1", lambda req, resp, context: True, 1000)
+        self.assertEqual(response, b"reply:1")
+        self.assertEqual(self.client._pending_requests_by_topic, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import threading
+import unittest
+from unittest.mock import patch
+
+from device.telemetry_broadcaster import TelemetryBroadcaster
+from models import DEVICE_TYPE, DeviceIdentity
+
+
+class TestTelemetryBroadcaster(unittest.TestCase):
+
+    def setUp(self):
+        self.broadcaster = TelemetryBroadcaster()
+        self.gps_identity = DeviceIdentity(
+            name="GenericTimelyReportGpsDtuDevice__001", dtu_sn="001", device_type=DEVICE_TYPE.DTU)
+        self.probe_identity = DeviceIdentity(
+            name="Probe_YiTong_TankTruck__002__1", dtu_sn="002",
+            device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, device_physical_id="1")
+
+    def test_published_from_other_thread_to_matched_subscriptions(self):
+        async def run_test():
+            all_subscription = self.broadcaster.subscribe()
+            dtu_subscription = self.broadcaster.subscribe(dtu_sn="002")
+            probe_subscription = self.broadcaster.subscribe(
+                device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, device_physical_id="2")
+            self.assertEqual(len(self.broadcaster), 3)
+            publishing_thread = threading.Thread(target=lambda: (
+                self.broadcaster.publish(
+                    self.gps_identity, {"data": {"纬度": 29.1}}),
+                self.broadcaster.publish(self.probe_identity, {"data": {"M1": 1}})))
+            publishing_thread.start()
+            received = [json.loads(await asyncio.wait_for(all_subscription.get(), 1)) for _ in range(2)]
+            self.assertEqual([message["data_record"]["data"] for message in received], [
+                             {"纬度": 29.1}, {"M1": 1}])
+            self.assertEqual(received[1]["device_identity"]["dtu_sn"], "002")
+            message = json.loads(await asyncio.wait_for(dtu_subscription.get(), 1))
+            self.assertEqual(message["data_record"]["data"], {"M1": 1})
+            publishing_thread.join()
+            await asyncio.sleep(0)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(dtu_subscription.get(), 0.05)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(probe_subscription.get(), 0.05)
+        asyncio.run(run_test())
+
+    def test_oldest_dropped_for_slow_subscription(self):
+        async def run_test():
+            subscription = self.broadcaster.subscribe(max_queued_count=2)
+            for i in range(5):
+                self.broadcaster.publish(self.probe_identity, {"data": {"M1": i}})
+            await asyncio.sleep(0)
+            self.assertEqual(subscription.dropped_count, 3)
+            self.assertEqual([json.loads(await subscription.get())["data_record"]["data"]["M1"] for _ in range(2)],
+                             [3, 4])
+        asyncio.run(run_test())
+
+    def test_not_encoded_without_subscription(self):
+        async def run_test():
+            subscription = self.broadcaster.subscribe(dtu_sn="003")
+            self.broadcaster.unsubscribe(subscription)
+            self.assertEqual(len(self.broadcaster), 0)
+            with patch("device.telemetry_broadcaster.to_json") as to_json:
+                self.broadcaster.publish(self.probe_identity, {"data": {"M1": 1}})
+                to_json.assert_not_called()
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+from device.data_record_history import DataRecordHistory
+from device.protocol_parser.parser import GenericTimelyReportGpsDtuDeviceParser, Probe_YiTong_TankTruck_Parser
+from device.telemetry_journal import TelemetryJournal
+from models import DEVICE_TYPE, DeviceIdentity
+
+PROBE_MSG = bytes.fromhex("aa0101020179589999990011470209960991099912bb")
+GPS_MSG = b"$GNRMC,111700.00,A,2906.78084,N,11207.29890,E,0.114,,111125,,,A,V*10"
+
+
+class TestTelemetryJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.parsers = {parser.__class__.__name__: parser for parser in [
+            Probe_YiTong_TankTruck_Parser(), GenericTimelyReportGpsDtuDeviceParser()]}
+        self.journals: list[TelemetryJournal] = []
+
+    def tearDown(self):
+        for journal in self.journals:
+            journal.stop()
+        self.temp_dir.cleanup()
+
+    def _create_journal(self, **kwargs) -> TelemetryJournal:
+        journal = TelemetryJournal(
+            self.temp_dir.name, logger=MagicMock(), **kwargs)
+        self.journals.append(journal)
+        return journal
+
+    def _restart(self) -> tuple[TelemetryJournal, dict[tuple, DataRecordHistory]]:
+        """stop the running journals, and replay into a new one"""
+        for journal in self.journals:
+            journal.stop()
+        histories: dict[tuple, DataRecordHistory] = {}
+
+        def restore_history(device_identity: DeviceIdentity, parser_name: str):
+            if parser_name not in self.parsers:
+                return None
+            history = histories[device_identity.identity_key(
+            )] = self.parsers[parser_name].create_data_record_history()
+            return history
+        journal = self._create_journal()
+        journal.replay(restore_history)
+        return journal, histories
+
+    def _append_msgs(self, journal: TelemetryJournal, histories: dict, count: int, start_index: int = 0) -> None:
+        received_datetime = datetime(2025, 11, 11, tzinfo=timezone.utc)
+        for i in range(start_index, start_index + count):
+            for parser_name, topic, msg in [("Probe_YiTong_TankTruck_Parser", f"dtu/00{i % 3}/outbox", PROBE_MSG),
+                                            ("GenericTimelyReportGpsDtuDeviceParser", "dtu/001/outbox", GPS_MSG)]:
+                parser = self.parsers[parser_name]
+                device_identity, data_record = parser.TryParse(topic, msg)
+                data_record["received_datetime"] = received_datetime + \
+                    timedelta(seconds=i)
+                history = histories.get(device_identity.identity_key())
+                if history is None:
+                    history = histories[device_identity.identity_key(
+                    )] = parser.create_data_record_history()
+                history.append(data_record)
+                journal.append(device_identity, parser_name,
+                               history, data_record)
+
+    @staticmethod
+    def _to_lists(histories: dict) -> dict:
+        return {key: history.to_list() for key, history in histories.items()}
+
+    def test_replay_after_restart(self):
+        journal = self._create_journal()
+        journal.start()
+        histories = {}
+        self._append_msgs(journal, histories, 10)
+
+        _, replayed_histories = self._restart()
+        self.assertEqual(len(replayed_histories), 4)
+        self.assertEqual(self._to_lists(replayed_histories),
+                         self._to_lists(histories))
+
+    def test_replay_after_several_restarts(self):
+        journal = self._create_journal()
+        journal.start()
+        histories = {}
+        self._append_msgs(journal, histories, 10)
+        journal, histories = self._restart()
+        journal.start()
+        self._append_msgs(journal, histories, 10, start_index=10)
+        self.assertEqual(len(histories), 4)
+
+        _, replayed_histories = self._restart()
+        self.assertEqual(self._to_lists(replayed_histories),
+                         self._to_lists(histories))
+
+    def test_snapshot_bounds_replay(self):
+        journal = self._create_journal()
+        journal.start()
+        histories = {}
+        # beyond the history capacity, which the snapshot is bounded to
+        self._append_msgs(journal, histories, 150)
+        journal.take_snapshot()
+        self._append_msgs(journal, histories, 5, start_index=150)
+
+        file_names = sorted(os.listdir(self.temp_dir.name))
+        self.assertEqual(file_names, [
+                         "journal-00000002.bin", "snapshot-00000002.bin"])
+        _, replayed_histories = self._restart()
+        self.assertEqual(self._to_lists(replayed_histories),
+                         self._to_lists(histories))
+
+    def test_snapshot_after_restart(self):
+        journal = self._create_journal()
+        journal.start()
+        histories = {}
+        self._append_msgs(journal, histories, 10)
+        journal, histories = self._restart()
+        journal.start()
+        # the device indexes of the previous run are remapped in the compacted snapshot
+        self._append_msgs(journal, histories, 5, start_index=10)
+        journal.take_snapshot()
+
+        _, replayed_histories = self._restart()
+        self.assertEqual(self._to_lists(replayed_histories),
+                         self._to_lists(histories))
+
+    def test_snapshot_while_appending_from_threads(self):
+        journal = self._create_journal(commit_interval_ms=1)
+        journal.start()
+        histories_list = [{} for _ in range(3)]
+
+        def append_msgs(thread_index: int):
+            parser = self.parsers["Probe_YiTong_TankTruck_Parser"]
+            histories = histories_list[thread_index]
+            for i in range(200):
+                device_identity, data_record = parser.TryParse(
+                    f"dtu/10{thread_index}/outbox", PROBE_MSG)
+                history = histories.get(device_identity.identity_key())
+                if history is None:
+                    history = histories[device_identity.identity_key(
+                    )] = parser.create_data_record_history()
+                data_record["received_datetime"] = datetime(
+                    2025, 11, 11, tzinfo=timezone.utc) + timedelta(seconds=i)
+                history.append(data_record)
+                journal.append(device_identity, "Probe_YiTong_TankTruck_Parser",
+                               history, data_record)
+        threads = [threading.Thread(target=append_msgs, args=(i,))
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for _ in range(5):
+            journal.take_snapshot()
+        for thread in threads:
+            thread.join()
+
+        _, replayed_histories = self._restart()
+        self.assertEqual(self._to_lists(replayed_histories),
+                         {key: history.to_list() for histories in histories_list for key, history in histories.items()})
+
+    def test_group_commit(self):
+        journal = self._create_journal(commit_interval_ms=10)
+        journal.start()
+        self._append_msgs(journal, {}, 1)
+        segment_file_name = os.path.join(
+            self.temp_dir.name, "journal-00000001.bin")
+        deadline = time.monotonic() + 5
+        while os.path.getsize(segment_file_name) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertGreater(os.path.getsize(segment_file_name), 0)
+
+    def test_torn_tail_skipped(self):
+        journal = self._create_journal()
+        journal.start()
+        histories = {}
+        self._append_msgs(journal, histories, 3)
+        journal.stop()
+        with open(os.path.join(self.temp_dir.name, "journal-00000001.bin"), "ab") as f:
+            f.write(b"\x20\x00\x00\x00\x01\x02")
+
+        _, replayed_histories = self._restart()
+        self.assertEqual(self._to_lists(replayed_histories),
+                         self._to_lists(histories))
+
+    def test_device_of_unknown_parser_skipped(self):
+        journal = self._create_journal()
+        journal.start()
+        histories = {}
+        self._append_msgs(journal, histories, 3)
+        del self.parsers["GenericTimelyReportGpsDtuDeviceParser"]
+
+        _, replayed_histories = self._restart()
+        self.assertEqual(
+            {key[1] for key in replayed_histories}, {DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import json
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+from device.telemetry_republisher import TelemetryRepublisher
+from models import DEVICE_TYPE, DeviceIdentity
+
+
+class TestTelemetryRepublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.published: list[tuple[str, list, int]] = []
+        self.publish_result = True
+        self.published_event = threading.Event()
+        self.gps_identity = DeviceIdentity(
+            name="GenericTimelyReportGpsDtuDevice__001", dtu_sn="001", device_type=DEVICE_TYPE.DTU)
+        self.probe_identity = DeviceIdentity(
+            name="Probe_YiTong_TankTruck__001__1", dtu_sn="001",
+            device_type=DEVICE_TYPE.SUB_DEVICE__Probe_YiTong_TankTruck, device_physical_id="1")
+        self.received_datetime = datetime(2025, 11, 11, tzinfo=timezone.utc)
+        self.republishers: list[TelemetryRepublisher] = []
+
+    def tearDown(self):
+        for republisher in self.republishers:
+            republisher.stop()
+
+    def _publish(self, topic: str, payload: bytes, qos: int) -> bool:
+        if self.publish_result:
+            self.published.append((topic, json.loads(payload), qos))
+            self.published_event.set()
+        return self.publish_result
+
+    def _create_republisher(self, **kwargs) -> TelemetryRepublisher:
+        republisher = TelemetryRepublisher(
+            self._publish, logger=MagicMock(), **kwargs)
+        self.republishers.append(republisher)
+        return republisher
+
+    def _submit(self, republisher: TelemetryRepublisher, device_identity: DeviceIdentity, m1: int) -> None:
+        republisher.submit(device_identity, {"received_datetime": self.received_datetime + timedelta(seconds=m1),
+                                             "data": {"M1": m1}})
+
+    def test_topics_and_normalized_records(self):
+        republisher = self._create_republisher(qos=1)
+        self._submit(republisher, self.gps_identity, 1)
+        self._submit(republisher, self.probe_identity, 2)
+        republisher.flush()
+        self.assertEqual(self.published, [
+            ("dtu_hub/001/DTU/001", [{"dtu_sn": "001", "device_type": "DTU", "device_physical_id": None,
+                                      "received_datetime": "2025-11-11T00:00:01Z", "data": {"M1": 1}}], 1),
+            ("dtu_hub/001/Probe_YiTong_TankTruck/1", [{"dtu_sn": "001", "device_type": "Probe_YiTong_TankTruck",
+                                                       "device_physical_id": "1", "received_datetime": "2025-11-11T00:00:02Z",
+                                                       "data": {"M1": 2}}], 1)])
+
+    def test_latest_coalesced(self):
+        republisher = self._create_republisher()
+        for i in range(5):
+            self._submit(republisher, self.probe_identity, i)
+        republisher.flush()
+        self.assertEqual([[record["data"]["M1"] for record in records] for _, records, _ in self.published], [[4]])
+        self.assertEqual(republisher.coalesced_count, 4)
+
+    def test_batched_without_coalescing(self):
+        republisher = self._create_republisher(
+            coalesce_latest=False, max_batch_size=3)
+        for i in range(5):
+            self._submit(republisher, self.probe_identity, i)
+        republisher.flush()
+        self.assertEqual([[record["data"]["M1"] for record in records] for _, records, _ in self.published],
+                         [[0, 1, 2], [3, 4]])
+
+    def test_kept_while_disconnected_or_failed(self):
+        connected = False
+        republisher = self._create_republisher(
+            coalesce_latest=False, is_connected=lambda: connected)
+        self._submit(republisher, self.probe_identity, 1)
+        republisher.flush()
+        self.assertEqual(self.published, [])
+        connected = True
+        self.publish_result = False
+        republisher.flush()
+        self.assertEqual(republisher.failed_count, 1)
+        self.publish_result = True
+        self._submit(republisher, self.probe_identity, 2)
+        republisher.flush()
+        self.assertEqual([[record["data"]["M1"] for record in records] for _, records, _ in self.published], [[1, 2]])
+
+    def test_dropped_beyond_max_pending_count(self):
+        republisher = self._create_republisher(
+            coalesce_latest=False, max_pending_count=2)
+        for i in range(5):
+            self._submit(republisher, self.probe_identity, i)
+        self.assertEqual(republisher.dropped_count, 3)
+
+    def test_published_by_background_thread(self):
+        republisher = self._create_republisher(batch_interval_ms=10)
+        republisher.start()
+        self._submit(republisher, self.probe_identity, 1)
+        self.assertTrue(self.published_event.wait(5))
+        self._submit(republisher, self.gps_identity, 2)
+        republisher.stop()
+        self.assertEqual(len(self.published), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()